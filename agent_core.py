@@ -5,19 +5,35 @@ import time
 import base64
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
-import hashlib
 import html2text
 import api_clients
 import utils
 import browser_controller
 import planner_client
+import page_scanner
+import page_fingerprint
+import skill_cache
+import som_renderer
+import profiler
 import io              
 import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from PIL import Image  
-from memory_manager import MemoryManager
+from memory_manager import get_shared_memory_manager
+from element_map import ElementMap, dedupe_elements, rank_elements
+from config import (FULL_PAGE_PERCEPTION, SKILL_REPLAY_ENABLED, SKILL_CAPTURE_ENABLED, SKILL_MAX_STEPS, RETRIEVAL_POOL_WORKERS, PLANNER_POOL_WORKERS,
+                    TASK_START_RAG_WAIT, TASK_START_PLAN_WAIT, REPLAN_SIGNAL_THRESHOLD, REPLAN_WAIT_TIMEOUT,
+                    ELEMENT_PROMPT_LIMIT)
+
+PAGE_CONTENT_BUDGET = 3000 # 頁面文字的字數上限 (控制 Token)
+
+# [New] 背景工作的執行緒池 (RAG 檢索、Planner 呼叫都是 I/O bound，不佔 Agent 主迴圈)
+# [Updated] RAG 與 Planner 分開：Planner 一次可能跑到 60 秒，平行模式下會把 RAG 擠到 TASK_START_RAG_WAIT 之後
+_RETRIEVAL_POOL = ThreadPoolExecutor(max_workers=RETRIEVAL_POOL_WORKERS, thread_name_prefix="AgentRetrieval")
+_PLANNER_POOL = ThreadPoolExecutor(max_workers=PLANNER_POOL_WORKERS, thread_name_prefix="AgentPlanner")
 
 class AgentCore:
-    def __init__(self, driver, logger = None):
+    def __init__(self, driver, logger = None, memory_manager = None):
         self.driver = driver
         self.history = []          
         self.max_history_len = 10  
@@ -27,26 +43,50 @@ class AgentCore:
         self.current_plan = "" #儲存當前計畫
         self.scratchpad = {} # [New] 短期記憶筆記本 (Key-Value)
         # 狀態追蹤
-        self.last_page_hash = ""
+        self.last_fingerprint = None # [Updated] 上一步的頁面指紋 (page_fingerprint.PageFingerprint)
         self.same_state_action_count = 0
         self.cached_elements_map = None
+        self.cached_fingerprint = None # 元素快取建立當下的頁面指紋
         self.cached_img_size = None
-        try:
-            self.memory_manager = MemoryManager()
-            print("✅ [Core] RAG 記憶模組連線成功")
-        except Exception:
-            self.memory_manager = None
+        self.page_map = None # [New] Full-Page 元素地圖 (文件座標)
+        self._page_content_cache = None # (頁面指紋, 文字)
+        # [Updated] 預設使用行程內共用的記憶服務 (可由外部注入)
+        self.memory_manager = memory_manager
+        if self.memory_manager is None:
+            try:
+                self.memory_manager = get_shared_memory_manager()
+                print("✅ [Core] RAG 記憶模組連線成功")
+            except Exception:
+                self.memory_manager = None
         self.rag_data = None
+        self.task_site = "" # [New] 任務所在網域 (記憶寫入/檢索時的 site 過濾)
+        self.task_start_url = None
+        self.current_fingerprint = None # 本步感知時的頁面指紋 (Skill 錄製用)
+        # [New] Skill 快取：錄製成功任務的動作序列，相似任務直接重播
+        self.skill_store = skill_cache.get_shared_skill_store() if SKILL_REPLAY_ENABLED else None
+        self.skill_trace = []
+        self.skill_replay = None
+        # [New] 任務啟動時送到背景的 RAG 檢索 / 初始規劃 (第一次呼叫大腦前才收回)
+        self.rag_future = None
+        self.plan_future = None
+        self.context_waited = False # 只在第一次呼叫大腦前等待一次，之後晚到的結果不阻塞
+        # [New] 預先重新規劃：出現卡關徵兆就在背景呼叫 replan_task，不等迴圈偵測觸發
+        self.stagnation_signals = []
+        self.replan_future = None
+        self.replan_stats = {"speculative": 0, "adopted": 0, "discarded": 0}
+        # [New] 延遲剖析：這一步寫進 Log 的 entry 與 analyze 的回傳指令 (動作執行完才補上 timings)
+        self._step_log_entry = None
+        self._step_command = None
+        self.som_renderer = som_renderer.SoMRenderer() # [New] 字型 / 標籤快取，畫面未變時不重畫
 
-    def _get_page_hash(self):
-        """計算當前頁面的狀態指紋 (URL + DOM 前 1000 字)"""
-        try:
-            dom_sample = self.driver.find_element("tag name", "body").text[:1000]
-            raw_data = f"{self.driver.current_url}-{dom_sample}"
-            return hashlib.md5(raw_data.encode('utf-8')).hexdigest()
-        except:
-            return "unknown_state"
+    def _capture_fingerprint(self):
+        """
+        [Updated] 計算當前頁面的狀態指紋 (結構 + 全頁文字 + 捲動位置)
+        取代舊版的 URL + Body 前 1000 字：視窗外、Dialog 與屬性變化也能偵測到。
+        """
+        return page_fingerprint.capture_fingerprint(self.driver)
 
+    @profiler.profiled("a11y")
     def _extract_a11y_tree(self):
         """
         [New] 提取簡易版無障礙樹 (Accessibility Tree)
@@ -108,54 +148,111 @@ class AgentCore:
         except:
             return ""
 
-    def _extract_page_content(self):
+    @profiler.profiled("page_text")
+    def _extract_page_content(self, cache_key=None):
+        """
+        [Updated] 抽取視窗附近的可見文字。
+        cache_key: 頁面指紋 (含捲動位置)；與上次相同時直接回傳快取，不再跑 JS。
+        """
+        if cache_key is not None and self._page_content_cache and self._page_content_cache[0] == cache_key:
+            print("🚀 [Cache] 頁面文字未變，沿用上次提取結果。")
+            return self._page_content_cache[1]
+        content = self._extract_page_content_uncached()
+        if cache_key is not None:
+            self._page_content_cache = (cache_key, content)
+        return content
+
+    def _extract_page_content_uncached(self):
         try:
             # === Plan A: 抓取 Viewport 可見文字 (解決捲動後讀不到的問題) ===
-            # 這段 JS 會過濾掉 display:none 以及 跑出螢幕範圍外的元素
+            # [Optimized] 整棵隱藏子樹直接 REJECT、可見性以父元素為單位快取、
+            # 用 checkVisibility 取代 getComputedStyle，並在達到字數上限時提早結束。
             js_script = """
-            function getVisibleText() {
+            function getVisibleText(budget) {
+                // 我們稍微放寬範圍 (擴大 500px)，確保不會切斷邊緣資訊
+                var viewTop = -500;
+                var viewBottom = window.innerHeight + 500;
+                var SKIP_TAGS = {SCRIPT: 1, STYLE: 1, NOSCRIPT: 1, TEMPLATE: 1, SVG: 1, CANVAS: 1, IFRAME: 1};
+                var BLOCK_TAGS = {H1: 1, H2: 1, H3: 1, BUTTON: 1, A: 1, LI: 1};
+                var hasCheckVisibility = typeof Element.prototype.checkVisibility === 'function';
+                var memo = new Map(); // parent element -> 是否可見且在 Viewport 內
+
+                // display: contents 的元素本身沒有 box (checkVisibility 為 false、rect 全 0)，但子孫照常顯示
+                function isDisplayContents(el) {
+                    return window.getComputedStyle(el).display === 'contents';
+                }
+
+                function isParentVisible(el) {
+                    var cached = memo.get(el);
+                    if (cached !== undefined) return cached;
+                    var ok;
+                    if (hasCheckVisibility) {
+                        ok = el.checkVisibility({checkOpacity: true, checkVisibilityCSS: true});
+                        if (!ok && isDisplayContents(el)) {
+                            // 改用最近一個有 box 的祖先判斷 (可見性與位置)
+                            ok = el.parentElement ? isParentVisible(el.parentElement) : false;
+                            memo.set(el, ok);
+                            return ok;
+                        }
+                    } else {
+                        var style = window.getComputedStyle(el);
+                        if (style.display === 'contents') {
+                            ok = el.parentElement ? isParentVisible(el.parentElement) : false;
+                            memo.set(el, ok);
+                            return ok;
+                        }
+                        ok = style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0';
+                    }
+                    if (ok) {
+                        var rect = el.getBoundingClientRect();
+                        ok = rect.bottom >= viewTop && rect.top <= viewBottom;
+                    }
+                    memo.set(el, ok);
+                    return ok;
+                }
+
                 var walker = document.createTreeWalker(
-                    document.body, 
-                    NodeFilter.SHOW_TEXT, 
-                    null, 
-                    false
+                    document.body,
+                    NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT,
+                    {
+                        acceptNode: function(node) {
+                            if (node.nodeType === 1) {
+                                if (SKIP_TAGS[node.tagName.toUpperCase()]) return NodeFilter.FILTER_REJECT;
+                                // display:none 的整棵子樹都不可見，直接跳過 (不逐一檢查子孫)
+                                // display:contents 同樣沒有 box，但子孫可見 -> 只略過自己，繼續走訪子孫
+                                if (hasCheckVisibility && !node.checkVisibility() && !isDisplayContents(node)) return NodeFilter.FILTER_REJECT;
+                                return NodeFilter.FILTER_SKIP;
+                            }
+                            return NodeFilter.FILTER_ACCEPT;
+                        }
+                    }
                 );
+
                 var node;
                 var textLines = [];
-                
-                while(node = walker.nextNode()) {
+                var total = 0;
+                while ((node = walker.nextNode())) {
+                    var txt = node.nodeValue.trim();
+                    if (txt.length === 0) continue;
                     var parent = node.parentNode;
-                    var style = window.getComputedStyle(parent);
-                    
-                    // 1. 過濾隱藏元素
-                    if (style && style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0') {
-                        var rect = parent.getBoundingClientRect();
-                        
-                        // 2. [核心] 檢查是否在 Viewport (視窗) 內
-                        // 我們稍微放寬範圍 (擴大 500px)，確保不會切斷邊緣資訊
-                        if (rect.bottom >= -500 && rect.top <= (window.innerHeight + 500)) {
-                            var txt = node.nodeValue.trim();
-                            if (txt.length > 0) {
-                                // 嘗試保留一點結構 (如果是標題或區塊，加換行)
-                                if (['H1','H2','H3','BUTTON','A','LI'].includes(parent.tagName)) {
-                                    textLines.push("[" + parent.tagName + "] " + txt);
-                                } else {
-                                    textLines.push(txt);
-                                }
-                            }
-                        }
-                    }
+                    if (!parent || parent.nodeType !== 1 || !isParentVisible(parent)) continue;
+
+                    // 嘗試保留一點結構 (如果是標題或區塊，加換行)
+                    var line = BLOCK_TAGS[parent.tagName] ? "[" + parent.tagName + "] " + txt : txt;
+                    textLines.push(line);
+                    total += line.length + 1;
+                    if (total >= budget) break; // 已達字數上限，提早結束
                 }
                 return textLines.join('\\n');
             }
-            return getVisibleText();
+            return getVisibleText(arguments[0]);
             """
             
-            visible_text = self.driver.execute_script(js_script)
+            visible_text = self.driver.execute_script(js_script, PAGE_CONTENT_BUDGET)
             
             if visible_text and len(visible_text) > 50:
                 # 成功抓到視窗內容
-                return visible_text[:3000] # 限制 Token
+                return visible_text[:PAGE_CONTENT_BUDGET] # 限制 Token
             
             else:
                 # 如果 JS 抓不太到 (例如 Canvas 或是 Shadow DOM)，進入 Plan B
@@ -177,38 +274,133 @@ class AgentCore:
                 lines = [line.strip() for line in markdown_content.splitlines()]
                 clean_content = "\n".join([line for line in lines if line])
                 
-                return clean_content[:3000]
+                return clean_content[:PAGE_CONTENT_BUDGET]
             except:
                 return self.driver.execute_script("return document.body.innerText")[:2000]
         
-    def start_new_task(self, goal: str):
-        """ 初始化任務並檢索記憶 """
+    def start_new_task(self, goal: str, start_url: str = None):
+        """
+        初始化任務並檢索記憶
+        start_url: 任務的起始網址 (未提供時使用瀏覽器目前的網址)，用於同網站記憶優先
+        [Updated] 立即返回：可在導航之前呼叫，RAG / Planner 與頁面載入同時進行
+        """
         self.user_goal = goal
+        try:
+            self.task_start_url = start_url or self.driver.current_url
+        except Exception:
+            self.task_start_url = start_url
+        self.task_site = utils.extract_site(self.task_start_url)
         self.history = []
         self.current_plan = ""
         self.scratchpad = {} # 每次新任務要清空
+        self.skill_trace = []
+        self.skill_replay = None
         print(f"🚀 [Core] 啟動新任務: {goal}")
+        if self.skill_store:
+            skill = self.skill_store.find_skill(goal, self.task_site, self.task_start_url)
+            if skill:
+                self.skill_replay = skill_cache.SkillReplay(skill, goal)
+        # [Updated] RAG 檢索與初始規劃改在背景執行，與導航、第一次截圖 / OmniParser 重疊；
+        # analyze_next_step 在呼叫大腦前才等待結果 (_collect_task_context)
+        self.rag_data = None
+        self.rag_future = None
+        self.context_waited = False
+        self.stagnation_signals = []
+        self.replan_future = None
+        self.replan_stats = {"speculative": 0, "adopted": 0, "discarded": 0}
+        # [New] 延遲剖析：這一步寫進 Log 的 entry 與 analyze 的回傳指令 (動作執行完才補上 timings)
+        self._step_log_entry = None
+        self._step_command = None
         if self.memory_manager:
-            try:
-                self.rag_data = self.memory_manager.retrieve_relevant_memory(goal)
-                print(f"[Core] 新任務: {goal}")
-                if self.rag_data.get('success_path'): 
-                    print("📚 [Memory] 已載入過去的成功策略！")
-            except: pass
+            self.rag_future = _RETRIEVAL_POOL.submit(self.memory_manager.retrieve_relevant_memory, goal, site=self.task_site)
+        self.plan_future = _PLANNER_POOL.submit(planner_client.generate_plan, goal, site=self.task_site)
+
+    @staticmethod
+    def _poll_future(future, timeout):
+        """ 回傳 (是否已結束, 結果)；背景工作拋出例外視為已結束、沒有結果 """
         try:
-            generated_plan = planner_client.generate_plan(goal)
-            if generated_plan:
-                self.current_plan = generated_plan
-                # 將計畫加入歷史紀錄，讓 Executor 一開始就知道全貌
-                self.history.append(f"System Plan: {generated_plan}")
+            return True, future.result(timeout=timeout)
+        except FutureTimeout:
+            return False, None
         except Exception as e:
-            print(f"⚠️ Planner 呼叫失敗，將依賴 Executor 即興發揮: {e}")
+            print(f"⚠️ [Core] 背景工作失敗: {e}")
+            return True, None
+
+    def _collect_task_context(self, rag_timeout=0, plan_timeout=0):
+        """
+        [New] 收回背景的 RAG / 初始計畫。timeout=0 時只取已完成的結果 (不阻塞)。
+        計畫晚到時直接替換暫定計畫，並寫入歷史讓大腦知道。
+        """
+        if self.context_waited:
+            rag_timeout = plan_timeout = 0
+        elif rag_timeout or plan_timeout:
+            self.context_waited = True
+        if self.rag_future is not None:
+            done, rag_data = self._poll_future(self.rag_future, rag_timeout)
+            if done:
+                self.rag_future = None
+                self.rag_data = rag_data
+                if rag_data and rag_data.get('success_path'):
+                    print("📚 [Memory] 已載入過去的成功策略！")
+
+        if self.plan_future is not None:
+            start_time = time.time()
+            done, generated_plan = self._poll_future(self.plan_future, plan_timeout)
+            if done:
+                self.plan_future = None
+                if generated_plan:
+                    late = bool(self.current_plan)
+                    self.current_plan = generated_plan
+                    # 將計畫加入歷史紀錄，讓 Executor 知道全貌
+                    self.history.append(f"System: Plan Updated (planner finished). New Plan: {generated_plan}" if late
+                                        else f"System Plan: {generated_plan}")
+                    if late: print("📋 [Planner] 正式計畫已送達，取代暫定計畫。")
+                else:
+                    print("⚠️ Planner 沒有回傳計畫，將依賴 Executor 即興發揮")
+            elif plan_timeout and not self.current_plan:
+                # 規劃還沒好：先用過去同類任務的成功路徑當暫定計畫，不讓大腦空等推理模型
+                success_path = (self.rag_data or {}).get('success_path')
+                if success_path:
+                    self.current_plan = f"(Provisional, from a past success on a similar goal) {success_path[:1500]}"
+                print(f"⏳ [Planner] 等待 {time.time() - start_time:.1f}s 仍未完成，先以{'暫定計畫' if success_path else '無計畫'}繼續。")
+
+    def _note_stagnation(self, signal: str):
+        """ [New] 記錄一個卡關徵兆；累積到門檻就在背景開始重新規劃 (不阻塞目前這一步) """
+        self.stagnation_signals.append(signal)
+        if len(self.stagnation_signals) < REPLAN_SIGNAL_THRESHOLD or self.replan_future is not None: return
+        try:
+            current_url = self.driver.current_url
+        except Exception:
+            current_url = ""
+        current_state_desc = (f"Stuck at URL: {current_url}. Warning signs: {self.stagnation_signals[-4:]}. "
+                              f"Recent History: {self.history[-3:]}")
+        print(f"🧠 [Core] 偵測到卡關徵兆 {self.stagnation_signals[-4:]}，背景預先重新規劃...")
+        self.replan_future = _PLANNER_POOL.submit(planner_client.replan_task, self.user_goal, self.current_plan, current_state_desc)
+        self.replan_stats["speculative"] += 1
+
+    def _clear_stagnation(self):
+        """ [New] 頁面有實質進展：清除徵兆；尚未採用的預先計畫直接丟棄 (請求仍會跑完，但結果不使用) """
+        if self.replan_future is not None:
+            print("🗑️ [Core] Agent 已自行恢復，丟棄預先規劃的計畫。")
+            self.replan_future = None
+            self.replan_stats["discarded"] += 1
+        self.stagnation_signals = []
+
+    def _adopt_plan(self, new_plan: str):
+        print(f"📋 [Planner] 新計畫已生成: {new_plan}")
+        planner_client.forget_plan(self.user_goal, self.task_site)
+        self.current_plan = new_plan
+        self.history.append(f"System: Plan Updated due to failure. New Plan: {new_plan}")
+        self.same_state_action_count = 0
+        self.stagnation_signals = []
+        self.replan_stats["adopted"] += 1
 
     def get_history_window(self):
         if len(self.history) > self.max_history_len:
             return self.history[-self.max_history_len:]
         return self.history
     
+    @profiler.profiled("completion_check")
     def check_success_with_tars(self):
         """
         [Updated] 使用 UI-TARS 進行終局驗證 (修正 Tuple 解包錯誤)
@@ -249,8 +441,10 @@ class AgentCore:
         return False, None
     
     # [New] 主動式反射系統 (The Reflex Layer)
+    @profiler.profiled("reflex")
     def _reflex_system(self, elements_map, scale_x, scale_y):   
         if not elements_map: return False
+        elements_map = ElementMap.wrap(elements_map)
 
         # 定義全網通用的「負面/關閉」關鍵字 (多語言支援)
         # 這些詞彙通常只出現在彈窗關閉鈕上，誤觸風險極低
@@ -265,7 +459,7 @@ class AgentCore:
 
         print("⚡ [Reflex] 正在掃描潛在干擾元素...")
 
-        for el in elements_map:
+        for i, el in enumerate(elements_map):
             # 取得經 Visual-DOM 對齊後的文字 (轉小寫比對)
             text = el.get('text', '').lower().strip()
             
@@ -275,13 +469,8 @@ class AgentCore:
                 print(f"🛡️ [Reflex] 偵測到阻礙元素: '{text}' (ID {el['id']})")
                 print(f"⚡ [Reflex] 觸發脊髓反射 -> 立即消除！")
                 
-                # 計算座標
-                cx = el['x'] + (el['w'] / 2)
-                cy = el['y'] + (el['h'] / 2)
-                
                 # 執行點擊 (傳入邏輯座標)
-                logic_x = int(cx / scale_x)
-                logic_y = int(cy / scale_y)
+                logic_x, logic_y = elements_map.logical_center(i, scale_x, scale_y)
                 # 1. 嘗試標準點擊
                 print(f"⚡ [Reflex] 嘗試點擊關閉...")
                 click_success = browser_controller.perform_mouse_click(self.driver, logic_x, logic_y)
@@ -302,23 +491,68 @@ class AgentCore:
         return False
     
     def analyze_next_step(self):
+        """
+        [Updated] 每一步的延遲剖析從這裡開始；動作執行完 (execute_action) 才把延遲樹寫進這一步的 Log
+        """
+        self.flush_step_profile() # 上一步沒經過 execute_action (finish / goto_url / 例外) 時在這裡補寫
+        profiler.begin_step()
+        with profiler.span("analyze"):
+            self._step_command = self._analyze_next_step()
+        return self._step_command
+
+    def flush_step_profile(self, executed_action=None):
+        """
+        [New] 取出這一步的延遲樹並寫入 Log。
+        提早返回 (反射 / 迴圈刷新 / 大腦無回應) 的步驟沒有 Log entry，另記一筆只含 timings 的步驟。
+        """
+        timings = profiler.end_step()
+        entry, command = self._step_log_entry, self._step_command or {}
+        self._step_log_entry = self._step_command = None
+        if timings is None or not self.logger: return # 剖析關閉時不寫入 timings
+        extra = {"executed_action": executed_action} if executed_action else {}
+        if entry is not None:
+            self.logger.attach_timings(entry, timings, **extra)
+        else:
+            self.logger.log_step(len(self.history) + 1, {
+                "action": command.get("action"), "executor_thought": command.get("thought", ""),
+                "timings": timings, **extra
+            })
+
+    def _analyze_next_step(self):
+        # 晚到的初始計畫 / RAG 結果 (不阻塞)
+        self._collect_task_context()
+
         # 1. 環境準備
         browser_controller.wait_for_page_stability(self.driver)
         browser_controller.handle_window_policy(self.driver)
         #browser_controller.smart_wait_for_change(self.driver)
         page_state = browser_controller.get_page_state(self.driver)
+        browser_controller.sync_request_blocking(self.driver, page_state.get('url'))
         
         # --- [Upgrade 1] 死循環偵測 ---
-        current_hash = self._get_page_hash()
-        is_page_changed = (current_hash != self.last_page_hash)
+        # 迴圈偵測只看 DOM (結構 / 文字 / 捲動)，不看畫面：影片與輪播圖不該讓卡關被誤判為「有進展」
+        fingerprint = self._capture_fingerprint()
+        page_change = fingerprint.compare(self.last_fingerprint) if fingerprint else page_fingerprint.NAVIGATED
+        is_page_changed = (page_change != page_fingerprint.IDENTICAL)
         
         if not is_page_changed:
             self.same_state_action_count += 1
-            print(f"⚡ [Core] 頁面狀態未變動 (Hash: {current_hash[:8]})...")
+            print(f"⚡ [Core] 頁面狀態未變動 ({fingerprint})...")
+            self._note_stagnation("page unchanged")
         else:
+            print(f"🔍 [Core] 頁面狀態: {page_change}")
             self.same_state_action_count = 0
-            self.last_page_hash = current_hash
-            self.cached_elements_map = None # 清除快取
+            self.last_fingerprint = fingerprint
+            if page_change != page_fingerprint.SCROLLED: # 只有捲動不算恢復 (可能正在無效捲動)
+                self._clear_stagnation()
+        self.current_fingerprint = fingerprint
+
+        # [New] 背景的預先計畫已完成且仍在卡關 -> 直接換上
+        if self.replan_future is not None and self.replan_future.done():
+            _, new_plan = self._poll_future(self.replan_future, 0)
+            self.replan_future = None
+            if new_plan:
+                self._adopt_plan(new_plan)
             
         # 如果連續 3 次在同一個畫面做動作沒反應，強制刷新
         if self.same_state_action_count >= 3:
@@ -326,16 +560,19 @@ class AgentCore:
             
             # [New] 呼叫 Planner 重新規劃
             try:
-                print("🧠 [Core] 請求 Planner 重新規劃戰略...")
-                current_state_desc = f"Stuck at URL: {self.driver.current_url}. Recent History: {self.history[-3:]}"
-                
-                new_plan = planner_client.replan_task(self.user_goal, self.current_plan, current_state_desc)
+                if self.replan_future is not None:
+                    # [Updated] 背景已經在規劃：等它 (已跑了一段時間)，不再另外發一個阻塞請求
+                    print("🧠 [Core] 等待背景重新規劃結果...")
+                    with profiler.span("replan_wait"):
+                        _, new_plan = self._poll_future(self.replan_future, REPLAN_WAIT_TIMEOUT)
+                    self.replan_future = None
+                else:
+                    print("🧠 [Core] 請求 Planner 重新規劃戰略...")
+                    current_state_desc = f"Stuck at URL: {self.driver.current_url}. Recent History: {self.history[-3:]}"
+                    new_plan = planner_client.replan_task(self.user_goal, self.current_plan, current_state_desc)
                 
                 if new_plan:
-                    print(f"📋 [Planner] 新計畫已生成: {new_plan}")
-                    self.current_plan = new_plan
-                    self.history.append(f"System: Plan Updated due to failure. New Plan: {new_plan}")
-                    self.same_state_action_count = 0
+                    self._adopt_plan(new_plan)
                     return {"action": "wait", "thought": "Plan updated, re-evaluating."}
             except Exception as e:
                 print(f"❌ Re-plan 失敗: {e}")
@@ -345,11 +582,19 @@ class AgentCore:
             self.driver.refresh()
             self.same_state_action_count = 0
             self.cached_elements_map = None
+            self.page_map = None
             return {"action": "wait", "thought": "Loop detected, refreshing page."}
+
+        # --- [New] Skill 重播：命中的 Skill 還有步驟時，跳過截圖 / OmniParser / 大腦 ---
+        if self.skill_replay and not self.skill_replay.finished:
+            replay_command = self._next_skill_command(fingerprint)
+            if replay_command:
+                return replay_command
         
         if self.history and "Scrolled" in self.history[-1]:
             print("🔄 [Core] 偵測到捲動，強制清除快取並等待渲染...")
-            time.sleep(2.0) # 給瀏覽器一點時間重繪畫面
+            with profiler.span("scroll_settle"):
+                time.sleep(2.0) # 給瀏覽器一點時間重繪畫面
             self.cached_elements_map = None
             self.cached_img_size = None
 
@@ -359,6 +604,7 @@ class AgentCore:
                 # 這裡做一個簡單的啟發式：透過 page_content 長度變化來判斷
                 # 或者在傳給 Brain 的 prompt 裡加入警告
                 print("⚠️ [Core] 偵測到連續捲動 (Consecutive Scrolling)...")
+                self._note_stagnation("consecutive scrolls")
                 
                 # 這裡我們可以動態修改 user_goal 或者注入一個 System Hint
                 # 但最簡單有效的方法是：修改接下來要傳給 LLM 的 elements_desc
@@ -372,14 +618,22 @@ class AgentCore:
 
         # 2. 截圖與尺寸分析 (Retina Scaling Fix)
         # 這是 OmniParser 看世界的解析度 (物理像素)
-        raw_png = self.driver.get_screenshot_as_png()
-        image = Image.open(io.BytesIO(raw_png))
+        with profiler.span("screenshot"):
+            raw_png = self.driver.get_screenshot_as_png()
+            if fingerprint: fingerprint.attach_visual(raw_png)
+            image = Image.open(io.BytesIO(raw_png))
         img_w, img_h = image.size 
         img_size = (img_w, img_h)
         # 這是 Selenium 操作世界的解析度 (邏輯像素/CSS像素)
         # 必須使用 JS window.innerWidth/Height，這才是真正的 "Viewport"
-        viewport_w = self.driver.execute_script("return window.innerWidth;") or 1920
-        viewport_h = self.driver.execute_script("return window.innerHeight;") or 1080
+        # 一次取回 viewport 尺寸、捲動位置與文件高度 (減少 round trip)
+        try:
+            viewport_w, viewport_h, scroll_y, doc_height = self.driver.execute_script(
+                "return [window.innerWidth, window.innerHeight, window.scrollY, document.documentElement.scrollHeight];")
+        except Exception:
+            viewport_w, viewport_h, scroll_y, doc_height = 1920, 1080, 0, 0
+        viewport_w = viewport_w or 1920
+        viewport_h = viewport_h or 1080
         
         # 計算縮放比例
         scale_x = img_w / viewport_w
@@ -388,35 +642,45 @@ class AgentCore:
         
         # 抓取頁面文字，用於回答問題 (如 summarize, compare prices)
         try:
-            page_content = self._extract_page_content()
+            page_content = self._extract_page_content(cache_key=fingerprint.key if fingerprint else None)
             print(f"📖 [Core] 已提取頁面內容 (前 {len(page_content)} 字)")
         except Exception:
             page_content = "(Page content unavailable)"
 
-        elements_map = []
-        if not is_page_changed and self.cached_elements_map is not None:
+        elements_map = ElementMap()
+        # 元素快取：建立當下的指紋與現在完全相同 (含畫面) 才沿用
+        cache_valid = (fingerprint is not None and self.cached_elements_map is not None and
+                       fingerprint.compare(self.cached_fingerprint, use_visual=True) == page_fingerprint.IDENTICAL)
+        if cache_valid:
             print("🚀 [Cache] 命中快取！跳過 OmniParser 呼叫。")
             elements_map = self.cached_elements_map
         else:
+            used_page_map = False
+            if FULL_PAGE_PERCEPTION:
+                # [New] 同一頁面只建一次整頁地圖，捲動後直接裁切，不再呼叫 OmniParser
+                if not page_scanner.is_page_map_valid(self.page_map, page_state.get('url'), doc_height):
+                    self.page_map = page_scanner.scan_full_page(self.driver)
+                if self.page_map:
+                    elements_map = ElementMap(page_scanner.viewport_elements(self.page_map, scroll_y, viewport_w, viewport_h, scale_x, scale_y))
+                    print(f"🗺️ [PageMap] 沿用整頁元素地圖，視窗內 {len(elements_map)} 個目標 (跳過 OmniParser)")
+                    used_page_map = True
+
             # 沒命中，老實呼叫 API
             max_retries = 3
             for attempt in range(max_retries):
+                if used_page_map: break
                 print(f"👁️ [Vision] 呼叫 OmniParser (Attempt {attempt+1})...")
                 omni_result = api_clients.call_eyes_omni_parser(raw_png)
                 if omni_result:
-                    elements_map = utils.convert_omni_data_to_elements(omni_result, img_size)
+                    elements_map = ElementMap(utils.convert_omni_data_to_elements(omni_result, img_size))
                     print(f"👁️ [Vision] OmniParser 捕捉到 {len(elements_map)} 個目標")
                 if elements_map: break
                 break 
             
             if elements_map:
                 print(f"🔗 [Core] 正在執行 Visual-DOM 對齊...")
-                query_coords = []
-                for el in elements_map:
-                    cx = el['x'] + (el['w'] / 2)
-                    cy = el['y'] + (el['h'] / 2)
-                    # 轉為邏輯像素
-                    query_coords.append({"x": int(cx / scale_x), "y": int(cy / scale_y)})
+                # 中心點一次換算為邏輯像素
+                query_coords = [{"x": x, "y": y} for x, y in elements_map.logical_centers(scale_x, scale_y).tolist()]
                 
                 dom_details = browser_controller.batch_get_element_details(self.driver, query_coords)
                 
@@ -454,31 +718,34 @@ class AgentCore:
                     print(f"✅ 對齊完成，增強了 {updated_count} 個元素的資訊。")
                 else:
                     print("⚠️ 對齊失敗 (JS 回傳異常)，沿用 OmniParser 原始資料。")
+                # [New] 對齊後才去重：同一個控制項的圖示 / 文字 / 外框此時已對到同一個 DOM 元素
+                elements_map = dedupe_elements(elements_map)
             # ----------------------------------------------------
             if self._reflex_system(elements_map, scale_x, scale_y):
                 # 如果反射系統觸發了動作 (例如點了關閉)，我們必須「重來」
                 # 因為畫面已經變了 (彈窗沒了)，舊的截圖無效了
                 print("🔄 [Reflex] 畫面已變更，重啟感知循環...")
                 self.cached_elements_map = None # 清除快取
+                self.page_map = None
                 # 回傳一個特殊的 Wait 訊號，讓外部迴圈繼續，自然會重新進入 analyze_next_step
                 return {"action": "wait", "thought": "Reflex action executed (Popup closed). Refreshing perception."}
             # ============================================================
             if elements_map:
                 self.cached_elements_map = elements_map
+                self.cached_fingerprint = fingerprint
 
-        if len(elements_map) > 50:
-            print(f"📉 [Core] 元素過多 ({len(elements_map)})，執行智慧縮減...")
-            # 簡單策略：保留前 40 個 (假設 OmniParser 已經按信心度排序) + 所有 Input
-            important_elements = [el for el in elements_map if el['tag'] in ['input', 'textarea']]
-            other_elements = [el for el in elements_map if el not in important_elements]
-            elements_map = important_elements + other_elements[:40]
+        if len(elements_map) > ELEMENT_PROMPT_LIMIT:
+            print(f"📉 [Core] 元素過多 ({len(elements_map)})，依相關性保留前 {ELEMENT_PROMPT_LIMIT} 個...")
+            # [Updated] 依目標關鍵字 / 互動性 / 畫面位置排序 (輸入框一律保留)，取代「前 40 個 + Input」
+            elements_map = rank_elements(elements_map, self.user_goal, ELEMENT_PROMPT_LIMIT, viewport_height=img_h)
         # --- 分支判斷 ---
 
         # [New] 在準備大腦輸入時，提取 A11y Tree
         a11y_tree = self._extract_a11y_tree()
         print(f"🌲 [Core] A11y Tree 提取完畢 ({len(a11y_tree)} chars)")
         # 4. 準備大腦輸入 (文字化清單 + 圖片)
-        tagged_b64, _ = utils.draw_som_on_image(raw_png, elements_map)
+        with profiler.span("som_render"):
+            tagged_b64, tagged_mime, _ = self.som_renderer.render(raw_png, elements_map, image=image)
         
         elements_text_list = []
         if getattr(self, 'consecutive_scroll_warning', False):
@@ -489,6 +756,15 @@ class AgentCore:
                 elements_text_list.append(f"[ID {el['id']}] <{el['tag']}> {clean_text}")
         else:
             elements_text_list.append("(No interactive elements found)")
+
+        if FULL_PAGE_PERCEPTION and self.page_map:
+            offscreen = page_scanner.offscreen_elements(self.page_map, scroll_y, viewport_h)
+            if offscreen:
+                elements_text_list.append('\n[Off-screen Elements] (Not visible now. Use action "scroll_to" with the full "P..." id as element_id to jump there)')
+                for el in offscreen:
+                    position = "above" if el['y'] < scroll_y else "below"
+                    clean_text = el['text'].replace('\n', ' ').strip()[:80]
+                    elements_text_list.append(f"[ID {page_scanner.format_offscreen_id(el['id'])}] ({position}) {clean_text}")
         
         elements_desc = "\n".join(elements_text_list)
         # [Mod] 將 A11y Tree 附加到 page_content 或 elements_desc 中
@@ -500,6 +776,10 @@ class AgentCore:
             is_success, answer = self.check_success_with_tars()
             if is_success:
                 return {"action": "finish", "value": answer, "thought": "UI-TARS verified completion."}
+        # [New] 大腦需要 RAG 與計畫：感知已完成，這裡才等背景工作 (有上限，逾時則先用暫定計畫)
+        with profiler.span("context_wait"):
+            self._collect_task_context(rag_timeout=TASK_START_RAG_WAIT, plan_timeout=TASK_START_PLAN_WAIT)
+
         # 5. 呼叫大腦 (Brain)
         # 如果 OmniParser 完全沒抓到東西，elements_desc 會是空的，Brain 應該會決定 Grounding
         brain_response = api_clients.call_brain(
@@ -511,7 +791,8 @@ class AgentCore:
             page_content=full_context_content, # 傳入 Markdown
             rag_data=self.rag_data,
             high_level_plan=self.current_plan,
-            scratchpad_data=scratchpad_str
+            scratchpad_data=scratchpad_str,
+            image_mime=tagged_mime
         )
         
         if not brain_response: return {"action": "wait", "thought": "Brain No Response"}
@@ -524,12 +805,12 @@ class AgentCore:
                 "action": brain_response.get("action"),
                 "target": brain_response.get("target_description", ""),
                 "value": brain_response.get("value", ""),
-                "elements_found": len(elements_map) if 'elements_map' in locals() else 0,
+                "elements_found": len(elements_map),
                 # 甚至可以記錄 page_content 的前 100 字，方便 debug
                 "page_snippet": page_content[:200] if 'page_content' in locals() else ""
             }
             # 這裡的 step 數可以從 history 長度推算
-            self.logger.log_step(len(self.history) + 1, log_payload)
+            self._step_log_entry = self.logger.log_step(len(self.history) + 1, log_payload)
         # 6. 動作分流 (Action Dispatch)
         # ================= [Critical Fix] 絕對初始化區塊 =================
         # 這裡的變數定義必須在所有 if/else 之外，防止 UnboundLocalError
@@ -539,10 +820,17 @@ class AgentCore:
         
         # 安全取得 target_id (確保是整數)
         raw_id = brain_response.get("element_id", 0)
+        # [Fix] "P1012" 是視窗外元素 (元素地圖 ID)，與畫面上的 SoM 編號分開處理
+        page_id = page_scanner.parse_offscreen_id(raw_id)
         try:
-            target_id = int(raw_id)
+            target_id = int(raw_id) if page_id is None else 0
         except:
             target_id = 0
+        if page_id is not None and action in ["click", "type"]:
+            # 元素不在畫面上，先捲過去；下一步它會以 SoM 編號出現
+            print(f"🗺️ [Core] {raw_id} 在視窗外，先 scroll_to 再操作。")
+            action = "scroll_to"
+            brain_response["action"] = action
             
         # 安全取得 coords (確保是 Tuple/List)
         coords = brain_response.get("coords")
@@ -596,7 +884,7 @@ class AgentCore:
             # ... (保留您的 Retrieve 邏輯) ...
             if self.memory_manager:
                 try:
-                    new_rag = self.memory_manager.retrieve_relevant_memory(target_desc or self.user_goal)
+                    new_rag = self.memory_manager.retrieve_relevant_memory(target_desc or self.user_goal, site=self.task_site)
                     self.rag_data = new_rag
                     if new_rag.get('success_path'):
                         print("📚 [Memory] 已動態載入新策略！")
@@ -613,6 +901,9 @@ class AgentCore:
                 raw_coords = tars_result['coords']
                 logic_x = int(raw_coords[0] / scale_x)
                 logic_y = int(raw_coords[1] / scale_y)
+                # [New] 座標落在哪個已知元素上 (最內層)，用它的文字做文字救援，比描述更準
+                hits = elements_map.at_point(raw_coords[0], raw_coords[1])
+                hit_text = elements_map[hits[0]].get('text', '') if hits else ""
                 
                 final_action = "click"
                 is_input_field = any(k in target_desc.lower() for k in ["search", "input", "box", "field", "text", "bar"])
@@ -629,22 +920,31 @@ class AgentCore:
                     "value": value,
                     "thought": "Grounding success.",
                     "target_desc": target_desc,
-                    "target_text": target_desc # 用描述當作文字救援
+                    "target_text": hit_text or target_desc # 用元素文字 (或描述) 當作文字救援
                 }
+            self._note_stagnation("grounding failed")
             return {"action": "scroll", "thought": "Grounding failed."}
 
+        # [Case C-2] Scroll To (Full-Page 元素地圖)
+        if action == "scroll_to":
+            # 只接受 "P..." ID：純數字是畫面上的 SoM 編號，不能拿來查元素地圖
+            page_el = page_scanner.find_page_element(self.page_map, page_id) if page_id is not None else None
+            if page_el:
+                brain_response["doc_y"] = page_el['y'] + page_el['h'] / 2
+                brain_response["target_desc"] = f"ID {page_scanner.format_offscreen_id(page_id)} ({page_el['text']})"
+                return brain_response
+            print(f"⚠️ [Core] 元素地圖中沒有 ID {raw_id}，改為一般捲動。")
+            return {"action": "scroll", "thought": "scroll_to target not found in page map."}
+
         # [Case D] Standard ID Interaction
         if action in ["click", "type"]:
             # [Fix] 使用前面初始化好的 target_id，不要再從 brain_response get 了
-            target_el = next((e for e in elements_map if str(e['id']) == str(target_id)), None)
+            target_index = elements_map.index_of(target_id)
             
-            if target_el:
-                # 計算中心點
-                center_x = target_el['x'] + (target_el['w'] / 2)
-                center_y = target_el['y'] + (target_el['h'] / 2)
-                
+            if target_index is not None:
+                target_el = elements_map[target_index]
                 # 更新 brain_response (這些資料會傳給 execute_action)
-                brain_response["coords"] = (int(center_x / scale_x), int(center_y / scale_y))
+                brain_response["coords"] = elements_map.logical_center(target_index, scale_x, scale_y)
                 
                 # [Fix] 確保 target_text 存在
                 target_text = target_el.get('text', '')
@@ -654,12 +954,100 @@ class AgentCore:
                 brain_response["action"] = action # 確保 action 正確
             else:
                 print(f"⚠️ [Core] ID {target_id} 不存在，轉為 Wait。")
+                self._note_stagnation(f"unknown element id {target_id}")
                 brain_response["action"] = "wait"
 
         # [Case E] 其他動作 (Scroll, Back...) 直接回傳
         return brain_response
 
+    def _next_skill_command(self, fingerprint):
+        """ [New] 驗證上一個重播步驟並產生下一個指令；偏離時回傳 None (回到一般流程) """
+        replay = self.skill_replay
+        if not replay.verify_previous(fingerprint): return None
+        step = replay.next_step(fingerprint)
+        if not step: return None
+
+        total = len(replay.skill["steps"])
+        action = step["action"]
+        command = {
+            "action": action, "value": step.get("value") or "",
+            "thought": f"Replaying skill step {replay.cursor}/{total}",
+            "skill_step": replay.cursor, "target_desc": f"Skill step {replay.cursor}",
+            "locator": step.get("locator") # 重錄時直接沿用，不必再查一次
+        }
+        if action in ("click", "type"):
+            coords = browser_controller.resolve_element_locator(self.driver, step.get("locator"))
+            if not coords:
+                replay.abort("找不到錄製的元素")
+                return None
+            text = step["locator"].get("text", "")
+            command.update({"coords": coords, "target_text": text, "target_desc": f"Skill: {text}"})
+        elif action == "scroll_to":
+            command["doc_y"] = step.get("doc_y")
+
+        print(f"🧩 [Skill] 重播第 {replay.cursor}/{total} 步: {action} {command['target_desc']}")
+        if self.logger:
+            self._step_log_entry = self.logger.log_step(len(self.history) + 1, {
+                "page_url": fingerprint.url if fingerprint else "",
+                "action": action, "target": command["target_desc"], "value": command["value"],
+                "skill_replay": True
+            })
+        return command
+
     def execute_action(self, action_data, target_desc=None, value=None, auto_submit=False, target_text=None):
+        """
+        [Updated] 執行動作 (計入這一步的延遲剖析)，結束後把整步的延遲樹寫入 Log
+        """
+        with profiler.span("execute"):
+            outcome = self._execute_and_record(action_data, target_desc, value, auto_submit, target_text)
+        self.flush_step_profile(executed_action=action_data.get("action") if isinstance(action_data, dict) else action_data)
+        return outcome
+
+    def _execute_and_record(self, action_data, target_desc=None, value=None, auto_submit=False, target_text=None):
+        """
+        [Updated] 執行動作，並在成功時錄製成 Skill 步驟 (定位資訊 + 前後頁面指紋)
+        """
+        if not isinstance(action_data, dict):
+            return self._execute_action(action_data, target_desc, value, auto_submit, target_text)
+
+        action = action_data.get("action")
+        pre_fp = self.current_fingerprint
+        capturing = self._skill_capture_active()
+        locator = action_data.get("locator") # Skill 重播步驟已帶有錄製時的定位資訊
+        coords = action_data.get("coords")
+        if capturing and not locator and action in ("click", "type") and coords:
+            # 動作前先取得定位資訊 (點擊後頁面可能已跳轉)；沒有要錄製時不多做這次 JS 呼叫
+            locator = browser_controller.describe_element_at(self.driver, int(coords[0]), int(coords[1]))
+
+        outcome = self._execute_action(action_data, target_desc, value, auto_submit, target_text)
+
+        if action_data.get("skill_step") and self.skill_replay and not outcome.get("success"):
+            self.skill_replay.abort(f"{action} 執行失敗")
+        if not outcome.get("success") and action in ("click", "type", "scroll", "scroll_to", "goto_url"):
+            self._note_stagnation(f"{action} failed")
+        if capturing and outcome.get("success") and action in skill_cache.REPLAYABLE_ACTIONS:
+            if action in ("click", "type") and not locator:
+                return outcome # 沒有定位資訊的點擊無法重播
+            self.skill_trace.append(skill_cache.make_step(
+                action, value=action_data.get("value"), locator=locator,
+                pre_fp=pre_fp, post_fp=page_fingerprint.capture_fingerprint(self.driver),
+                doc_y=action_data.get("doc_y")
+            ))
+        return outcome
+
+    def _skill_capture_active(self) -> bool:
+        """
+        [New] 這個任務是否還在錄製 Skill；超過 SKILL_MAX_STEPS 時放棄整條軌跡 (不存半截的 Skill)
+        """
+        if not (self.skill_store and SKILL_CAPTURE_ENABLED) or self.skill_trace is None:
+            return False
+        if len(self.skill_trace) >= SKILL_MAX_STEPS:
+            print(f"🧩 [Skill] 軌跡超過 {SKILL_MAX_STEPS} 步，本任務不錄製 Skill。")
+            self.skill_trace = None
+            return False
+        return True
+
+    def _execute_action(self, action_data, target_desc=None, value=None, auto_submit=False, target_text=None):
         """
         [Updated] 執行動作 (整合文字救援與擬人化)
         """
@@ -711,18 +1099,26 @@ class AgentCore:
                 self.history.append("Scrolled down")
                 print("🔄 [Core] 捲動發生，強制清除視覺快取 (Force Refresh)...")
                 self.cached_elements_map = None 
-                self.last_page_hash = "" 
                 return result(True, "捲動完成")
             else:
                 self.history.append("Scroll FAILED (End of page)")
                 return result(False, "已達底部")
             
+        if action == "scroll_to":
+            doc_y = action_data.get("doc_y") if isinstance(action_data, dict) else None
+            if doc_y is not None and browser_controller.scroll_to_document_position(self.driver, doc_y):
+                self.history.append(f"Scrolled to {target_desc}")
+                self.cached_elements_map = None
+                return result(True, "定點捲動完成")
+            return result(False, "定點捲動失敗")
+
         if action == "goto_url":
             success = browser_controller.perform_goto_url(self.driver, value)
             if success:
                 self.history.append(f"Jumped to {value}")
                 self.cached_elements_map = None
-                self.last_page_hash = ""
+                self.page_map = None
+                self.last_fingerprint = None
                 return result(True, "跳轉成功")
             return result(False, "跳轉失敗")
 
@@ -753,7 +1149,8 @@ class AgentCore:
             self.driver.back()
             self.history.append("Navigated Back")
             self.cached_elements_map = None
-            self.last_page_hash = ""
+            self.page_map = None
+            self.last_fingerprint = None
             browser_controller.smart_wait_for_change(self.driver) # 使用 smart wait 確保載入
             return result(True, "返回上一頁")
         # --- 3. SoM / UI-TARS 精確操作 ---
@@ -788,6 +1185,7 @@ class AgentCore:
 
             if success:
                 self.cached_elements_map = None
+                self.page_map = None # 點擊/輸入可能改變頁面內容，整頁地圖失效
                 # 這裡不需要額外的 wait_for_page_load，因為 controller 內部已經有了 smart_wait
                 return result(True, f"{action} 成功")
             else:
@@ -820,15 +1218,28 @@ class AgentCore:
 
     def handle_failure(self, reason: str):
         """ 失敗時的反思與記錄 """
-        print(f"[Core] 任務失敗，正在反思: {reason}")
-        insight = api_clients.call_reflexion(self.user_goal, self.history, reason)
-        sanitized_history = utils.sanitize_history(self.history)
-        self.memory_manager.add_memory(self.user_goal, sanitized_history, outcome="failure", insight=insight)
+        if not self.memory_manager: return
+        print(f"[Core] 任務失敗，反思與記錄交由背景佇列處理: {reason}")
+        # [Updated] 反思 (LLM) + Embedding + Upsert 全部移到 MemoryWriteQueue，不阻塞下一個任務
+        user_goal, history = self.user_goal, list(self.history)
+        sanitized_history = utils.sanitize_history(history)
+        self.memory_manager.add_memory_async(
+            user_goal, sanitized_history, outcome="failure",
+            insight_fn=lambda: api_clients.call_reflexion(user_goal, history, reason),
+            site=self.task_site
+        )
 
     def _save_success(self):
-        """ 成功時的記錄 """
-        sanitized_history = utils.sanitize_history(self.history)
-        self.memory_manager.add_memory(self.user_goal, sanitized_history, outcome="success")
+        """ 成功時的記錄 (背景寫入) """
+        if self.memory_manager:
+            sanitized_history = utils.sanitize_history(self.history)
+            self.memory_manager.add_memory_async(self.user_goal, sanitized_history, outcome="success", site=self.task_site)
+        if self.skill_store:
+            # [New] 只有驗證通過的任務才存成 Skill
+            if self.skill_replay:
+                self.skill_store.record_outcome(self.skill_replay.skill["id"], success=True)
+            if self.skill_trace: # None: 軌跡過長已放棄錄製
+                self.skill_store.save_skill(self.user_goal, self.task_site, self.task_start_url, self.skill_trace)
         browser_controller.cleanup_tabs(self.driver)
 
     def check_login_status(self, initial_url):
@@ -10,6 +10,7 @@ from PyQt6.QtGui import QPainter, QColor, QBrush, QAction, QGuiApplication
 
 from agent_core import AgentCore # <--- 引入核心
 import browser_controller
+import memory_writer
 
 # --- 樣式表 (保持不變) ---
 STYLESHEET = """
@@ -329,6 +330,7 @@ class AgentController(QWidget):
 
     def close_application(self):
         if self.worker and self.worker.isRunning(): self.worker.stop(); self.worker.wait()
+        memory_writer.flush_all() # 關閉前確保背景記憶寫入完成
         if self.agent_driver: 
             try: self.agent_driver.quit() 
             except: pass
@@ -1,41 +1,55 @@
 # analyze_logs.py
+# [Updated] 失敗案例分析 + 每一步的延遲剖析 (profiler 寫入的 step["timings"])
+# 用法: python analyze_logs.py [session 資料夾]  (未指定時分析最新的 session)
 import os
+import sys
 import json
 import glob
+from collections import defaultdict
+from test_logger import SESSION_REPORT_NAME
+from profiler import flatten_spans
 
-def analyze_latest_session():
-    # 1. 找到最新的 Log 資料夾
-    log_root = "test_logs"
+LOG_ROOT = "test_logs"
+CHECKPOINT_DIR_NAME = "checkpoints" # test_suite 的逐題 Checkpoint，不是 session
+LATENCY_TOP_PHASES = 8 # 分組報表只列出總耗時最多的幾個階段
+
+def find_latest_session(log_root=LOG_ROOT):
     if not os.path.exists(log_root):
+        return None
+    sessions = sorted(d for d in os.listdir(log_root)
+                      if d != CHECKPOINT_DIR_NAME and os.path.isdir(os.path.join(log_root, d)))
+    return os.path.join(log_root, sessions[-1]) if sessions else None
+
+def load_case_logs(session_dir):
+    cases = []
+    for jf in glob.glob(os.path.join(session_dir, "*.json")):
+        if os.path.basename(jf) == SESSION_REPORT_NAME: continue
+        with open(jf, 'r', encoding='utf-8') as f:
+            cases.append(json.load(f))
+    return cases
+
+def analyze_latest_session(session_dir=None):
+    # 1. 找到最新的 Log 資料夾
+    latest_session = session_dir or find_latest_session()
+    if not latest_session:
         print("沒有 Log 資料。")
         return
 
-    sessions = sorted(os.listdir(log_root))
-    if not sessions: return
-    
-    latest_session = os.path.join(log_root, sessions[-1])
     print(f"📂 分析 Log 資料夾: {latest_session}\n")
 
     # 2. 讀取所有 JSON
-    json_files = glob.glob(os.path.join(latest_session, "*.json"))
-    
-    failed_cases = []
-    
-    for jf in json_files:
-        with open(jf, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if data['status'] == "FAIL":
-                failed_cases.append(data)
+    cases = load_case_logs(latest_session)
+    failed_cases = [case for case in cases if case['status'] == "FAIL"]
 
     # 3. 輸出分析報告
     print(f"🔴 總計失敗: {len(failed_cases)} 筆\n")
-    
+
     for case in failed_cases:
         print("="*60)
         print(f"🆔 Case ID: {case['id']}")
         print(f"🎯 Goal: {case['goal']}")
         print(f"❌ Error: {case['error_msg']}")
-        
+
         # 顯示最後一步的思考 (通常是死因)
         if case['steps']:
             last_step = case['steps'][-1]
@@ -48,5 +62,63 @@ def analyze_latest_session():
             print("⚠️ No steps recorded.")
         print("\n")
 
+    analyze_latency(cases)
+
+# --- [New] 延遲剖析 ---
+def percentile(sorted_values, q):
+    """ 最近秩 (nearest-rank) 百分位數；sorted_values 需已排序且非空 (benchmark_retrieval 共用) """
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+def _print_phase_table(title, phase_samples, step_count, top=None):
+    """ phase_samples: {階段路徑: [ms, ...]}；top: 只列出總耗時最多的前幾個階段 (step 總時間一定列出) """
+    phases = [p for p in phase_samples if p != "step"]
+    if top:
+        phases = sorted(phases, key=lambda p: -sum(phase_samples[p]))[:top]
+    phases = ["step"] + sorted(phases) # 依路徑排序：子階段緊接在父階段後面
+    print(f"\n⏱️ {title} ({step_count} steps)")
+    print(f"{'Phase':<52} | {'n':>5} | {'p50 ms':>9} | {'p95 ms':>9} | {'max ms':>9}")
+    print("-" * 96)
+    for phase in phases:
+        values = sorted(phase_samples.get(phase, []))
+        if not values: continue
+        depth = phase.count("/")
+        label = ("  " * depth + phase.rsplit("/", 1)[-1])[:52]
+        print(f"{label:<52} | {len(values):>5} | {percentile(values, 0.5):>9.0f} | "
+              f"{percentile(values, 0.95):>9.0f} | {max(values):>9.0f}")
+
+def analyze_latency(cases):
+    """ 各階段 (含巢狀) 的 p50 / p95 / max：全部、依網站、依動作類型 """
+    overall = defaultdict(list)
+    by_site = defaultdict(lambda: defaultdict(list))
+    by_action = defaultdict(lambda: defaultdict(list))
+    step_counts = defaultdict(int)
+
+    for case in cases:
+        site = case.get('web_name') or "Unknown"
+        for step in case.get('steps', []):
+            timings = step.get('timings')
+            if not timings or not timings.get('spans'): continue # 剖析關閉時的舊 Log 只有空的 timings
+            action = step.get('executed_action') or step.get('action') or "unknown"
+            samples = {"step": timings['total_ms'], **flatten_spans(timings['spans'])}
+            for phase, ms in samples.items():
+                overall[phase].append(ms)
+                by_site[site][phase].append(ms)
+                by_action[action][phase].append(ms)
+            step_counts["all"] += 1
+            step_counts[("site", site)] += 1
+            step_counts[("action", action)] += 1
+
+    if not overall:
+        print("⏱️ 沒有延遲剖析資料 (config.PROFILER_ENABLED 關閉或舊版 Log)。")
+        return
+
+    print("=" * 96)
+    print("⏱️ 每一步延遲剖析 (Latency Breakdown)")
+    _print_phase_table("All steps", overall, step_counts["all"])
+    for site in sorted(by_site):
+        _print_phase_table(f"Site: {site}", by_site[site], step_counts[("site", site)], top=LATENCY_TOP_PHASES)
+    for action in sorted(by_action):
+        _print_phase_table(f"Action: {action}", by_action[action], step_counts[("action", action)], top=LATENCY_TOP_PHASES)
+
 if __name__ == "__main__":
-    analyze_latest_session()
\ No newline at end of file
+    analyze_latest_session(sys.argv[1] if len(sys.argv) > 1 else None)
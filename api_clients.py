@@ -6,8 +6,9 @@ import json
 import re
 from openai import OpenAI 
 from config import (GPT_OSS_URL, GPT_OSS_MODEL_NAME, USE_OPENAI_API, 
-                    OPENAI_API_KEY, OPENAI_MODEL_NAME, OMNIPARSER_API_URL, UI_TARS_API_URL)
+                    OPENAI_API_KEY, OPENAI_MODEL_NAME, OMNIPARSER_API_URL, UI_TARS_API_URL, FULL_PAGE_PERCEPTION)
 from utils import parse_omni_coordinates, parse_coords_from_string, parse_json_from_string
+from profiler import profiled
 
 # [New] 強健的 JSON 解析器 (取代 utils.parse_json_from_string)
 def robust_json_parse(text):
@@ -39,10 +40,12 @@ def robust_json_parse(text):
     print(f"❌ JSON Parse Failed. Raw text: {text[:100]}...")
     return None
 
-def call_brain(user_goal: str, history: list, page_state: dict, som_image_b64: str, rag_data: dict = None, element_text_description: str = "", page_content: str = "", high_level_plan: str = "", scratchpad_data: str = "") -> dict | None:
+@profiled("brain")
+def call_brain(user_goal: str, history: list, page_state: dict, som_image_b64: str, rag_data: dict = None, element_text_description: str = "", page_content: str = "", high_level_plan: str = "", scratchpad_data: str = "", image_mime: str = "image/png") -> dict | None:
     """
     [Updated] 統一的大腦入口。
     整合：SoM 視覺 + CoT 推理 + RAG 記憶注入 + OpenAI/Local 切換。
+    image_mime: SoM 圖片格式 (som_renderer 可輸出 JPEG / WebP)
     """
     
     # 1. 準備歷史紀錄
@@ -74,6 +77,12 @@ def call_brain(user_goal: str, history: list, page_state: dict, som_image_b64: s
     else:
         plan_section = "\n(No high-level plan available. You must plan and execute autonomously.)\n"
         
+    # [Fix] scroll_to 只在 Full-Page 感知開啟時提供 (關閉時沒有 [Off-screen Elements] 可跳)
+    scroll_to_command, scroll_to_action = "", ""
+    if FULL_PAGE_PERCEPTION:
+        scroll_to_command = '    - **scroll_to**: Jump directly to an element from [Off-screen Elements] (element_id required, keep the "P" prefix, e.g. "P1012"). Prefer this over repeated "scroll".\n'
+        scroll_to_action = '| "scroll_to" '
+
     #JSON issue fix
     system_prompt = """
     You are an advanced Browser Automation Agent operating in a "Planner-Executor" cognitive architecture.
@@ -163,7 +172,7 @@ def call_brain(user_goal: str, history: list, page_state: dict, som_image_b64: s
     - **click**: Click on a specific element ID.
     - **type**: Type text into an input field (ID required).
     - **scroll**: Scroll down to see more content.
-    - **wait**: Wait for page load or animation.
+""" + scroll_to_command + """    - **wait**: Wait for page load or animation.
     - **go_back**: Return to the previous page (use when results are bad).
     - **grounding**: Use UI-TARS to find an element by description (when ID is missing).
     - **extract_content**: 
@@ -179,7 +188,7 @@ def call_brain(user_goal: str, history: list, page_state: dict, som_image_b64: s
     {
         "planner_thought": "Phase 1...",
         "executor_thought": "Phase 2...",
-        "action": "click" | "type" | "scroll" | "wait" | "goto_url" | "finish" | "grounding" | "retrieve" | "go_back" | "extract_content",
+        "action": "click" | "type" | "scroll" """ + scroll_to_action + """| "wait" | "goto_url" | "finish" | "grounding" | "retrieve" | "go_back" | "extract_content",
         "target_description": "Search Input Bar",
         "element_id": 123,  // Integer ID from the interactive list. Use 0 if using grounding.
         "value": "text input OR final answer OR extracted data",
@@ -240,12 +249,12 @@ def call_brain(user_goal: str, history: list, page_state: dict, som_image_b64: s
 
     # 5. 呼叫模型
     if USE_OPENAI_API:
-        return _call_openai(system_prompt, user_content, som_image_b64)
+        return _call_openai(system_prompt, user_content, som_image_b64, image_mime)
     else:
         return _call_local_llm(system_prompt, user_content, som_image_b64)
     
 
-def _call_openai(system_prompt, user_content, image_b64):
+def _call_openai(system_prompt, user_content, image_b64, image_mime="image/png"):
     print(f"🧠 [Brain] Calling OpenAI ({OPENAI_MODEL_NAME})...")
     client = OpenAI(api_key=OPENAI_API_KEY)
     
@@ -256,7 +265,7 @@ def _call_openai(system_prompt, user_content, image_b64):
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": [
                     {"type": "text", "text": user_content},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}
+                    {"type": "image_url", "image_url": {"url": f"data:{image_mime};base64,{image_b64}"}}
                 ]}
             ],
             max_tokens=1024, # 增加 token 數以容納 CoT
@@ -293,6 +302,7 @@ def _call_local_llm(system_prompt, user_content, image_b64):
         return None
 
 
+@profiled("reflexion")
 def call_reflexion(user_goal: str, history: list, error_reason: str) -> str:
     """
     (New) 反思機制：分析失敗原因並產生 Insight
@@ -326,6 +336,7 @@ def call_reflexion(user_goal: str, history: list, error_reason: str) -> str:
         print(f"❌ 反思失敗: {e}")
         return "無法產生反思"
 
+@profiled("visual_verification")
 def call_visual_verification(user_goal: str, image_b64: str) -> tuple[bool, str]:
 
     print(f"--- 正在呼叫 Visual Verification (VQA) ---")
@@ -395,6 +406,7 @@ def call_visual_verification(user_goal: str, image_b64: str) -> tuple[bool, str]
         return False, str(e)
 
 
+@profiled("omniparser")
 def call_eyes_omni_parser(image_bytes: bytes) -> dict | None:
     print(f"--- 正在呼叫 OmniParser ---")
     files = {'file': ('image.png', image_bytes, 'image/png')}
@@ -411,6 +423,7 @@ def call_eyes_omni_parser(image_bytes: bytes) -> dict | None:
         print(f"❌ OmniParser 呼叫失敗: {e}")
         return None
 
+@profiled("tars_grounding")
 def call_eyes_ui_tars_grounding(sub_task: str, image_b64: str) -> dict | None:
     print(f"--- 正在呼叫 UI-TARS (定位) ---")
     prompt = f"""
@@ -447,6 +460,7 @@ def call_eyes_ui_tars_grounding(sub_task: str, image_b64: str) -> dict | None:
 def call_eyes_ui_tars(prompt: str, image_b64: str) -> str | None:
     return None 
 
+@profiled("popup_killer")
 def call_popup_killer(image_b64: str) -> dict | None:
     print(f"--- 正在呼叫 Popup Killer ---")
     prompt = """
@@ -475,6 +489,7 @@ def call_popup_killer(image_b64: str) -> dict | None:
     except Exception:
         return None
 
+@profiled("tars_vqa")
 def call_eyes_ui_tars_vqa(user_goal: str, image_b64: str, current_url: str = "") -> tuple[bool, str]:
     """
     [Updated] UI-TARS VQA 模式
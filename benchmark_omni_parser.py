@@ -0,0 +1,107 @@
+# benchmark_omni_parser.py
+# [New] OmniParser 回應解析的微基準測試
+# 比較舊版 (逐行 ast.literal_eval + 逐一換算) 與 utils.convert_omni_data_to_elements (Regex + 陣列換算)，
+# 並確認兩者輸出一致。
+# 用法: python benchmark_omni_parser.py [--payload recorded.json ...] [--elements 300] [--rounds 50]
+#   --payload: 錄下來的 OmniParser 回應 (單一 JSON 物件或物件陣列)；未提供時產生模擬回應
+
+import argparse
+import ast
+import json
+import random
+import statistics
+import time
+import utils
+
+IMAGE_SIZE = (1920, 1080)
+
+
+def legacy_convert(omni_data: dict, image_size: tuple) -> list:
+    """ 舊版 parsed_content 解析 (不含 print)，作為對照組 """
+    content_str = omni_data.get('parsed_content', [])
+    lines = content_str if isinstance(content_str, list) else str(content_str).strip().split('\n')
+    img_w, img_h = image_size
+    parsed_elements = []
+    index = 1
+    for line in lines:
+        line = line.strip()
+        if not line.startswith('icon '): continue
+        try:
+            icon_data = ast.literal_eval(line[line.index('{'):line.rindex('}') + 1])
+            bbox = icon_data.get('bbox', [])
+            content = icon_data.get('content', 'UI Element')
+            if len(bbox) != 4: continue
+            xmin, ymin, xmax, ymax = bbox
+            x1, y1 = int(xmin * img_w), int(ymin * img_h)
+            w, h = int(xmax * img_w) - x1, int(ymax * img_h) - y1
+            if w < 5 or h < 5: continue
+            parsed_elements.append({"id": index, "x": x1, "y": y1, "w": w, "h": h, "tag": "vision_el", "text": str(content)})
+            index += 1
+        except Exception:
+            continue
+    return parsed_elements
+
+
+def synthetic_payload(count: int, seed: int = 0) -> dict:
+    """ 模擬 OmniParser 的 parsed_content (文字 / 圖示混合，含引號、跳脫字元、content 為 None 或缺欄位) """
+    rng = random.Random(seed)
+    words = ["Search", "Sign in", "Add to cart", "Men's shoes", 'Say "hi"', "Next ›", "價格", "Back\\slash", "Filter"]
+    lines = []
+    for i in range(count):
+        x, y = rng.random() * 0.95, rng.random() * 0.95
+        bbox = [round(x, 4), round(y, 4), round(x + rng.random() * 0.05, 4), round(y + rng.random() * 0.04, 4)]
+        kind = rng.choice(["text", "icon"])
+        item = {"type": kind, "bbox": bbox, "interactivity": kind == "icon", "content": rng.choice(words)}
+        roll = rng.random()
+        if roll < 0.05:
+            item["content"] = None
+        elif roll < 0.1:
+            del item["content"]
+        lines.append(f"icon {i}: {item!r}")
+    return {"parsed_content": "\n".join(lines)}
+
+
+def load_payloads(paths: list) -> list:
+    payloads = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        payloads.extend(data if isinstance(data, list) else [data])
+    return payloads
+
+
+def time_parser(fn, payloads: list, rounds: int) -> list:
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for payload in payloads:
+            fn(payload, IMAGE_SIZE)
+        timings.append((time.perf_counter() - start) / len(payloads) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OmniParser response parsing benchmark")
+    parser.add_argument("--payload", nargs="*", default=[], help="Recorded OmniParser JSON responses")
+    parser.add_argument("--elements", type=int, default=300, help="Elements per synthetic payload")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payload) or [synthetic_payload(args.elements, seed) for seed in range(5)]
+    for payload in payloads:
+        if legacy_convert(payload, IMAGE_SIZE) != utils.convert_omni_data_to_elements(payload, IMAGE_SIZE):
+            print("⚠️ 新舊解析結果不一致！")
+            break
+    else:
+        print(f"✅ {len(payloads)} 份回應的新舊解析結果一致")
+
+    print(f"{'Parser':<10} | {'p50 ms':>8} | {'p95 ms':>8}")
+    print("-" * 32)
+    for name, fn in (("legacy", legacy_convert), ("fast", utils.convert_omni_data_to_elements)):
+        timings = sorted(time_parser(fn, payloads, args.rounds))
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"{name:<10} | {statistics.median(timings):>8.2f} | {p95:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# benchmark_retrieval.py
+# [New] RAG 檢索的延遲 / 召回測試
+# 作法：把 test_dataset.json 的所有 goal 當作記憶寫入「記憶體內」的 Chroma Collection (不動正式資料庫)，
+#       再以每個 goal 當查詢 (leave-one-out，排除自己)，統計前 k 筆中「同網站」記憶的比例。
+# 用法: python benchmark_retrieval.py [--dataset test_dataset.json] [--k 2] [--limit 200]
+
+import argparse
+import json
+import statistics
+import time
+import chromadb
+import utils
+from analyze_logs import percentile
+from memory_manager import MemoryManager
+
+# (名稱, 是否使用 site 過濾, 檢索模式)
+MODES = [
+    ("vector", False, "vector"),
+    ("vector + site", True, "vector"),
+    ("hybrid", False, "hybrid"),
+    ("hybrid + site", True, "hybrid"),
+]
+
+
+def load_goals(dataset_path: str) -> list:
+    with open(dataset_path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    return [{"id": item["id"], "goal": item["ques"], "site": utils.extract_site(item["web"]), "web_name": item["web_name"]}
+            for item in raw]
+
+
+def run_benchmark(dataset_path: str, k: int, limit: int = None):
+    goals = load_goals(dataset_path)
+    print(f"📚 載入 {len(goals)} 個 goal，建立記憶體內 Collection...")
+
+    memory = MemoryManager(client=chromadb.EphemeralClient(), collection_name="retrieval_benchmark")
+    start = time.perf_counter()
+    memory.add_memories([{
+        "user_goal": g["goal"], "trajectory": [], "outcome": "success",
+        "insight": "", "doc_id": g["id"], "site": g["site"]
+    } for g in goals])
+    print(f"💾 寫入 + 向量化耗時 {time.perf_counter() - start:.2f}s")
+
+    site_of = {g["id"]: g["site"] for g in goals}
+    queries = goals[:limit] if limit else goals
+
+    print(f"\n{'Mode':<16} | {'p50 ms':>7} | {'p95 ms':>7} | {'Hit@1':>6} | {f'Prec@{k}':>7} | {'RAG chars':>9}")
+    print("-" * 70)
+    for name, use_site, mode in MODES:
+        latencies, hit_at_1, precision, rag_chars = [], 0, [], []
+        for g in queries:
+            t0 = time.perf_counter()
+            hits = memory.search_memories(g["goal"], k=k + 1, site=g["site"] if use_site else None, mode=mode)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            hits = [(doc_id, meta) for doc_id, meta in hits if doc_id != g["id"]][:k]
+            same_site = [site_of.get(doc_id) == g["site"] for doc_id, _ in hits]
+            if same_site and same_site[0]: hit_at_1 += 1
+            precision.append(sum(same_site) / k)
+            rag_chars.append(sum(len(meta.get("goal", "")) for _, meta in hits))
+        latencies.sort()
+        # 與 analyze_logs 的延遲報表使用同一個百分位數定義
+        p50, p95 = (percentile(latencies, 0.5), percentile(latencies, 0.95)) if latencies else (0, 0)
+        print(f"{name:<16} | {p50:>7.1f} | {p95:>7.1f} | "
+              f"{hit_at_1 / len(queries):>6.1%} | {statistics.mean(precision):>7.1%} | {statistics.mean(rag_chars):>9.0f}")
+
+    if memory.embedding_cache:
+        print(f"\nEmbedding cache: {memory.embedding_cache.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAG retrieval latency / recall benchmark")
+    parser.add_argument("--dataset", type=str, default="test_dataset.json")
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=None, help="只用前 N 個 goal 當查詢")
+    args = parser.parse_args()
+    run_benchmark(args.dataset, args.k, args.limit)
@@ -5,12 +5,12 @@ import undetected_chromedriver as uc
 import sys
 import time
 from pathlib import Path
-import hashlib
-import numpy as np
-from PIL import Image
 import io
 import os
+import base64
+import re
 import shutil
+import threading
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.action_chains import ActionChains
@@ -18,9 +18,18 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import ElementClickInterceptedException, MoveTargetOutOfBoundsException
-from config import CHROME_PROFILE_NAME
+from config import (CHROME_PROFILE_NAME, ENABLE_REQUEST_BLOCKING, COLLECT_BLOCKING_STATS,
+                    BROWSER_LAUNCH_MODE, BROWSER_WINDOW_SIZE, BROWSER_DEVICE_SCALE_FACTOR,
+                    TEMPLATE_PROFILE_NAME, BROWSER_STARTUP_URL)
 from human_mouse import human_move_to_element
+from network_blocker import RequestBlocker
+import visual_diff
+import page_fingerprint
+from profiler import profiled
 
+# [New] undetected_chromedriver 啟動時會 patch 共用的 chromedriver 執行檔，
+# 多個 Worker 同時啟動會互相踩到，因此啟動階段需要序列化。
+_LAUNCH_LOCK = threading.Lock()
 
 class ActionVerifier:
     """
@@ -29,20 +38,9 @@ class ActionVerifier:
     """
     def __init__(self, driver):
         self.driver = driver
-        self.start_url = driver.current_url
-        self.start_dom_hash = self._get_dom_hash()
+        self.start_fingerprint = page_fingerprint.capture_fingerprint(driver) # [Updated] 共用頁面指紋服務
         self.start_time = time.time()
 
-    def _get_dom_hash(self):
-        """ 計算輕量級 DOM 指紋 (只取 Body 文字的前 5000 字) """
-        try:
-            body_text = self.driver.find_element(By.TAG_NAME, "body").text
-            # 移除空白以減少雜訊
-            clean_text = "".join(body_text.split())[:5000]
-            return hashlib.md5(clean_text.encode('utf-8')).hexdigest()
-        except:
-            return "error"
-
     def verify_action(self, timeout=3.0, check_interval=0.5):
         """
         檢查動作是否生效
@@ -51,31 +49,125 @@ class ActionVerifier:
         end_time = time.time() + timeout
         
         while time.time() < end_time:
-            try:
-                current_url = self.driver.current_url
-                current_hash = self._get_dom_hash()
-                
+            current = page_fingerprint.capture_fingerprint(self.driver)
+            if current is not None:
+                change = current.compare(self.start_fingerprint)
                 # 1. 檢查 URL 是否變了 (最強指標：跳轉)
-                if current_url != self.start_url:
+                if change == page_fingerprint.NAVIGATED:
                     return True, "URL Changed"
                 
-                # 2. 檢查 DOM 是否變了 (次強指標：內容刷新/選單展開)
-                if current_hash != self.start_dom_hash:
+                # 2. 檢查 DOM 是否變了 (次強指標：內容刷新/選單展開/Dialog 開啟)
+                if change in (page_fingerprint.STRUCTURE_CHANGED, page_fingerprint.CONTENT_CHANGED):
                     return True, "DOM Updated"
-                    
-                time.sleep(check_interval)
-            except:
-                pass # 忽略瀏覽器在切換過程中的短暫錯誤
+            # None: 忽略瀏覽器在切換過程中的短暫錯誤
+            time.sleep(check_interval)
             
         return False, "No Change Detected"
     
 
-def initialize_agent() -> uc.Chrome | None:    
-    print("[Browser] 啟動中 (含 CDP 反偵測注入)...")
+# 複製 profile 時略過的檔案：鎖定檔與各種快取 (重建成本低、體積大)
+_PROFILE_COPY_IGNORE = shutil.ignore_patterns(
+    "Singleton*", "lockfile", "*.lock", "*.tmp", "Crashpad",
+    "Cache", "Code Cache", "GPUCache", "ShaderCache", "GrShaderCache", "DawnCache"
+)
+
+# 在頁面載入前注入 JS 覆蓋指紋 (SOTA 等級的反偵測技術)
+STEALTH_JS = """
+    // 1. 覆蓋 navigator.webdriver (雖然 UC 有修，但雙重保險)
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined
+    });
+
+    // 2. 偽造 Chrome 插件列表 (Headless/Automation 通常是空的)
+    // 讓它看起來像有安裝 PDF Viewer 等預設插件
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => [1, 2, 3, 4, 5] 
+    });
+
+    // 3. 偽造 WebGL 供應商 (關鍵！防止被識破是 VM 或 Headless)
+    // 如果你是用 A6000，網站可能會看到 Nvidia，這很好。
+    // 但如果是在 Docker 內部，可能會變成 SwiftShader，這就需要偽裝。
+    try {
+        const getParameter = WebGLRenderingContext.prototype.getParameter;
+        WebGLRenderingContext.prototype.getParameter = function(parameter) {
+            // UNMASKED_VENDOR_WEBGL
+            if (parameter === 37445) return 'Intel Inc.';
+            // UNMASKED_RENDERER_WEBGL
+            if (parameter === 37446) return 'Intel(R) Iris(R) Xe Graphics';
+            return getParameter(parameter);
+        };
+    } catch (err) {}
+
+    // 4. 偽造 window.chrome (有些舊檢測會看這個)
+    if (!window.chrome) {
+        window.chrome = {
+            runtime: {}
+        };
+    }
+    
+    // 5. 偽造 Permissions API (讓通知檢測看起來更自然)
+    const originalQuery = window.navigator.permissions.query;
+    window.navigator.permissions.query = (parameters) => (
+        parameters.name === 'notifications' ?
+        Promise.resolve({ state: Notification.permission }) :
+        originalQuery(parameters)
+    );
+"""
+
+def snapshot_template_profile(profile_name: str = None, template_name: str = TEMPLATE_PROFILE_NAME) -> bool:
+    """
+    [New] 將一個「已知可用」的 profile (已同意 Cookie、已登入等) 存成模板。
+    之後新建或損壞的 profile 會直接複製模板，而不是從零重建。
+    注意：請在該 profile 的 Chrome 關閉後執行。
+    """
+    source_dir = Path.home() / (profile_name or CHROME_PROFILE_NAME)
+    template_dir = Path.home() / template_name
+    if not source_dir.exists():
+        print(f"❌ [Profile] 找不到來源 profile: {source_dir}")
+        return False
+    try:
+        if template_dir.exists():
+            shutil.rmtree(str(template_dir), ignore_errors=True)
+        shutil.copytree(str(source_dir), str(template_dir), ignore=_PROFILE_COPY_IGNORE)
+        print(f"📦 [Profile] 模板已建立: {template_dir}")
+        return True
+    except Exception as e:
+        print(f"❌ [Profile] 建立模板失敗: {e}")
+        return False
+
+def _prepare_profile_dir(user_data_dir: Path, reset: bool = False) -> str:
+    """
+    確保 user-data-dir 可用。回傳來源: "existing" | "template" | "fresh"
+    reset=True 時 (設定檔損壞) 會先刪除再從模板還原。
+    """
+    if reset and user_data_dir.exists():
+        shutil.rmtree(str(user_data_dir), ignore_errors=True)
+    if user_data_dir.exists():
+        return "existing"
+
+    template_dir = Path.home() / TEMPLATE_PROFILE_NAME
+    if template_dir.exists() and template_dir != user_data_dir:
+        try:
+            shutil.copytree(str(template_dir), str(user_data_dir), ignore=_PROFILE_COPY_IGNORE)
+            return "template"
+        except Exception as e:
+            print(f"⚠️ [Profile] 模板複製失敗，改用全新 profile: {e}")
+            shutil.rmtree(str(user_data_dir), ignore_errors=True)
+    return "fresh"
+
+def _build_chrome_options(user_data_dir: Path, launch_mode: str) -> uc.ChromeOptions:
+    # uc 不允許重複使用同一個 ChromeOptions，重試時必須重新建立
     options = uc.ChromeOptions()
-    USER_DATA_DIR = Path.home() / CHROME_PROFILE_NAME
-    options.add_argument(f"--user-data-dir={str(USER_DATA_DIR)}")
-    options.add_argument("--window-size=1920,1080")
+    options.add_argument(f"--user-data-dir={str(user_data_dir)}")
+    width, height = BROWSER_WINDOW_SIZE
+    options.add_argument(f"--window-size={width},{height}")
+
+    if launch_mode == "server":
+        # new-headless 下 window-size 即為 viewport，DPR 固定以確保截圖座標一致
+        options.add_argument(f"--force-device-scale-factor={BROWSER_DEVICE_SCALE_FACTOR}")
+        options.add_argument("--disable-dev-shm-usage") # Docker/小 /dev/shm 環境
+        if sys.platform.startswith("linux") and hasattr(os, "geteuid") and os.geteuid() == 0:
+            options.add_argument("--no-sandbox") # root 身分下 Chrome 無法啟用 sandbox
     
     # [Tips] 增加這行可以減少自動化特徵，但有時會影響擴充功能
     # options.add_argument("--disable-blink-features=AutomationControlled")
@@ -90,83 +182,100 @@ def initialize_agent() -> uc.Chrome | None:
     }
     options.add_experimental_option("prefs", prefs)
     options.add_argument("--disable-infobars")
-    
-    try:
-        driver = uc.Chrome(options=options)
-        
-        # ================= [New] CDP Stealth Injection =================
-        # 這是 SOTA 等級的反偵測技術：在頁面載入前注入 JS 覆蓋指紋
-        
-        stealth_js = """
-            // 1. 覆蓋 navigator.webdriver (雖然 UC 有修，但雙重保險)
-            Object.defineProperty(navigator, 'webdriver', {
-                get: () => undefined
-            });
 
-            // 2. 偽造 Chrome 插件列表 (Headless/Automation 通常是空的)
-            // 讓它看起來像有安裝 PDF Viewer 等預設插件
-            Object.defineProperty(navigator, 'plugins', {
-                get: () => [1, 2, 3, 4, 5] 
-            });
+    if ENABLE_REQUEST_BLOCKING:
+        # 自動播放影片是最大的流量與彈窗來源之一，直接要求使用者手勢才播放
+        options.add_argument("--autoplay-policy=user-gesture-required")
+        if COLLECT_BLOCKING_STATS:
+            # 封鎖統計來自 Performance Log 的 Network 事件
+            options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+            options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+    return options
+
+def _launch_chrome(user_data_dir: Path, launch_mode: str) -> uc.Chrome:
+    options = _build_chrome_options(user_data_dir, launch_mode)
+    with _LAUNCH_LOCK:
+        # headless=True 時 uc 會使用 --headless=new 並修正 UA 中的 "HeadlessChrome"
+        return uc.Chrome(options=options, headless=(launch_mode == "server"))
+
+def _post_launch_setup(driver: uc.Chrome):
+    """ 啟動後的共同設定 (首次啟動與損壞重建都必須執行) """
+    # ================= [New] CDP Stealth Injection =================
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
+        "source": STEALTH_JS
+    })
+    # ===============================================================
+
+    if ENABLE_REQUEST_BLOCKING:
+        try:
+            driver.request_blocker = RequestBlocker(driver, collect_stats=COLLECT_BLOCKING_STATS)
+            driver.request_blocker.enable()
+        except Exception as e:
+            print(f"⚠️ [Network] 請求封鎖啟用失敗，改為不封鎖: {e}")
+            driver.request_blocker = None
 
-            // 3. 偽造 WebGL 供應商 (關鍵！防止被識破是 VM 或 Headless)
-            // 如果你是用 A6000，網站可能會看到 Nvidia，這很好。
-            // 但如果是在 Docker 內部，可能會變成 SwiftShader，這就需要偽裝。
-            try {
-                const getParameter = WebGLRenderingContext.prototype.getParameter;
-                WebGLRenderingContext.prototype.getParameter = function(parameter) {
-                    // UNMASKED_VENDOR_WEBGL
-                    if (parameter === 37445) return 'Intel Inc.';
-                    // UNMASKED_RENDERER_WEBGL
-                    if (parameter === 37446) return 'Intel(R) Iris(R) Xe Graphics';
-                    return getParameter(parameter);
-                };
-            } catch (err) {}
-
-            // 4. 偽造 window.chrome (有些舊檢測會看這個)
-            if (!window.chrome) {
-                window.chrome = {
-                    runtime: {}
-                };
-            }
-            
-            // 5. 偽造 Permissions API (讓通知檢測看起來更自然)
-            const originalQuery = window.navigator.permissions.query;
-            window.navigator.permissions.query = (parameters) => (
-                parameters.name === 'notifications' ?
-                Promise.resolve({ state: Notification.permission }) :
-                originalQuery(parameters)
-            );
-        """
-        
-        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-            "source": stealth_js
-        })
-        # ===============================================================
+    driver.set_page_load_timeout(30)
 
-        driver.set_page_load_timeout(30)
-        time.sleep(1) # 給一點時間讓 CDP 生效
-        
-        # 先去一個檢測網站測試 (可選，或直接去 Google)
-        driver.get("https://www.google.com")
-        
-        return driver
+def initialize_agent(profile_name: str = None, launch_mode: str = None, startup_url: str = BROWSER_STARTUP_URL) -> uc.Chrome | None:
+    """
+    profile_name: 使用者資料夾名稱 (位於家目錄下)。
+    平行測試時每個 Worker 需要獨立的 profile，避免 Chrome 鎖定同一個 user-data-dir。
+    launch_mode: "headed" (預設) 或 "server" (new-headless，給無螢幕的 Linux 主機)。
+    startup_url: 啟動後先前往的網址；傳入 None 可跳過 (呼叫端會自行導航時)。
+    """
+    launch_mode = launch_mode or BROWSER_LAUNCH_MODE
+    print(f"[Browser] 啟動中 (含 CDP 反偵測注入)... Profile: {profile_name or CHROME_PROFILE_NAME}, Mode: {launch_mode}")
+    USER_DATA_DIR = Path.home() / (profile_name or CHROME_PROFILE_NAME)
+    timings = {}
+
+    def mark(phase, since):
+        timings[phase] = round(time.perf_counter() - since, 3)
+        return time.perf_counter()
+
+    t = time.perf_counter()
+    profile_source = _prepare_profile_dir(USER_DATA_DIR)
+    t = mark("prepare_profile", t)
+
+    try:
+        try:
+            driver = _launch_chrome(USER_DATA_DIR, launch_mode)
+        except Exception as e:
+            print(f"❌ 啟動錯誤: {e}")
+            if not ("Expecting ',' delimiter" in str(e) or "JSON" in str(e)):
+                return None
+            print("🧹 偵測到設定檔損壞，正在從模板還原並重試...")
+            t = mark("launch_failed", t)
+            profile_source = _prepare_profile_dir(USER_DATA_DIR, reset=True)
+            t = mark("restore_profile", t)
+            driver = _launch_chrome(USER_DATA_DIR, launch_mode)
+        t = mark("launch", t)
     except Exception as e:
-        print(f"❌ 啟動錯誤: {e}")
-        if "Expecting ',' delimiter" in str(e) or "JSON" in str(e):
-            print("🧹 偵測到設定檔損壞，正在清除並重試...")
-            try:
-                if os.path.exists(str(USER_DATA_DIR)):
-                    shutil.rmtree(str(USER_DATA_DIR), ignore_errors=True)
-                
-                # 再次嘗試啟動
-                driver = uc.Chrome(options=options)
-                # ... (記得補上 CDP 注入代碼) ...
-                return driver
-            except Exception as retry_e:
-                print(f"❌ 重試失敗: {retry_e}")
+        print(f"❌ 重試失敗: {e}")
         return None
 
+    try:
+        _post_launch_setup(driver)
+        t = mark("setup", t)
+    except Exception as e:
+        print(f"❌ 啟動後設定失敗: {e}")
+        try: driver.quit()
+        except: pass
+        return None
+
+    if startup_url:
+        # 先去一個檢測網站測試 (可選，或直接去 Google)；失敗不影響 driver 本身
+        try:
+            driver.get(startup_url)
+        except Exception as e:
+            print(f"⚠️ [Browser] 啟動導航失敗 ({startup_url}): {e}")
+        t = mark("startup_nav", t)
+
+    timings["total"] = round(sum(timings.values()), 3)
+    driver.startup_timings = timings
+    summary = ", ".join(f"{k}={v:.2f}s" for k, v in timings.items())
+    print(f"⏱️ [Browser] 啟動完成 (profile: {profile_source}) {summary}")
+    return driver
+
 
 def get_interactive_elements_coordinates(driver):
     """
@@ -315,6 +424,7 @@ def get_interactive_elements_coordinates(driver):
         print(f"❌ SoM 提取失敗: {e}")
         return []
     
+@profiled("smart_wait_for_change")
 def smart_wait_for_change(driver: webdriver.Chrome, timeout=5.0):
     """
     [New Logic] 等待頁面發生變化 (用於動作執行後)
@@ -349,18 +459,17 @@ def smart_wait_for_change(driver: webdriver.Chrome, timeout=5.0):
     print("⏳ [Browser] No significant change detected (Timeout).")
     return False
 
+@profiled("wait_for_page_stability")
 def wait_for_page_stability(driver: webdriver.Chrome, timeout=10, check_interval=0.5):
     """
-    [Old Logic] 等待頁面變動停止 (用於截圖前)
+    等待頁面變動停止 (用於截圖前)
+    [Updated] 改用 page_fingerprint 的內容指紋 (結構 + 全頁文字)，一次 JS 呼叫、不回傳整頁文字
     """
     print("⏳ [Browser] Waiting for stability...")
     
     def get_dom_hash(d):
-        try:
-            body = d.find_element(By.TAG_NAME, "body").text
-            return hashlib.md5(body[:5000].encode('utf-8')).hexdigest()
-        except:
-            return "error"
+        fingerprint = page_fingerprint.capture_fingerprint(d)
+        return fingerprint.content_key if fingerprint else "error"
 
     end_time = time.time() + timeout
     last_hash = get_dom_hash(driver)
@@ -384,36 +493,28 @@ def wait_for_page_stability(driver: webdriver.Chrome, timeout=10, check_interval
 def _calculate_visual_diff(img_bytes_1, img_bytes_2):
     """
     計算兩張圖片的差異百分比 (0.0 ~ 100.0)
-    使用 Numpy 向量化運算，速度極快 (約 0.02s)
+    [Updated] 改用 visual_diff 的降採樣灰階引擎 (記憶體約為舊版的 1/60)
     """
     try:
-        # 將 bytes 轉為 PIL Image
-        img1 = Image.open(io.BytesIO(img_bytes_1)).convert("RGB")
-        img2 = Image.open(io.BytesIO(img_bytes_2)).convert("RGB")
-        
-        # 確保尺寸一致 (Retina 螢幕有時候會有微小誤差)
-        if img1.size != img2.size:
-            img2 = img2.resize(img1.size)
-            
-        # 轉為 Numpy Array
-        arr1 = np.array(img1, dtype=np.int16) # 使用 int16 避免相減溢出
-        arr2 = np.array(img2, dtype=np.int16)
-        
-        # 計算絕對差值
-        diff = np.abs(arr1 - arr2)
-        
-        # 設定一個閾值，過濾掉 JPEG 壓縮雜訊 (例如 RGB 差異 < 15 視為相同)
-        # 產生一個 Boolean Mask
-        mask = np.any(diff > 15, axis=-1)
-        
-        # 計算變動像素的比例
-        change_ratio = np.sum(mask) / mask.size * 100
-        
-        return change_ratio
+        return visual_diff.diff_frames(visual_diff.VisualFrame(img_bytes_1), visual_diff.VisualFrame(img_bytes_2),
+                                       with_regions=False)["change_ratio"]
     except Exception as e:
         print(f"⚠️ 視覺比對失敗: {e}")
         return 100.0 # 失敗時預設視為有變動，避免誤判死循環
 
+def _diff_visual_frames(frame_before, png_after):
+    """
+    [New] 以已解碼的前一張畫面比對新截圖，回傳 (diff 結果, 新畫面)。
+    新畫面可再作為下一次比對的基準，避免重複解碼。
+    [Fix] 驗證只看變動比例，不計算變動區塊 (with_regions=False)
+    """
+    try:
+        frame_after = visual_diff.VisualFrame(png_after)
+        return visual_diff.diff_frames(frame_before, frame_after, with_regions=False), frame_after
+    except Exception as e:
+        print(f"⚠️ 視覺比對失敗: {e}")
+        return {"change_ratio": 100.0, "regions": []}, None
+
 def _inject_visual_cursor(driver: webdriver.Chrome):
     js = """
     if (!document.getElementById('agent-cursor')) {
@@ -434,6 +535,7 @@ def _move_visual_cursor(driver: webdriver.Chrome, x: int, y: int):
     driver.execute_script(f"let c=document.getElementById('agent-cursor');if(c){{c.style.left='{x-10}px';c.style.top='{y-10}px';}}")
     time.sleep(0.3)
 
+@profiled("dom_alignment")
 def batch_get_element_details(driver, coordinates_list):
     """
     輸入：一個包含 {'x', 'y'} 的列表 (邏輯像素座標)
@@ -557,6 +659,7 @@ def force_remove_element_by_coords(driver, x, y):
      
 # --- 真實操作 (ActionChains) ---
 
+@profiled("scroll")
 def perform_scroll(driver: webdriver.Chrome, direction: str = "down", amount: int = 400):
     try:
         # 紀錄捲動前的位置
@@ -584,45 +687,56 @@ def perform_scroll(driver: webdriver.Chrome, direction: str = "down", amount: in
         print(f"❌ 捲動失敗: {e}")
         return False
 
-def click_element_by_text(driver, text):
+@profiled("scroll_to")
+def scroll_to_document_position(driver: webdriver.Chrome, doc_y: float) -> bool:
     """
-    [Fallback] 當座標點擊失敗時，嘗試用文字內容直接尋找元素並點擊
-    這對 Hugging Face 的 Sort/Filter 按鈕非常有效
+    [New] 直接捲動到文件座標 (CSS px)，讓目標落在視窗上方 1/3 處。
+    搭配 Full-Page 元素地圖使用，取代一次 400px 的盲目捲動。
     """
-    if not text or len(text) < 2: return False
-    
-    # 清洗文字，避免特殊字符導致 XPath 報錯
-    clean_text = text.replace("'", "").replace('"', '').strip()
-    print(f"🔄 [Fallback] 嘗試使用文字搜尋點擊: '{clean_text}'")
-    
     try:
-        # 使用 XPath 尋找包含該文字的可點擊元素
-        # 1. 包含匹配 (針對 'Sort: Trending' 這種變動文字)
-        xpath_contains = f"//*[contains(text(), '{clean_text}')]"
-        
-        elements = driver.find_elements(By.XPATH, xpath_contains)
-        
-        # 過濾出可見且可點擊的元素
-        for el in elements:
-            if el.is_displayed():
-                # 檢查是否為按鈕或連結，或是其子元素
-                tag = el.tag_name.lower()
-                # 往上找一層看是不是包在 button 裡
-                try:
-                    parent = el.find_element(By.XPATH, "./..")
-                    parent_tag = parent.tag_name.lower()
-                except:
-                    parent_tag = ""
-                
-                if tag in ['a', 'button'] or parent_tag in ['a', 'button'] or el.get_attribute('role') == 'button':
-                    print(f"✅ [Fallback] 找到文字對應元素 <{tag}>，執行 JS Click")
-                    driver.execute_script("arguments[0].click();", el)
-                    return True
-        return False
+        new_y = driver.execute_script("""
+            const target = Math.max(0, arguments[0] - window.innerHeight / 3);
+            window.scrollTo({top: target, behavior: 'instant'});
+            return window.scrollY;
+        """, float(doc_y))
+        print(f"🎯 [Scroll] 已跳至文件位置 y={new_y}")
+        return True
     except Exception as e:
-        print(f"❌ 文字救援失敗: {e}")
+        print(f"❌ 定點捲動失敗: {e}")
         return False
 
+@profiled("full_page_capture")
+def capture_full_page_png(driver: webdriver.Chrome, max_height: int = 10000):
+    """
+    [New] 以 CDP captureBeyondViewport 一次截取整頁 (超出視窗的部分)。
+    回傳: (png_bytes, info)；info 含 css_width / css_height / viewport_w / viewport_h
+    max_height: CSS px 上限，避免無限捲動頁面產生超大圖片。
+    """
+    try:
+        metrics = driver.execute_cdp_cmd("Page.getLayoutMetrics", {})
+        content = metrics.get("cssContentSize") or metrics.get("contentSize")
+        viewport = metrics.get("cssLayoutViewport") or metrics.get("layoutViewport")
+        css_width = int(viewport["clientWidth"])
+        css_height = int(min(content["height"], max_height))
+
+        shot = driver.execute_cdp_cmd("Page.captureScreenshot", {
+            "format": "png",
+            "captureBeyondViewport": True,
+            "clip": {"x": 0, "y": 0, "width": css_width, "height": css_height, "scale": 1}
+        })
+        info = {
+            "css_width": css_width,
+            "css_height": css_height,
+            "viewport_w": css_width,
+            "viewport_h": int(viewport["clientHeight"]),
+            "truncated": content["height"] > max_height
+        }
+        return base64.b64decode(shot["data"]), info
+    except Exception as e:
+        print(f"❌ 全頁截圖失敗: {e}")
+        return None, None
+
+@profiled("click")
 def perform_mouse_click(driver: webdriver.Chrome, x: int, y: int, expect_change: bool = True, target_text: str = "") -> bool:
     print(f"--- Action: Click at ({x}, {y}) ---")
     _move_visual_cursor(driver, x, y)
@@ -651,11 +765,11 @@ def perform_mouse_click(driver: webdriver.Chrome, x: int, y: int, expect_change:
         driver.save_screenshot(f"{debug_dir}/click_{timestamp}.png")
     except: pass
 
-    # 1. [Optimization] 預先截圖 (用於後續視覺比對)
-    png_before = None
+    # 1. [Optimization] 預先截圖並解碼成降採樣畫面 (用於後續視覺比對)
+    frame_before = None
     if expect_change:
         try:
-            png_before = driver.get_screenshot_as_png()
+            frame_before = visual_diff.VisualFrame(driver.get_screenshot_as_png())
         except: pass
 
     try:
@@ -750,13 +864,13 @@ def perform_mouse_click(driver: webdriver.Chrome, x: int, y: int, expect_change:
             
             # 2. 視覺比對 (Visual Check)
             diff_ratio = 0.0
-            png_after = None
-            if png_before:
+            frame_after = None
+            if frame_before:
                 try:
                     # 只有當 DOM 沒變時，才需要認真看截圖 (節省資源)
                     if not dom_changed:
-                        png_after = driver.get_screenshot_as_png()
-                        diff_ratio = _calculate_visual_diff(png_before, png_after)
+                        diff, frame_after = _diff_visual_frames(frame_before, driver.get_screenshot_as_png())
+                        diff_ratio = diff["change_ratio"]
                         print(f"👀 [Verifier] 視覺差異: {diff_ratio:.2f}%")
                 except: pass
 
@@ -789,9 +903,10 @@ def perform_mouse_click(driver: webdriver.Chrome, x: int, y: int, expect_change:
                             print("❌ [Verifier] 文字救援找不到對應元素。")
 
                     # 最後手段：再看一次截圖，也許重試後畫面變了但 DOM 沒變 (例如 Canvas)
-                    if png_after:
-                        png_retry = driver.get_screenshot_as_png()
-                        diff_retry = _calculate_visual_diff(png_after, png_retry)
+                    if frame_after:
+                        # 直接沿用已解碼的 frame_after 當基準，不必重新解碼上一張截圖
+                        diff, _ = _diff_visual_frames(frame_after, driver.get_screenshot_as_png())
+                        diff_retry = diff["change_ratio"]
                         print(f"👀 [Verifier] L1/L2 重試後視覺差異: {diff_retry:.2f}%")
                         if diff_retry > 0.5:
                             print("✅ [Verifier] 最終確認：畫面已發生視覺變化。")
@@ -819,6 +934,7 @@ def perform_mouse_click(driver: webdriver.Chrome, x: int, y: int, expect_change:
         except:
             return False
         
+@profiled("wait_for_input_stability")
 def wait_for_input_stability(driver: webdriver.Chrome, min_wait=1.0, timeout=10.0):
     """
     [New] 等待輸入框相關的 DOM 穩定 (Debounce Wait)
@@ -853,6 +969,7 @@ def wait_for_input_stability(driver: webdriver.Chrome, min_wait=1.0, timeout=10.
     print("⚠️ [Browser] 等待穩定超時 (強制繼續).")
     return True
 
+@profiled("type")
 def perform_type(driver: webdriver.Chrome, x: int, y: int, text: str) -> bool:
     print(f"⌨️ [Browser] 正在座標 ({x}, {y}) 輸入: '{text}'")
     
@@ -1085,17 +1202,38 @@ def get_page_state(driver: webdriver.Chrome) -> dict:
     try: return {"url": driver.current_url, "title": driver.title}
     except: return {"url": "unknown", "title": "unknown"}
 
+def sync_request_blocking(driver: webdriver.Chrome, url: str = None):
+    """ [New] 依目前網站更新封鎖規則並累加統計 (未啟用封鎖時為 no-op) """
+    blocker = getattr(driver, "request_blocker", None)
+    if not blocker: return
+    if url is None:
+        try: url = driver.current_url
+        except: url = ""
+    blocker.sync(url)
+
+def get_network_stats(driver: webdriver.Chrome, reset: bool = False) -> dict:
+    """ [New] 取得封鎖統計；reset=True 時回傳後歸零 (用於每個測試案例) """
+    blocker = getattr(driver, "request_blocker", None)
+    if not blocker: return {}
+    stats = blocker.collect_stats()
+    if reset: blocker.reset_stats()
+    return stats
+
+@profiled("wait_for_page_load")
 def wait_for_page_load(driver: webdriver.Chrome):
     try: WebDriverWait(driver, 10).until(lambda d: d.execute_script("return document.readyState") == "complete"); time.sleep(0.5)
     except: pass
 
+@profiled("wait_for_url_change")
 def wait_for_url_change(driver: webdriver.Chrome, old_url: str):
     try: WebDriverWait(driver, 10).until(lambda d: d.current_url != old_url)
     except: pass
 
+@profiled("goto_url")
 def perform_goto_url(driver: webdriver.Chrome, url: str) -> bool:
     print(f"🚀 [Smart Jump] Agent 決定直接跳轉至: {url}")
     try:
+        sync_request_blocking(driver, url) # 先套用目標網站的封鎖規則
         driver.get(url)
         # 跳轉後通常需要等待載入
         wait_for_page_load(driver)
@@ -1104,37 +1242,236 @@ def perform_goto_url(driver: webdriver.Chrome, url: str) -> bool:
         print(f"❌ 跳轉失敗: {e}")
         return False
     
+# [New] 單次往返的文字定位引擎：在頁面內完成正規化、比對、排名與幾何計算
+_TEXT_LOCATOR_JS = """
+const query = arguments[0];
+const norm = (s) => (s || "").replace(/\\s+/g, " ").trim().toLowerCase();
+const q = norm(query);
+if (!q) return null;
+const qTokens = q.split(" ").filter(t => t.length > 1);
+
+const SELECTOR = 'a, button, summary, label, select, input[type="button"], input[type="submit"], ' +
+    '[role="button"], [role="link"], [role="menuitem"], [role="tab"], [role="option"], ' +
+    '[role="checkbox"], [role="radio"], [onclick]';
+
+function textScore(label) {
+    if (!label) return 0;
+    if (label === q) return 100;
+    if (label.startsWith(q)) return 80 + 10 * (q.length / label.length);
+    if (label.includes(q)) return 60 + 20 * (q.length / label.length);
+    // 反向包含 (元素文字是查詢的一部分)：必須是完整單字，且至少佔查詢一半長度，
+    // 避免 "google maps" 命中 "go" / "map" / "le" 這類短標籤
+    if (label.length >= q.length * 0.5 && (" " + q + " ").includes(" " + label + " ")) return 40 + 20 * (label.length / q.length);
+    if (qTokens.length > 0) {
+        const hits = qTokens.filter(t => label.includes(t)).length;
+        const ratio = hits / qTokens.length;
+        if (ratio >= 0.5) return 50 * ratio;
+    }
+    return 0;
+}
+
+const winW = window.innerWidth, winH = window.innerHeight;
+const hasCheckVisibility = typeof Element.prototype.checkVisibility === 'function';
+let best = null;
+
+for (const el of document.querySelectorAll(SELECTOR)) {
+    // 1. 便宜的文字比對先做 (textContent 不觸發 layout)
+    const labels = [
+        el.textContent, el.getAttribute("aria-label"), el.getAttribute("title"), el.value
+    ];
+    let score = 0, matched = "";
+    for (const raw of labels) {
+        if (typeof raw !== "string") continue;
+        const label = norm(raw.slice(0, 300));
+        const s = textScore(label);
+        if (s > score) { score = s; matched = label; }
+    }
+    if (score < 40) continue;
+    if (best && score + 15 < best.score) continue; // 不可能超越目前最佳
+
+    // 2. 只對候選者做可見性與幾何計算
+    if (hasCheckVisibility && !el.checkVisibility({checkOpacity: true, checkVisibilityCSS: true})) continue;
+    const rect = el.getBoundingClientRect();
+    if (rect.width < 2 || rect.height < 2) continue;
+
+    const cx = rect.left + rect.width / 2, cy = rect.top + rect.height / 2;
+    const inViewport = cx >= 0 && cx < winW && cy >= 0 && cy < winH;
+    if (inViewport) {
+        score += 10;
+        const topEl = document.elementFromPoint(cx, cy);
+        if (topEl && !(topEl === el || el.contains(topEl) || topEl.contains(el))) score -= 15; // 被遮擋
+    }
+    // 同分時偏好文字較短 (較精準) 的元素
+    if (!best || score > best.score || (score === best.score && matched.length < best.text.length)) {
+        best = {
+            element: el, score: score, text: matched.slice(0, 100),
+            tag: el.tagName.toLowerCase(), x: cx, y: cy,
+            w: rect.width, h: rect.height, in_viewport: inViewport
+        };
+    }
+}
+return best;
+"""
+
+def _clean_locator_text(text: str) -> str:
+    """ 移除 Visual-DOM 對齊時附加的描述 (如 ' [Attr: ...]'、' (href: ...)') """
+    text = re.sub(r"\s*\[Attr:[^\]]*\]", "", text)
+    text = re.sub(r"\s*\((href|expanded|state|role|label):.*\)\s*$", "", text)
+    return text.strip()
+
+def locate_element_by_text(driver: webdriver.Chrome, text: str) -> dict | None:
+    """
+    [New] 在頁面內一次完成：正規化 (不分大小寫/空白)、可見互動元素比對、排名。
+    回傳最佳候選 {element, score, text, tag, x, y, w, h, in_viewport} 或 None。
+    """
+    query = _clean_locator_text(text or "")
+    if len(query) < 2: return None
+    try:
+        return driver.execute_script(_TEXT_LOCATOR_JS, query)
+    except Exception as e:
+        print(f"❌ 文字定位失敗: {e}")
+        return None
+
 def click_element_by_text(driver: webdriver.Chrome, text: str) -> bool:
     """
     [通用備案] DOM 文字點擊：搜尋包含特定文字的可見元素並點擊。
-    解決視覺模型看不準浮動選單文字的問題。
+    解決視覺模型看不準浮動選單文字的問題 (例如 Hugging Face 的 Sort/Filter 按鈕)。
     """
     print(f"--- Fallback: Attempting to click by text '{text}' ---")
-    try:
-        # 使用 XPath 尋找包含文字的元素 (不區分大小寫處理比較複雜，這裡先做簡易版)
-        # 尋找所有包含該文字的元素
-        xpath = f"//*[contains(text(), '{text}')] | //*[contains(@aria-label, '{text}')] | //*[contains(@title, '{text}')]"
-        elements = driver.find_elements(By.XPATH, xpath)
-        
-        target_element = None
-        
-        # 過濾：只找「顯示中 (Displayed)」且「可點擊」的元素
-        for el in elements:
-            if el.is_displayed():
-                # 這裡也可以復用之前的 "Smart Bubble-up" 邏輯找父層
-                target_element = el
-                break
-        
-        if not target_element:
-            print(f"❌ DOM 中找不到可見的文字: {text}")
-            return False
+    match = locate_element_by_text(driver, text)
+    if not match:
+        print(f"❌ DOM 中找不到可見的文字: {text}")
+        return False
 
-        # 執行點擊
+    target_element = match['element']
+    print(f"✅ [Text Locator] 命中 <{match['tag']}> '{match['text']}' (score {match['score']:.0f})")
+    try:
+        if not match['in_viewport']:
+            driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", target_element)
         actions = ActionChains(driver)
         actions.move_to_element(target_element).pause(0.2).click().perform()
         print(f"✅ DOM 文字點擊成功: {text}")
         return True
+    except Exception as e:
+        # ActionChains 失敗 (例如被遮擋或超出範圍) 時改用 JS Click
+        print(f"⚠️ ActionChains 點擊失敗 ({e})，改用 JS Click")
+        try:
+            driver.execute_script("arguments[0].click();", target_element)
+            return True
+        except Exception as js_e:
+            print(f"❌ DOM 文字點擊失敗: {js_e}")
+            return False
 
+# [New] 為 Skill 錄製產生「可重播」的元素定位資訊 (CSS selector + 文字 + role + 相對位置)
+_DESCRIBE_ELEMENT_JS = """
+const x = arguments[0], y = arguments[1];
+let el = document.elementFromPoint(x, y);
+if (!el) return null;
+const interactive = el.closest('a, button, input, select, textarea, summary, label, [role], [onclick]');
+if (interactive) el = interactive;
+
+function selectorFor(node) {
+    const tag = node.tagName.toLowerCase();
+    if (node.id && document.querySelectorAll('#' + CSS.escape(node.id)).length === 1) return '#' + CSS.escape(node.id);
+    for (const attr of ['data-testid', 'name', 'aria-label', 'placeholder']) {
+        const value = node.getAttribute(attr);
+        if (!value) continue;
+        const sel = tag + '[' + attr + '="' + CSS.escape(value) + '"]';
+        if (document.querySelectorAll(sel).length === 1) return sel;
+    }
+    // 往上最多 5 層，以 nth-of-type 組出路徑；遇到有 id 的祖先就停
+    const parts = [];
+    let cur = node;
+    for (let depth = 0; cur && cur !== document.body && depth < 5; depth++) {
+        let part = cur.tagName.toLowerCase();
+        if (cur.id) { parts.unshift('#' + CSS.escape(cur.id)); break; }
+        const parent = cur.parentElement;
+        if (parent) {
+            const same = Array.from(parent.children).filter(c => c.tagName === cur.tagName);
+            if (same.length > 1) part += ':nth-of-type(' + (same.indexOf(cur) + 1) + ')';
+        }
+        parts.unshift(part);
+        cur = parent;
+    }
+    return parts.join(' > ');
+}
+
+const rect = el.getBoundingClientRect();
+const doc = document.documentElement;
+const text = (el.innerText || el.value || el.getAttribute('aria-label') || el.getAttribute('placeholder') || '')
+    .replace(/\\s+/g, ' ').trim().slice(0, 80);
+return {
+    selector: selectorFor(el),
+    text: text,
+    tag: el.tagName.toLowerCase(),
+    role: el.getAttribute('role') || '',
+    rel_x: (rect.left + rect.width / 2) / Math.max(1, window.innerWidth),
+    rel_y: (rect.top + window.scrollY + rect.height / 2) / Math.max(1, doc.scrollHeight)
+};
+"""
+
+# [New] 依錄製的定位資訊找回元素：selector 命中多個時以文字與相對位置挑選，並捲到視窗中央
+_RESOLVE_LOCATOR_JS = """
+const loc = arguments[0];
+const norm = (s) => (s || '').replace(/\\s+/g, ' ').trim().toLowerCase();
+let candidates = [];
+try { candidates = Array.from(document.querySelectorAll(loc.selector)); } catch (e) {}
+const doc = document.documentElement;
+let best = null, bestScore = -1;
+for (const el of candidates) {
+    const rect = el.getBoundingClientRect();
+    if (rect.width < 2 || rect.height < 2) continue;
+    let score = 0;
+    const text = norm(el.innerText || el.value || el.getAttribute('aria-label') || el.getAttribute('placeholder'));
+    if (loc.text) {
+        if (text === norm(loc.text)) score += 2;
+        else if (text && (text.includes(norm(loc.text)) || norm(loc.text).includes(text))) score += 1;
+        else if (candidates.length > 1) continue;
+    }
+    if (loc.tag && el.tagName.toLowerCase() === loc.tag) score += 1;
+    const relX = (rect.left + rect.width / 2) / Math.max(1, window.innerWidth);
+    const relY = (rect.top + window.scrollY + rect.height / 2) / Math.max(1, doc.scrollHeight);
+    score -= Math.hypot(relX - loc.rel_x, relY - loc.rel_y);
+    if (score > bestScore) { bestScore = score; best = el; }
+}
+if (!best) return null;
+best.scrollIntoView({block: 'center'});
+const r = best.getBoundingClientRect();
+return {x: r.left + r.width / 2, y: r.top + r.height / 2, via: 'selector'};
+"""
+
+@profiled("describe_element")
+def describe_element_at(driver: webdriver.Chrome, x: int, y: int) -> dict | None:
+    """ [New] 取得邏輯座標 (x, y) 上互動元素的定位資訊 {selector, text, tag, role, rel_x, rel_y} """
+    try:
+        return driver.execute_script(_DESCRIBE_ELEMENT_JS, x, y)
     except Exception as e:
-        print(f"❌ DOM 文字點擊失敗: {e}")
-        return False
\ No newline at end of file
+        print(f"⚠️ 元素定位資訊擷取失敗: {e}")
+        return None
+
+@profiled("resolve_locator")
+def resolve_element_locator(driver: webdriver.Chrome, locator: dict) -> tuple | None:
+    """
+    [New] 以錄製的定位資訊找回元素，回傳視窗內中心點 (x, y)；找不到回傳 None。
+    順序：CSS selector (+文字/位置驗證) -> 文字定位引擎 (locate_element_by_text)。
+    """
+    if not locator: return None
+    try:
+        hit = driver.execute_script(_RESOLVE_LOCATOR_JS, locator)
+    except Exception:
+        hit = None
+    if hit:
+        return int(hit['x']), int(hit['y'])
+
+    match = locate_element_by_text(driver, locator.get('text', ''))
+    if not match or match['score'] < 60: return None
+    if not match['in_viewport']:
+        driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", match['element'])
+        match = locate_element_by_text(driver, locator.get('text', ''))
+        if not match: return None
+    return int(match['x']), int(match['y'])
+
+if __name__ == "__main__":
+    # 用法: python browser_controller.py --snapshot-template [profile_name]
+    if len(sys.argv) >= 2 and sys.argv[1] == "--snapshot-template":
+        snapshot_template_profile(sys.argv[2] if len(sys.argv) > 2 else None)
@@ -15,12 +15,95 @@ OPENAI_MODEL_NAME = "gpt-4o" # 建議使用 gpt-4o 或 gpt-4-turbo
 # --- (Embedding / RAG) 設定 ---
 EMBEDDING_SERVER_URL = "http://yourserver.ip:11434"
 EMBEDDING_MODEL_NAME = "bge-large:latest"
+EMBEDDING_BACKEND = "ollama" # "ollama" | "fastembed" (本機 CPU 量化模型) | "hashing" (純 numpy，零依賴)
+EMBEDDING_FALLBACK_BACKEND = "hashing" # 主要後端不可用時改用 (設為 None 則不 fallback)
+EMBEDDING_BATCH_SIZE = 32 # 每次送往後端的文字筆數
+FASTEMBED_MODEL_NAME = "BAAI/bge-small-en-v1.5"
+HASHING_EMBEDDING_DIM = 512
 CHROMA_DB_PATH = "./chroma_memory_db"
+ENABLE_EMBEDDING_CACHE = True
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite3" # 本地向量快取 (以內容雜湊 + 模型名稱為 Key)
+MEMORY_WRITE_BATCH_SIZE = 8 # 背景寫入佇列每批最多幾筆 (一次 embed + 一次 upsert)
+MEMORY_WRITE_MAX_RETRIES = 3 # 寫入失敗重試次數 (指數退避)
+MEMORY_FLUSH_TIMEOUT = 30 # 結束時等待佇列寫完的秒數上限
+MEMORY_INIT_RETRY_INTERVAL = 30 # 共用記憶服務初始化失敗後 (Ollama / Chroma 尚未啟動)，隔多少秒才再重試
+
+# --- 記憶壓縮 (memory_compaction.py) ---
+MEMORY_DUPLICATE_THRESHOLD = 0.92 # 目標向量餘弦相似度 >= 此值視為同一目標群
+MEMORY_MAX_PER_CLUSTER = 3 # 每個目標群最多保留幾筆
+MEMORY_FAILURE_TTL_DAYS = 14 # 失敗教訓的保存天數
+MEMORY_MAX_RECORDS = 2000 # Collection 總筆數上限
+MEMORY_TRAJECTORY_MAX_CHARS = 4000 # 軌跡 metadata 的字數上限
+MEMORY_COMPACT_EVERY_WRITES = 50 # 背景佇列每寫入 N 筆自動壓縮一次 (0 = 關閉)
 
 # --- (OmniParser & UI-TARS) 設定 ---
 OMNIPARSER_API_URL = "http://yourserver.ip:port/process_image"
 UI_TARS_API_URL = "http://yourserver.ip:port/v1/chat/completions"
+DEBUG_OMNI_PARSER = False # 印出 OmniParser 原始回應與逐行解析錯誤
+
+# --- 元素縮減 (element_map.py: 去重 + 相關性排序) ---
+ELEMENT_NMS_IOU = 0.7 # 兩框 IoU 超過此值視為同一個元素
+ELEMENT_CONTAINMENT_RATIO = 0.9 # 小框面積有此比例落在大框內，視為被包含
+ELEMENT_CONTAINER_MIN_CHILDREN = 3 # 包含這麼多個其他框的大框視為容器 (移除)
+ELEMENT_PROMPT_LIMIT = 50 # 送給大腦 (與 SoM 標註) 的元素上限
 
 # --- 瀏覽器設定 ---
 DEBUG_PORT = 9222
-CHROME_PROFILE_NAME = "ChromeDebugProfile"
\ No newline at end of file
+CHROME_PROFILE_NAME = "ChromeDebugProfile"
+BROWSER_LAUNCH_MODE = "headed" # "headed" | "server" (new-headless，無螢幕的 Linux 主機)
+BROWSER_WINDOW_SIZE = (1920, 1080)
+BROWSER_DEVICE_SCALE_FACTOR = 1 # server 模式固定 DPR，確保截圖與座標換算一致
+TEMPLATE_PROFILE_NAME = "ChromeDebugProfile_template" # 已知可用的 profile 模板 (新建/損壞時複製)
+BROWSER_STARTUP_URL = "https://www.google.com" # 設為 None 可跳過啟動導航
+
+# --- 網路資源封鎖 (CDP Network.setBlockedURLs) ---
+ENABLE_REQUEST_BLOCKING = True
+# "off": 只封鎖廣告/追蹤/分析 | "media": 再加上影音檔 | "lite": 再加上字型與 GIF 動圖
+RESOURCE_THROTTLE_MODE = "media"
+# 各網站例外規則: {"allow": [不封鎖的類別], "deny": [額外封鎖的 URL pattern]}
+BLOCKING_SITE_RULES = {
+    "youtube.com": {"allow": ["media"]},
+    "bilibili.com": {"allow": ["media"]},
+}
+COLLECT_BLOCKING_STATS = True # 透過 Performance Log 統計封鎖數量
+
+# --- Full-Page 感知 (整頁截圖 + 分塊平行解析) ---
+FULL_PAGE_PERCEPTION = False # 開啟後每個新頁面只解析一次，捲動時直接沿用元素地圖
+FULL_PAGE_MAX_HEIGHT = 10000 # 整頁截圖的 CSS px 上限
+FULL_PAGE_TILE_OVERLAP = 0.1 # 相鄰分塊重疊比例 (避免元素被切斷)
+FULL_PAGE_PARSE_WORKERS = 4 # 同時送往 OmniParser 的分塊數
+
+# --- Skill 快取 (skill_cache.py) ---
+SKILL_REPLAY_ENABLED = True
+SKILL_STORE_PATH = "./skill_store.json"
+SKILL_MATCH_THRESHOLD = 0.8 # 目標相似度 (單字序列 difflib ratio) 門檻
+SKILL_MAX_PER_SITE = 20
+SKILL_CAPTURE_ENABLED = True # 錄製新 Skill (關閉時仍可重播既有 Skill，且不再為每次點擊多做一次定位 JS 呼叫)
+SKILL_MAX_STEPS = 15 # 超過此步數的任務不錄製 (長軌跡很難完整重播)，之後的動作也不再擷取定位資訊
+
+# --- 計畫快取 (plan_cache.py) ---
+PLAN_CACHE_ENABLED = True
+PLAN_CACHE_PATH = "./plan_cache.json"
+PLAN_CACHE_SIMILARITY = 0.9 # 目標向量 cosine 相似度門檻
+PLAN_CACHE_LEXICAL_SIMILARITY = 0.8 # 記憶模組不可用時改用字面相似度的門檻
+PLAN_CACHE_MAX_ENTRIES = 500 # 超過時淘汰最久未使用的計畫 (LRU)
+PLAN_CACHE_TTL_DAYS = 7 # 網站改版後舊計畫可能失效
+
+# --- 背景工作 (任務啟動 RAG / Planner 平行化) ---
+RETRIEVAL_POOL_WORKERS = 4 # RAG 檢索專用 (短任務，不與 Planner 排隊)
+PLANNER_POOL_WORKERS = 8 # 初始計畫 + 預先重新規劃；平行模式建議 >= 2 x workers
+TASK_START_RAG_WAIT = 10 # 第一次呼叫大腦前最多等待 RAG 檢索的秒數
+TASK_START_PLAN_WAIT = 15 # 最多等待初始計畫的秒數；逾時先用暫定計畫，正式計畫送達後再替換
+
+# --- 預先重新規劃 (卡關徵兆出現時背景呼叫 replan_task) ---
+REPLAN_SIGNAL_THRESHOLD = 2 # 累積幾個徵兆 (頁面未變 / 連續捲動 / 點擊失敗 / Grounding 失敗) 就開始背景規劃
+REPLAN_WAIT_TIMEOUT = 60 # 迴圈偵測觸發時，最多等背景規劃多久
+
+# --- SoM 標註圖 (som_renderer.py) ---
+SOM_IMAGE_FORMAT = "JPEG" # "JPEG" | "WEBP" | "PNG" (本地 GPT-OSS / Ollama 不一定支援 WebP)
+SOM_IMAGE_QUALITY = 80
+SOM_MAX_WIDTH = 1600 # 截圖超過此寬度時等比例縮小 (None = 原尺寸)；框線與標籤字級不變
+SOM_FONT_SIZE = 16
+
+# --- 效能剖析 (profiler.py: 每一步的巢狀延遲 Span，寫入 TestLogger 的 step["timings"]) ---
+PROFILER_ENABLED = True
@@ -0,0 +1,215 @@
+# element_map.py
+# [New] 陣列化的元素地圖
+# 職責：保留原本的元素 dict 清單 (text / tag / id 照舊存取)，另外維護平行的 numpy 座標陣列，
+#       讓中心點、座標縮放、裁切、ID 查找與空間查詢 (點 / 矩形) 不必在 Python 迴圈裡逐一計算。
+
+import re
+import numpy as np
+from hybrid_retrieval import tokenize
+from config import ELEMENT_NMS_IOU, ELEMENT_CONTAINMENT_RATIO, ELEMENT_CONTAINER_MIN_CHILDREN
+
+GRID_CELL_SIZE = 128 # 空間索引的格子大小 (px)
+INPUT_TAGS = {"input", "textarea", "select"}
+INTERACTIVE_TAGS = INPUT_TAGS | {"a", "button", "option", "label", "summary"}
+# Visual-DOM 對齊時附加在文字後面的描述 (" [Attr: ...]" / " (href: ... | role: ...)")
+_ALIGN_SUFFIX_RE = re.compile(r" \[Attr: .*$| \((?:href|expanded|state|role|label): .*\)$")
+
+
+class ElementMap:
+    """
+    elements: 元素 dict 清單 {"id", "x", "y", "w", "h", "tag", "text", ...}
+    boxes   : (n, 4) float32 陣列 [x, y, w, h]，與 elements 一一對應
+    元素 dict 與原本共用 (不複製)，Visual-DOM 對齊改寫 text / tag 後，快取中的地圖也會一起更新。
+    座標 (x, y, w, h) 建立後視為不可變；要換座標請建立新的 ElementMap。
+    """
+    def __init__(self, elements=None):
+        self.elements = list(elements or [])
+        self.boxes = np.array([[e['x'], e['y'], e['w'], e['h']] for e in self.elements],
+                              dtype=np.float32).reshape(-1, 4)
+        self._id_index = {str(e['id']): i for i, e in enumerate(self.elements)}
+        self._grid = None
+
+    @classmethod
+    def wrap(cls, elements) -> "ElementMap":
+        """ 已經是 ElementMap 就直接回傳，否則由 dict 清單建立 """
+        return elements if isinstance(elements, ElementMap) else cls(elements)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __iter__(self):
+        return iter(self.elements)
+
+    def __getitem__(self, index) -> dict:
+        return self.elements[index]
+
+    def to_list(self) -> list:
+        return list(self.elements)
+
+    # --- ID 查找 ---
+    def index_of(self, element_id) -> int | None:
+        return self._id_index.get(str(element_id))
+
+    def get(self, element_id) -> dict | None:
+        index = self.index_of(element_id)
+        return None if index is None else self.elements[index]
+
+    # --- 向量化幾何 ---
+    def corners(self) -> np.ndarray:
+        """ (n, 4) [x1, y1, x2, y2] """
+        return np.concatenate([self.boxes[:, :2], self.boxes[:, :2] + self.boxes[:, 2:]], axis=1)
+
+    def centers(self) -> np.ndarray:
+        """ (n, 2) 截圖像素座標的中心點 """
+        return self.boxes[:, :2] + self.boxes[:, 2:] / 2
+
+    def areas(self) -> np.ndarray:
+        return self.boxes[:, 2] * self.boxes[:, 3]
+
+    def logical_centers(self, scale_x: float, scale_y: float) -> np.ndarray:
+        """ (n, 2) int 中心點，換算為 Selenium 使用的邏輯 (CSS) 像素 """
+        return (self.centers() / np.array([scale_x, scale_y], dtype=np.float32)).astype(np.int64)
+
+    def logical_center(self, index: int, scale_x: float, scale_y: float) -> tuple:
+        x, y, w, h = self.boxes[index]
+        return int((x + w / 2) / scale_x), int((y + h / 2) / scale_y)
+
+    def in_bounds_mask(self, width: float, height: float) -> np.ndarray:
+        """ 左上角落在畫面內的元素 """
+        x, y = self.boxes[:, 0], self.boxes[:, 1]
+        return (x >= 0) & (y >= 0) & (x <= width) & (y <= height)
+
+    def clipped_corners(self, width: float, height: float) -> np.ndarray:
+        """ 裁切到畫面範圍內的 [x1, y1, x2, y2] """
+        return np.clip(self.corners(), 0, [width, height, width, height])
+
+    def tag_mask(self, tags) -> np.ndarray:
+        tags = set(tags)
+        return np.fromiter((e.get('tag') in tags for e in self.elements), dtype=bool, count=len(self.elements))
+
+    def subset(self, indices) -> "ElementMap":
+        """ 依 index 陣列或布林遮罩取出子集 (保留原本的 ID 與順序) """
+        indices = np.asarray(indices)
+        indices = np.flatnonzero(indices) if indices.dtype == bool else indices.astype(np.int64)
+        sub = ElementMap.__new__(ElementMap)
+        sub.elements = [self.elements[i] for i in indices.tolist()]
+        sub.boxes = self.boxes[indices] if len(indices) else np.zeros((0, 4), dtype=np.float32)
+        sub._id_index = {str(e['id']): i for i, e in enumerate(sub.elements)}
+        sub._grid = None
+        return sub
+
+    # --- 空間索引 (均勻格網) ---
+    def _grid_index(self) -> dict:
+        if self._grid is None:
+            grid = {}
+            cells = np.floor_divide(self.corners(), GRID_CELL_SIZE).astype(np.int64)
+            for i, (cx1, cy1, cx2, cy2) in enumerate(cells.tolist()):
+                for cx in range(cx1, cx2 + 1):
+                    for cy in range(cy1, cy2 + 1):
+                        grid.setdefault((cx, cy), []).append(i)
+            self._grid = grid
+        return self._grid
+
+    def at_point(self, x: float, y: float) -> list:
+        """ 包含該點的元素 index，面積由小到大 (最內層的元素在最前面) """
+        candidates = self._grid_index().get((int(x // GRID_CELL_SIZE), int(y // GRID_CELL_SIZE)))
+        if not candidates: return []
+        idx = np.array(candidates)
+        x1, y1, x2, y2 = self.corners()[idx].T
+        hit = idx[(x1 <= x) & (x <= x2) & (y1 <= y) & (y <= y2)]
+        return hit[np.argsort(self.areas()[hit], kind="stable")].tolist()
+
+    def overlapping(self, box) -> list:
+        """ 與矩形 [x1, y1, x2, y2] 相交的元素 index (依原順序) """
+        bx1, by1, bx2, by2 = box
+        grid = self._grid_index()
+        candidates = set()
+        for cx in range(int(bx1 // GRID_CELL_SIZE), int(bx2 // GRID_CELL_SIZE) + 1):
+            for cy in range(int(by1 // GRID_CELL_SIZE), int(by2 // GRID_CELL_SIZE) + 1):
+                candidates.update(grid.get((cx, cy), ()))
+        if not candidates: return []
+        idx = np.array(sorted(candidates))
+        x1, y1, x2, y2 = self.corners()[idx].T
+        return idx[(x1 < bx2) & (bx1 < x2) & (y1 < by2) & (by1 < y2)].tolist()
+
+
+# --- [New] 去重與排序 (縮減送給大腦的元素) ---
+def _normalized_text(el: dict) -> str:
+    """ 去掉對齊時附加的 [Attr: ...] / (href: ...)，只比較可見文字 """
+    text = _ALIGN_SUFFIX_RE.sub("", el.get('text', ''))
+    return " ".join(text.lower().split())
+
+
+def dedupe_elements(emap: ElementMap, iou_threshold: float = ELEMENT_NMS_IOU,
+                    containment_ratio: float = ELEMENT_CONTAINMENT_RATIO,
+                    container_min_children: int = ELEMENT_CONTAINER_MIN_CHILDREN) -> ElementMap:
+    """
+    OmniParser 常對同一個控制項給出多個框 (圖示 + 文字 + 外框)。在 Visual-DOM 對齊之後：
+    1. NMS：IoU 超過門檻的框只留優先度最高的 (輸入框 > 互動元素 > 有文字)
+    2. 容器：內含 container_min_children 個以上其他框的大框 (卡片 / 列表外框) 移除，保留裡面的控制項
+    3. 包含合併：被包住、且文字與外框相同 (或沒有文字) 的小框移除，點外框即可
+    輸入框一律保留；其餘元素的 ID 不變 (SoM 標籤與大腦回傳的 element_id 仍對得上)。
+    """
+    n = len(emap)
+    if n < 2: return emap
+    corners = emap.corners()
+    areas = np.maximum(emap.areas(), 1.0)
+    ix = np.clip(np.minimum(corners[:, None, 2], corners[None, :, 2]) - np.maximum(corners[:, None, 0], corners[None, :, 0]), 0, None)
+    iy = np.clip(np.minimum(corners[:, None, 3], corners[None, :, 3]) - np.maximum(corners[:, None, 1], corners[None, :, 1]), 0, None)
+    inter = ix * iy
+    np.fill_diagonal(inter, 0)
+    iou = inter / (areas[:, None] + areas[None, :] - inter)
+
+    is_input = emap.tag_mask(INPUT_TAGS)
+    texts = [_normalized_text(el) for el in emap]
+    has_text = np.array([bool(t) for t in texts])
+    priority = is_input * 4.0 + emap.tag_mask(INTERACTIVE_TAGS) * 2.0 + has_text * 1.0
+
+    # 1. NMS (依優先度由高到低；同分時較小的框優先，通常是真正的控制項)
+    order = np.lexsort((areas, -priority))
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    keep = np.ones(n, dtype=bool)
+    for i in order.tolist():
+        if not keep[i]: continue
+        keep &= ~((iou[i] >= iou_threshold) & (rank > rank[i]))
+    nms_removed = n - int(keep.sum())
+
+    # contained[i, j]: i 大部分落在較大的 j 裡面
+    contained = (inter / areas[:, None] >= containment_ratio) & (areas[None, :] > areas[:, None])
+    contained &= keep[:, None] & keep[None, :]
+
+    # 2. 容器
+    children = contained.sum(axis=0)
+    containers = (children >= container_min_children) & ~is_input & keep
+    keep &= ~containers
+    contained &= keep[None, :]
+
+    # 3. 與外框重複的小框
+    for i, j in np.argwhere(contained).tolist():
+        if keep[i] and not is_input[i] and (not texts[i] or texts[i] == texts[j]):
+            keep[i] = False
+
+    if keep.all(): return emap
+    print(f"🧹 [Elements] 去重: {n} -> {int(keep.sum())} (重疊 {nms_removed}、容器 {int(containers.sum())}、"
+          f"重複子框 {n - int(keep.sum()) - nms_removed - int(containers.sum())})")
+    return emap.subset(keep)
+
+
+def rank_elements(emap: ElementMap, goal: str, limit: int, viewport_height: float = None) -> ElementMap:
+    """
+    元素超過 limit 時依相關性保留前 limit 個：目標關鍵字命中 > 互動元素 > 畫面位置 (上方優先) > 有文字。
+    輸入框一律保留；保留下來的元素維持原本順序與 ID。
+    """
+    n = len(emap)
+    if n <= limit: return emap
+    goal_tokens = {t for t in tokenize(goal) if len(t) > 2 or not t.isascii()}
+    keyword = np.array([len(goal_tokens.intersection(tokenize(_normalized_text(el)))) for el in emap], dtype=np.float32)
+    has_text = np.array([len(_normalized_text(el)) > 1 for el in emap])
+    height = viewport_height or max(float(emap.corners()[:, 3].max()), 1.0)
+    position = 1.0 - np.clip(emap.centers()[:, 1] / height, 0.0, 1.0)
+
+    score = (3.0 * np.minimum(keyword, 3) / 3 + 1.5 * emap.tag_mask(INTERACTIVE_TAGS)
+             + 1.0 * position + 0.5 * has_text + 100.0 * emap.tag_mask(INPUT_TAGS))
+    top = np.sort(np.argsort(-score, kind="stable")[:limit])
+    return emap.subset(top)
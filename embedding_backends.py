@@ -0,0 +1,196 @@
+# embedding_backends.py
+# [New] 可替換的 Embedding 後端
+# 職責：統一 embed_query / embed_documents 介面，讓記憶模組不必綁死遠端 Ollama。
+#   - OllamaBackend   : 遠端 Ollama (預設，批次呼叫 /api/embed)
+#   - FastEmbedBackend: 行程內 CPU 量化小模型 (需 pip install fastembed)
+#   - HashingBackend  : 純 numpy 的特徵雜湊向量 (零依賴、零網路，品質較低的最後防線)
+# 用法: python embedding_backends.py  (各後端延遲比較)
+
+import re
+import time
+from abc import ABC, abstractmethod
+import zlib
+import numpy as np
+import requests
+from hybrid_retrieval import tokenize
+from config import (EMBEDDING_SERVER_URL, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_FALLBACK_BACKEND,
+                    EMBEDDING_BATCH_SIZE, FASTEMBED_MODEL_NAME, HASHING_EMBEDDING_DIM)
+
+DEFAULT_COLLECTION_NAME = "agent_experiences"
+# 舊版 (langchain OllamaEmbeddings) 寫入時用的是 query 前綴；改用 passage 前綴後向量空間不同，
+# 因此預設 Ollama 模型改存到帶版本後綴的 Collection，第一次開啟時由舊 Collection 重新 embed 搬移
+OLLAMA_DOCUMENT_VECTOR_VERSION = "passage"
+
+
+class EmbeddingBackend(ABC):
+    """
+    name: 含模型資訊的識別字串；Collection 名稱與 Embedding 快取都以它區分，
+          確保不同後端 / 模型產生的向量永遠不會混在同一個索引裡。
+    """
+    name = "base"
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text], kind="query")[0]
+
+    @abstractmethod
+    def embed_documents(self, texts: list, kind: str = "document") -> list:
+        """ kind: "query" | "document" (部分模型對兩者使用不同前綴) """
+
+    def is_available(self) -> bool:
+        return True
+
+
+class OllamaBackend(EmbeddingBackend):
+    # 與 langchain OllamaEmbeddings 的預設前綴相同，舊資料的向量仍然相容
+    PREFIXES = {"query": "query: ", "document": "passage: "}
+
+    def __init__(self, base_url: str = EMBEDDING_SERVER_URL, model: str = EMBEDDING_MODEL_NAME,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, timeout: float = 60):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.name = model # 沿用既有名稱：舊的 Collection 與快取不需重建
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._batch_api = True
+        self._session = requests.Session()
+
+    def is_available(self) -> bool:
+        try:
+            return self._session.get(f"{self.base_url}/api/tags", timeout=2).ok
+        except requests.RequestException:
+            return False
+
+    def embed_documents(self, texts: list, kind: str = "document") -> list:
+        prefix = self.PREFIXES.get(kind, "")
+        inputs = [prefix + t for t in texts]
+        vectors = []
+        for i in range(0, len(inputs), self.batch_size):
+            vectors.extend(self._embed_batch(inputs[i:i + self.batch_size]))
+        return vectors
+
+    def _embed_batch(self, inputs: list) -> list:
+        if self._batch_api:
+            resp = self._session.post(f"{self.base_url}/api/embed",
+                                      json={"model": self.model, "input": inputs}, timeout=self.timeout)
+            if resp.status_code != 404:
+                resp.raise_for_status()
+                return resp.json()["embeddings"]
+            self._batch_api = False # 舊版 Ollama 沒有批次 API，改為逐筆
+        vectors = []
+        for text in inputs:
+            resp = self._session.post(f"{self.base_url}/api/embeddings",
+                                      json={"model": self.model, "prompt": text}, timeout=self.timeout)
+            resp.raise_for_status()
+            vectors.append(resp.json()["embedding"])
+        return vectors
+
+
+class FastEmbedBackend(EmbeddingBackend):
+    """ fastembed (ONNX Runtime, 量化模型) 在本機 CPU 上推論；首次使用會下載模型 """
+    def __init__(self, model: str = FASTEMBED_MODEL_NAME, batch_size: int = EMBEDDING_BATCH_SIZE):
+        from fastembed import TextEmbedding # 選用依賴：沒裝時由 create_backend 處理 ImportError
+        self.model = TextEmbedding(model_name=model)
+        self.name = f"fastembed:{model}"
+        self.batch_size = batch_size
+
+    def embed_query(self, text: str) -> list:
+        return next(iter(self.model.query_embed([text]))).tolist()
+
+    def embed_documents(self, texts: list, kind: str = "document") -> list:
+        if kind == "query":
+            return [v.tolist() for v in self.model.query_embed(texts)]
+        return [v.tolist() for v in self.model.passage_embed(texts, batch_size=self.batch_size)]
+
+
+class HashingBackend(EmbeddingBackend):
+    """
+    特徵雜湊 (Hashing Trick)：單字 / 中文 bigram + 字元 3-gram，以 crc32 映射到固定維度並帶正負號。
+    不需要模型與網路，但只能抓到字面相似度。
+    """
+    def __init__(self, dim: int = HASHING_EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing:{dim}"
+
+    def _features(self, text: str) -> list:
+        words = tokenize(text)
+        compact = re.sub(r"\s+", " ", (text or "").lower())
+        trigrams = [compact[i:i + 3] for i in range(len(compact) - 2)]
+        return words + trigrams
+
+    def embed_documents(self, texts: list, kind: str = "document") -> list:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.maximum(norms, 1e-12)
+        return matrix.tolist()
+
+
+_BACKENDS = {"ollama": OllamaBackend, "fastembed": FastEmbedBackend, "hashing": HashingBackend}
+
+
+def _build(kind: str) -> EmbeddingBackend | None:
+    try:
+        backend = _BACKENDS[kind]()
+    except KeyError:
+        print(f"⚠️ [Embedding] 未知的後端: {kind}")
+        return None
+    except ImportError as e:
+        print(f"⚠️ [Embedding] {kind} 後端缺少套件: {e}")
+        return None
+    return backend if backend.is_available() else None
+
+
+def create_backend(kind: str = EMBEDDING_BACKEND, fallback: str = EMBEDDING_FALLBACK_BACKEND) -> EmbeddingBackend:
+    """ 建立 Embedding 後端；主要後端不可用時改用 fallback (並明確印出，而不是默默沒有記憶) """
+    backend = _build(kind)
+    if backend is not None:
+        return backend
+    if fallback and fallback != kind:
+        print(f"⚠️ [Embedding] {kind} 後端不可用，改用 {fallback} (向量存放於獨立的 Collection)")
+        backend = _build(fallback)
+        if backend is not None:
+            return backend
+    raise RuntimeError(f"No embedding backend available ({kind}, fallback={fallback})")
+
+
+def legacy_collection_name_for(backend: EmbeddingBackend, base: str = DEFAULT_COLLECTION_NAME) -> str | None:
+    """ 需要重新 embed 搬移的舊 Collection (只有預設 Ollama 模型有舊資料) """
+    if isinstance(backend, OllamaBackend) and backend.model == EMBEDDING_MODEL_NAME:
+        return base
+    return None
+
+
+def collection_name_for(backend: EmbeddingBackend, base: str = DEFAULT_COLLECTION_NAME) -> str:
+    """ 以後端 / 模型 (與文件向量版本) 加上後綴，向量空間彼此隔離 """
+    if legacy_collection_name_for(backend, base):
+        return f"{base}__{OLLAMA_DOCUMENT_VECTOR_VERSION}"
+    slug = re.sub(r"[^a-zA-Z0-9_-]+", "-", backend.name).strip("-")
+    return f"{base}__{slug}"[:63] # Chroma Collection 名稱上限 63 字
+
+
+def benchmark(rounds: int = 5, batch: int = 32):
+    """ 比較各後端的單筆查詢與批次寫入延遲 """
+    sample = [f"Find a vegetarian lasagna recipe with at least {i} reviews on Allrecipes" for i in range(batch)]
+    print(f"{'Backend':<36} | {'query ms':>9} | {f'batch{batch} ms':>11} | {'dim':>5}")
+    print("-" * 70)
+    for kind in _BACKENDS:
+        backend = _build(kind)
+        if backend is None:
+            print(f"{kind:<36} | {'unavailable':>9}")
+            continue
+        backend.embed_query("warm up")
+        start = time.perf_counter()
+        for i in range(rounds):
+            vector = backend.embed_query(f"search query {i}")
+        t_query = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        backend.embed_documents(sample)
+        t_batch = time.perf_counter() - start
+        print(f"{backend.name:<36} | {t_query * 1000:>9.1f} | {t_batch * 1000:>11.1f} | {len(vector):>5}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,87 @@
+# embedding_cache.py
+# [New] 本地 Embedding 快取 (SQLite)
+# 職責：同一段文字 + 同一個模型只向 Ollama 要一次向量；重啟後仍有效。
+
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_MODEL_NAME
+
+
+class EmbeddingCache:
+    """
+    以 sha256(模型名稱 + 種類 + 文字) 為 Key 的向量快取。
+    kind: "query" / "document" —— 多數後端對兩者會加上不同前綴，向量不同，必須分開存。
+    model_name: 由 MemoryManager 傳入後端名稱 (embedding_backends.EmbeddingBackend.name)。
+    向量以 float32 (array('f')) 存成 BLOB，約為 JSON 的 1/4 大小。
+    """
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, model_name: str = EMBEDDING_MODEL_NAME):
+        self.path = path
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 多個 Worker 執行緒共用同一條連線，由 _lock 序列化
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _key(self, text: str, kind: str) -> str:
+        raw = f"{self.model_name}\0{kind}\0{text}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text: str, kind: str = "query") -> list | None:
+        return self.get_many([text], kind)[0]
+
+    def get_many(self, texts: list, kind: str = "query") -> list:
+        """ 回傳與 texts 等長的列表，未命中者為 None """
+        if not texts: return []
+        keys = [self._key(t, kind) for t in texts]
+        found = {}
+        with self._lock:
+            # SQLite 單一查詢的參數上限為 999，分批查詢
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        results = [found.get(k) for k in keys]
+        hit_count = sum(1 for r in results if r is not None)
+        self.hits += hit_count
+        self.misses += len(results) - hit_count
+        return results
+
+    def put(self, text: str, vector: list, kind: str = "query"):
+        self.put_many([text], [vector], kind)
+
+    def put_many(self, texts: list, vectors: list, kind: str = "query"):
+        now = time.time()
+        rows = [(self._key(t, kind), self.model_name, len(v), array("f", v).tobytes(), now)
+                for t, v in zip(texts, vectors)]
+        if not rows: return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_name,)).fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,90 @@
+# hybrid_retrieval.py
+# [New] 輕量級混合檢索：行程內 BM25 關鍵字索引 + Reciprocal Rank Fusion
+# 職責：補足純向量檢索對「專有名詞 / 網站名稱 / 數字」不敏感的問題
+
+import math
+import re
+from collections import Counter, defaultdict
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CJK_RE = re.compile(r"[一-鿿]+")
+
+
+def tokenize(text: str) -> list:
+    """ 英文/數字以單字切分；中文以單字 + 雙字 (bigram) 切分 (不需要分詞器) """
+    text = (text or "").lower()
+    tokens = _WORD_RE.findall(text)
+    for run in _CJK_RE.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    Okapi BM25 倒排索引 (全部在記憶體中，數千筆記憶的規模下建索引 < 100ms)。
+    每筆文件可附帶 metadata，搜尋時可用 filter_fn(metadata) 先行過濾 (例如只看同網站)。
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict) # term -> {doc_id: tf}
+        self.doc_len = {}
+        self.doc_terms = {}
+        self.metadatas = {}
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, doc_id: str, text: str, metadata: dict = None):
+        if doc_id in self.doc_len:
+            self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+        length = sum(counts.values())
+        self.doc_len[doc_id] = length
+        self.doc_terms[doc_id] = list(counts)
+        self.metadatas[doc_id] = metadata or {}
+        self.total_len += length
+
+    def remove(self, doc_id: str):
+        if doc_id not in self.doc_len: return
+        for term in self.doc_terms.pop(doc_id):
+            docs = self.postings.get(term)
+            if docs is None: continue
+            docs.pop(doc_id, None)
+            if not docs: del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id)
+        self.metadatas.pop(doc_id, None)
+
+    def search(self, query: str, top_n: int = 10, filter_fn=None) -> list:
+        """ 回傳 [(doc_id, score), ...]，依分數由高到低 """
+        n_docs = len(self.doc_len)
+        if n_docs == 0: return []
+        avg_len = self.total_len / n_docs
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs: continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+        if filter_fn is not None:
+            scores = {d: s for d, s in scores.items() if filter_fn(self.metadatas[d])}
+        return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)[:top_n]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60, weights: list = None) -> list:
+    """
+    RRF：score(d) = Σ weight_i / (k + rank_i(d))
+    rankings: [[doc_id, ...], ...] (各自已排序)；不需要把不同來源的分數正規化到同一尺度。
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] += weight / (k + rank + 1)
+    return sorted(fused.items(), key=lambda pair: pair[1], reverse=True)
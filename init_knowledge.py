@@ -1,7 +1,7 @@
 # init_knowledge.py
 # [Updated] 模組化知識庫，提供固定 ID 以供同步
 
-from memory_manager import MemoryManager
+from memory_manager import get_shared_memory_manager
 
 def sync_system_knowledge():
     """
@@ -9,7 +9,7 @@ def sync_system_knowledge():
     使用固定 ID (sop_001, sop_002...) 來避免重複。
     """
     print("📚 [System] 正在同步核心知識庫...")
-    memory = MemoryManager()
+    memory = get_shared_memory_manager() # 與之後的 AgentCore 共用同一個實例
     
     knowledge_base = [
         {
@@ -73,16 +73,9 @@ def sync_system_knowledge():
         }
     ]
 
-    for item in knowledge_base:
-        memory.add_memory(
-            user_goal=item['goal'],
-            trajectory=item['trajectory'],
-            outcome=item['outcome'],
-            insight=item['insight'],
-            doc_id=item['id'] # 傳入 ID 進行 Upsert
-        )
-    
-    print("✅ 核心知識庫同步完成 (無重複資料)。")
+    # [Updated] 批次同步：只重新向量化內容有變的 SOP，一次 upsert 寫入
+    report = memory.sync_memories(knowledge_base)
+    print(f"✅ 核心知識庫同步完成 (共 {report['total']} 筆：略過 {report['skipped']}，更新 {report['updated']})。")
 
 if __name__ == "__main__":
     sync_system_knowledge()
\ No newline at end of file
@@ -0,0 +1,163 @@
+# memory_compaction.py
+# [New] 長期記憶壓縮 (Compaction)
+# 職責：合併近似重複的目標、限制每個目標群的筆數、淘汰過期的失敗教訓、控制總筆數上限，
+#       並截短過長的軌跡。系統 SOP (sop_*) 一律不動。
+# 用法: python memory_compaction.py [--dry-run]
+
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+import numpy as np
+from config import (MEMORY_DUPLICATE_THRESHOLD, MEMORY_MAX_PER_CLUSTER, MEMORY_FAILURE_TTL_DAYS,
+                    MEMORY_MAX_RECORDS, MEMORY_TRAJECTORY_MAX_CHARS)
+
+PROTECTED_PREFIX = "sop_"
+# 同一群內保留的優先順序：成功經驗 > 系統洞察 > 失敗教訓 (同級時新的優先)
+_OUTCOME_PRIORITY = {"success": 0, "insight": 1, "failure": 2}
+_MERGED_INSIGHT_MAX_CHARS = 1000
+
+
+def _timestamp(meta: dict) -> float:
+    try:
+        return datetime.fromisoformat(meta.get("timestamp", "")).timestamp()
+    except (TypeError, ValueError):
+        return 0.0 # 沒有時間戳記的舊資料視為最舊
+
+
+def _truncate_trajectory(traj: str, max_chars: int) -> str:
+    """ 保留開頭與結尾 (起手式與最後成功的步驟最有參考價值) """
+    if len(traj) <= max_chars: return traj
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    return f"{traj[:head]}\n...(略 {len(traj) - max_chars} 字)...\n{traj[-tail:]}"
+
+
+def cluster_by_similarity(embeddings: np.ndarray, threshold: float) -> list:
+    """
+    貪婪分群：依輸入順序 (呼叫端先排成「最該保留的在前」)，
+    與任一群首的餘弦相似度 >= threshold 即加入該群，否則自成一群。
+    回傳與輸入等長的群編號列表。
+    """
+    if len(embeddings) == 0: return []
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    sims = vectors @ vectors.T
+    labels = [-1] * len(vectors)
+    leaders = []
+    for i in range(len(vectors)):
+        if leaders:
+            leader_sims = sims[i, leaders]
+            best = int(np.argmax(leader_sims))
+            if leader_sims[best] >= threshold:
+                labels[i] = labels[leaders[best]]
+                continue
+        labels[i] = len(leaders)
+        leaders.append(i)
+    return labels
+
+
+def plan_compaction(records: list, now: datetime = None, duplicate_threshold: float = MEMORY_DUPLICATE_THRESHOLD,
+                    max_per_cluster: int = MEMORY_MAX_PER_CLUSTER, failure_ttl_days: int = MEMORY_FAILURE_TTL_DAYS,
+                    max_records: int = MEMORY_MAX_RECORDS, trajectory_max_chars: int = MEMORY_TRAJECTORY_MAX_CHARS) -> dict:
+    """
+    純計算 (不動資料庫)。records: [{"id", "metadata", "embedding"}, ...]
+    回傳: {"remove": {id: reason}, "update": {id: new_metadata}}
+    """
+    now = now or datetime.now()
+    remove, update = {}, {}
+    protected = [r for r in records if r["id"].startswith(PROTECTED_PREFIX)]
+    candidates = [r for r in records if not r["id"].startswith(PROTECTED_PREFIX)]
+
+    # 1. 過期的失敗教訓
+    expire_before = (now - timedelta(days=failure_ttl_days)).timestamp()
+    alive = []
+    for r in candidates:
+        if r["metadata"].get("outcome") == "failure" and _timestamp(r["metadata"]) < expire_before:
+            remove[r["id"]] = "expired_failure"
+        else:
+            alive.append(r)
+
+    # 2. 近似重複的目標：同網站內分群，每群最多保留 max_per_cluster 筆
+    alive.sort(key=lambda r: (_OUTCOME_PRIORITY.get(r["metadata"].get("outcome"), 3), -_timestamp(r["metadata"])))
+    by_site = {}
+    for r in alive:
+        by_site.setdefault(r["metadata"].get("site", ""), []).append(r)
+
+    kept = []
+    for site_records in by_site.values():
+        labels = cluster_by_similarity([r["embedding"] for r in site_records], duplicate_threshold)
+        clusters = {}
+        for r, label in zip(site_records, labels):
+            clusters.setdefault(label, []).append(r)
+        for members in clusters.values():
+            keep, drop = members[:max_per_cluster], members[max_per_cluster:]
+            kept.extend(keep)
+            # 被合併掉的記錄若有不同的教訓，併入保留下來的第一筆
+            merged = [keep[0]["metadata"].get("insight", "")]
+            for r in drop:
+                remove[r["id"]] = "duplicate"
+                insight = r["metadata"].get("insight", "")
+                if insight and insight not in merged:
+                    merged.append(insight)
+            merged_text = "\n".join(m for m in merged if m)[:_MERGED_INSIGHT_MAX_CHARS]
+            if merged_text != keep[0]["metadata"].get("insight", ""):
+                update[keep[0]["id"]] = dict(keep[0]["metadata"], insight=merged_text)
+
+    # 3. 總量上限 (SOP 也計入總量，但不會被刪)：先刪最舊的失敗，再刪最舊的其他記錄
+    overflow = len(kept) + len(protected) - max_records
+    if overflow > 0:
+        kept.sort(key=lambda r: (r["metadata"].get("outcome") != "failure", _timestamp(r["metadata"])))
+        for r in kept[:overflow]:
+            remove[r["id"]] = "budget"
+            update.pop(r["id"], None)
+
+    # 4. 截短過長的軌跡 (只改 metadata，向量不變)
+    for r in candidates:
+        if r["id"] in remove: continue
+        meta = update.get(r["id"], r["metadata"])
+        traj = meta.get("trajectory", "")
+        if len(traj) > trajectory_max_chars:
+            update[r["id"]] = dict(meta, trajectory=_truncate_trajectory(traj, trajectory_max_chars))
+
+    return {"remove": remove, "update": update}
+
+
+def compact_memories(memory_manager, dry_run: bool = False, verbose: bool = True, **policy) -> dict:
+    """
+    對 MemoryManager 的 Collection 執行壓縮，回傳報告:
+    {"before", "after", "removed": {reason: count}, "updated", "removed_records": [{"id", "goal", "reason"}], "dry_run"}
+    """
+    records = memory_manager.export_memories()
+
+    plan = plan_compaction(records, **policy)
+    goals = {r["id"]: r["metadata"].get("goal", "") for r in records}
+    report = {
+        "before": len(records),
+        "after": len(records) - len(plan["remove"]),
+        "removed": dict(Counter(plan["remove"].values())),
+        "updated": len(plan["update"]),
+        "removed_records": [{"id": doc_id, "goal": goals.get(doc_id, ""), "reason": reason}
+                            for doc_id, reason in plan["remove"].items()],
+        "dry_run": dry_run
+    }
+
+    if not dry_run:
+        memory_manager.delete_memories(list(plan["remove"]))
+        memory_manager.update_memories(plan["update"])
+
+    if verbose:
+        tag = " (dry-run)" if dry_run else ""
+        print(f"🧹 [Compaction]{tag} {report['before']} -> {report['after']} 筆，"
+              f"移除 {report['removed'] or 0}，更新 {report['updated']} 筆")
+    return report
+
+
+if __name__ == "__main__":
+    from memory_manager import get_shared_memory_manager
+    parser = argparse.ArgumentParser(description="Compact the long-term memory collection")
+    parser.add_argument("--dry-run", action="store_true", help="只列出會被移除的記錄，不寫入資料庫")
+    args = parser.parse_args()
+
+    result = compact_memories(get_shared_memory_manager(), dry_run=args.dry_run)
+    for item in result["removed_records"]:
+        print(f"  - [{item['reason']}] {item['id']}: {item['goal'][:80]}")
@@ -5,87 +5,371 @@
 import chromadb
 import uuid
 import json
+import hashlib
+import threading
+import time
 from datetime import datetime
-from langchain_community.embeddings import OllamaEmbeddings
-from config import EMBEDDING_SERVER_URL, EMBEDDING_MODEL_NAME, CHROMA_DB_PATH
+from config import CHROMA_DB_PATH, ENABLE_EMBEDDING_CACHE, MEMORY_COMPACT_EVERY_WRITES, MEMORY_INIT_RETRY_INTERVAL
+import embedding_backends
+from embedding_cache import EmbeddingCache
+from memory_writer import MemoryWriteQueue
+from hybrid_retrieval import BM25Index, reciprocal_rank_fusion
+import memory_compaction
+
+# [New] 行程內共用的單一實例 (見 get_shared_memory_manager)
+_SHARED_MANAGER = None
+_SHARED_INIT_ERROR = None # (例外, 失敗時間)
+_SHARED_LOCK = threading.Lock()
+
 
 class MemoryManager:
-    def __init__(self):
+    def __init__(self, client=None, collection_name: str = None, backend=None):
+        """
+        client / collection_name: 預設為本地持久化的 agent_experiences__<後端 / 向量版本>；
+        benchmark 等工具可傳入 chromadb.EphemeralClient() 在記憶體中建立獨立 Collection。
+        backend: embedding_backends.EmbeddingBackend，預設依 config.EMBEDDING_BACKEND 建立。
+        """
         print(f"[Memory] 初始化 ChromaDB ({CHROMA_DB_PATH})...")
-        
-        # 1. 初始化 Embedding Function
-        self.embedding_fn = OllamaEmbeddings(
-            base_url=EMBEDDING_SERVER_URL, 
-            model=EMBEDDING_MODEL_NAME
-        )
+        init_start = time.perf_counter()
+        self.init_metrics = {}
+        # 多個 Worker / UI 執行緒共用同一個實例時，Collection 操作需序列化 (Embedding 呼叫不鎖)
+        self._lock = threading.RLock()
+
+        # 1. 初始化 Embedding 後端 ([Updated] Ollama 不可用時會改用 fallback 後端)
+        phase_start = time.perf_counter()
+        self.embedding_fn = backend if backend is not None else embedding_backends.create_backend()
+        print(f"[Memory] Embedding 後端: {self.embedding_fn.name}")
+        self.init_metrics["embedding_fn"] = round(time.perf_counter() - phase_start, 3)
         
         # 2. 初始化 Chroma Client (Persistent)
-        self.client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        phase_start = time.perf_counter()
+        self.client = client if client is not None else chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        self.init_metrics["chroma_client"] = round(time.perf_counter() - phase_start, 3)
         
         # 3. 取得或建立 Collection
+        phase_start = time.perf_counter()
         self.collection = self.client.get_or_create_collection(
-            name="agent_experiences",
+            name=collection_name or embedding_backends.collection_name_for(self.embedding_fn),
             metadata={"hnsw:space": "cosine"} # 使用餘弦相似度
         )
+        self.init_metrics["collection"] = round(time.perf_counter() - phase_start, 3)
+
+        # 4. [New] 本地向量快取：重複的文字不再呼叫遠端 Embedding Server
+        phase_start = time.perf_counter()
+        self.embedding_cache = None
+        if ENABLE_EMBEDDING_CACHE:
+            try:
+                self.embedding_cache = EmbeddingCache(model_name=self.embedding_fn.name)
+            except Exception as e:
+                print(f"⚠️ [Memory] Embedding 快取開啟失敗，改為直接呼叫 Server: {e}")
+        self.init_metrics["embedding_cache"] = round(time.perf_counter() - phase_start, 3)
+
+        # 4-1. [New] 舊 Collection (query 前綴向量) 第一次開啟時以文件向量重新 embed 搬移
+        legacy_name = None if collection_name else embedding_backends.legacy_collection_name_for(self.embedding_fn)
+        if legacy_name:
+            phase_start = time.perf_counter()
+            self.init_metrics["migrated"] = self._migrate_legacy_collection(legacy_name)
+            self.init_metrics["migration"] = round(time.perf_counter() - phase_start, 3)
+
+        # 5. [New] 背景寫入佇列 (add_memory_async 使用)
+        self.writer = MemoryWriteQueue(self)
+
+        # 6. [New] BM25 關鍵字索引 (第一次檢索時才從 Collection 建立，之後隨寫入增量更新)
+        self.keyword_index = None
+        self._writes_since_compaction = 0
+
+        self.init_metrics["total"] = round(time.perf_counter() - init_start, 3)
+        try:
+            self.init_metrics["documents"] = self.collection.count()
+        except Exception:
+            pass
+        print(f"✅ [Memory] 初始化完成 {self.init_metrics}")
 
     def _get_embedding(self, text):
-        """ 產生向量 """
-        return self.embedding_fn.embed_query(text)
+        """ 產生向量 (先查本地快取) """
+        if self.embedding_cache:
+            cached = self.embedding_cache.get(text, kind="query")
+            if cached is not None:
+                return cached
+        vector = self.embedding_fn.embed_query(text)
+        if self.embedding_cache:
+            self.embedding_cache.put(text, vector, kind="query")
+        return vector
 
-    # [關鍵修正] 這裡必須包含 doc_id=None
-    def add_memory(self, user_goal: str, trajectory: list, outcome: str, insight: str = "", doc_id: str = None):
-        """ 
-        [Updated] 統一的儲存入口 
-        doc_id: 若提供 (例如來自 init_knowledge.py)，則進行 Upsert (更新/插入)；若無，則自動生成 UUID (新增)。
+    def _get_embeddings(self, texts: list) -> list:
+        """
+        [New] 批次產生「文件」向量 (儲存用)：快取未命中的部分合併成一次 embed_documents 呼叫
         """
-        # 決定 ID 與動作類型
-        if doc_id is None:
-            doc_id = str(uuid.uuid4())
-            action_type = "新增"
-        else:
-            action_type = "同步" # 有 ID 代表是系統知識同步
+        if not texts: return []
+        vectors = self.embedding_cache.get_many(texts, kind="document") if self.embedding_cache else [None] * len(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            fresh = self.embedding_fn.embed_documents([texts[i] for i in missing], kind="document")
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+            if self.embedding_cache:
+                self.embedding_cache.put_many([texts[i] for i in missing], fresh, kind="document")
+        return vectors
 
-        # 準備向量化文字
-        text_to_embed = user_goal 
-        embedding = self._get_embedding(text_to_embed)
-        
+    def _migrate_legacy_collection(self, legacy_name: str, batch_size: int = 64) -> int:
+        """
+        [New] 新 Collection 為空時，把舊 Collection 的記憶以 embed_documents 重新產生向量後寫入。
+        舊 Collection 保留不動 (可回退)；回傳搬移筆數。
+        """
+        if self.collection.count() > 0: return 0
+        try:
+            legacy = self.client.get_collection(legacy_name)
+            data = legacy.get(include=["documents", "metadatas"])
+        except Exception:
+            return 0 # 沒有舊資料
+        ids, documents, metadatas = data.get("ids") or [], data.get("documents") or [], data.get("metadatas") or []
+        if not ids: return 0
+        print(f"🔁 [Memory] 以新的文件向量重新 embed 舊記憶 ({legacy_name}: {len(ids)} 筆)...")
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            self.collection.upsert(
+                ids=ids[start:end], documents=documents[start:end], metadatas=metadatas[start:end],
+                embeddings=self._get_embeddings(documents[start:end])
+            )
+        return len(ids)
+
+    @staticmethod
+    def _format_trajectory(trajectory) -> str:
         # 確保 trajectory 是字串格式 (存入 metadata)
         if isinstance(trajectory, list):
-            traj_str = "\n".join([str(step) for step in trajectory])
-        else:
-            traj_str = str(trajectory)
-        
-        # 建構 Metadata
-        metadata = {
+            return "\n".join([str(step) for step in trajectory])
+        return str(trajectory)
+
+    def _content_hash(self, user_goal: str, traj_str: str, outcome: str, insight: str, site: str = "") -> str:
+        """ 記憶內容 + Embedding 模型的雜湊；任一改變都代表需要重新寫入 """
+        raw = json.dumps([self.embedding_fn.name, user_goal, traj_str, outcome, insight, site], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _build_metadata(self, user_goal: str, traj_str: str, outcome: str, insight: str, site: str = "") -> dict:
+        return {
             "goal": user_goal,
             "outcome": outcome,
             "insight": insight,
+            "site": site, # [New] 網域 (去掉 www.)；空字串代表通用知識 (例如 SOP)
             "timestamp": datetime.now().isoformat(),
-            "trajectory": traj_str 
+            "trajectory": traj_str,
+            "content_hash": self._content_hash(user_goal, traj_str, outcome, insight, site)
+        }
+
+    @staticmethod
+    def _index_text(document: str, metadata: dict) -> str:
+        # 關鍵字索引同時涵蓋目標與教訓 (教訓裡常有網站名稱、按鈕文字等專有名詞)
+        return f"{document} {metadata.get('insight', '')}"
+
+    def _index_documents(self, ids: list, documents: list, metadatas: list):
+        """ 寫入後同步更新 BM25 索引 (尚未建立時略過，建立時會從 Collection 讀取) """
+        with self._lock:
+            if self.keyword_index is None: return
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                self.keyword_index.add(doc_id, self._index_text(document, metadata), metadata)
+
+    def _ensure_keyword_index(self) -> BM25Index:
+        with self._lock:
+            if self.keyword_index is None:
+                index = BM25Index()
+                data = self.collection.get(include=["documents", "metadatas"])
+                for doc_id, document, metadata in zip(data.get('ids', []), data.get('documents') or [], data.get('metadatas') or []):
+                    metadata = metadata or {}
+                    index.add(doc_id, self._index_text(document or "", metadata), metadata)
+                self.keyword_index = index
+            return self.keyword_index
+
+    def sync_memories(self, items: list) -> dict:
+        """
+        [New] 批次同步固定 ID 的記憶 (例如系統 SOP)。
+        items: [{"id", "goal", "trajectory", "outcome", "insight"}, ...]
+        與 Collection 中既有的 content_hash 比對，只有新增/變更的項目才會
+        以一次 embed_documents + 一次 upsert 寫入。
+        回傳: {"total", "skipped", "updated"}
+        """
+        if not items:
+            return {"total": 0, "skipped": 0, "updated": 0}
+
+        ids = [item['id'] for item in items]
+        with self._lock:
+            existing = self.collection.get(ids=ids, include=["metadatas"])
+        stored_hashes = {
+            doc_id: (meta or {}).get("content_hash")
+            for doc_id, meta in zip(existing.get('ids', []), existing.get('metadatas') or [])
         }
 
+        changed_ids, documents, metadatas = [], [], []
+        for item in items:
+            traj_str = self._format_trajectory(item['trajectory'])
+            insight = item.get('insight', "")
+            site = item.get('site', "")
+            content_hash = self._content_hash(item['goal'], traj_str, item['outcome'], insight, site)
+            if stored_hashes.get(item['id']) == content_hash:
+                continue
+            changed_ids.append(item['id'])
+            documents.append(item['goal'])
+            metadatas.append(self._build_metadata(item['goal'], traj_str, item['outcome'], insight, site))
+
+        if changed_ids:
+            embeddings = self._get_embeddings(documents)
+            with self._lock:
+                self.collection.upsert(
+                    ids=changed_ids,
+                    embeddings=embeddings,
+                    documents=documents,
+                    metadatas=metadatas
+                )
+            self._index_documents(changed_ids, documents, metadatas)
+        return {"total": len(items), "skipped": len(items) - len(changed_ids), "updated": len(changed_ids)}
+
+    # [關鍵修正] 這裡必須包含 doc_id=None
+    def add_memory(self, user_goal: str, trajectory: list, outcome: str, insight: str = "", doc_id: str = None, site: str = ""):
+        """ 
+        [Updated] 統一的儲存入口 
+        doc_id: 若提供 (例如來自 init_knowledge.py)，則進行 Upsert (更新/插入)；若無，則自動生成 UUID (新增)。
+        site: 任務所在網域，檢索時用來優先匹配同網站的經驗。
+        """
+        self.add_memories([{
+            "user_goal": user_goal, "trajectory": trajectory,
+            "outcome": outcome, "insight": insight, "doc_id": doc_id, "site": site
+        }])
+
+    def add_memories(self, entries: list):
+        """
+        [New] 批次寫入：一次 embed_documents + 一次 upsert
+        entries: [{"user_goal", "trajectory", "outcome", "insight", "doc_id", "site"}, ...]
+        doc_id 為 None 時自動生成 UUID (新增)；有 ID 代表是系統知識同步 (Upsert)。
+        """
+        if not entries: return
+        ids, documents, metadatas = [], [], []
+        for entry in entries:
+            ids.append(entry.get("doc_id") or str(uuid.uuid4()))
+            # 準備向量化文字 (儲存端使用文件向量，與 sync_memories 一致)
+            documents.append(entry["user_goal"])
+            traj_str = self._format_trajectory(entry["trajectory"])
+            metadatas.append(self._build_metadata(entry["user_goal"], traj_str, entry["outcome"],
+                                                  entry.get("insight", ""), entry.get("site", "")))
+
+        embeddings = self._get_embeddings(documents)
         # 執行 Upsert (存在則更新，不存在則寫入)
-        self.collection.upsert(
-            ids=[doc_id],
-            embeddings=[embedding],
-            documents=[text_to_embed], # 搜尋時匹配這段文字
-            metadatas=[metadata]
-        )
+        with self._lock:
+            self.collection.upsert(
+                ids=ids,
+                embeddings=embeddings,
+                documents=documents, # 搜尋時匹配這段文字
+                metadatas=metadatas
+            )
+        self._index_documents(ids, documents, metadatas)
         
         # 僅在新增時印出 Log，避免同步時洗版
-        if action_type == "新增":
-            print(f"💾 [Memory] 已儲存 ({outcome}): {user_goal}")
+        for entry in entries:
+            if not entry.get("doc_id"):
+                print(f"💾 [Memory] 已儲存 ({entry['outcome']}): {entry['user_goal']}")
+
+    def export_memories(self) -> list:
+        """ [New] 全部記錄 [{"id", "metadata", "embedding"}, ...] (給 memory_compaction 等維護工具) """
+        with self._lock:
+            data = self.collection.get(include=["metadatas", "embeddings"])
+        embeddings = data.get("embeddings")
+        if embeddings is None: embeddings = [] # Chroma 可能回傳 numpy array，不能直接用 or
+        return [{"id": doc_id, "metadata": meta or {}, "embedding": emb}
+                for doc_id, meta, emb in zip(data.get("ids", []), data.get("metadatas") or [], embeddings)]
+
+    def delete_memories(self, ids: list):
+        """ [New] 刪除記錄：Collection 與 BM25 索引在同一把鎖內一起更新 """
+        if not ids: return
+        with self._lock:
+            self.collection.delete(ids=list(ids))
+            if self.keyword_index is not None:
+                for doc_id in ids:
+                    self.keyword_index.remove(doc_id)
+
+    def update_memories(self, updates: dict):
+        """ [New] 覆寫記錄的 metadata ({doc_id: metadata})，向量與文件不變；BM25 索引同步更新 """
+        if not updates: return
+        with self._lock:
+            self.collection.update(ids=list(updates), metadatas=list(updates.values()))
+            if self.keyword_index is not None:
+                for doc_id, metadata in updates.items():
+                    # 文件即目標 (add_memories 以 user_goal 當作 document)
+                    self.keyword_index.add(doc_id, self._index_text(metadata.get("goal", ""), metadata), metadata)
+
+    def add_memory_async(self, user_goal: str, trajectory: list, outcome: str, insight: str = "", insight_fn=None, site: str = ""):
+        """
+        [New] 非同步儲存：放入背景佇列後立即返回。
+        insight_fn: 在背景執行緒才呼叫的 callable (例如失敗反思的 LLM 呼叫)。
+        """
+        self.writer.submit({
+            "user_goal": user_goal, "trajectory": trajectory, "outcome": outcome,
+            "insight": insight, "doc_id": None, "insight_fn": insight_fn, "site": site
+        })
 
-    def retrieve_relevant_memory(self, current_goal: str, k=2) -> dict:
+    def on_batch_written(self, count: int):
+        """
+        [New] 背景佇列寫入一批後的回呼 (在寫入執行緒中執行)：
+        累積寫入達 MEMORY_COMPACT_EVERY_WRITES 筆時自動壓縮，不影響 Agent 主執行緒。
+        """
+        if MEMORY_COMPACT_EVERY_WRITES <= 0: return
+        self._writes_since_compaction += count
+        if self._writes_since_compaction < MEMORY_COMPACT_EVERY_WRITES: return
+        self._writes_since_compaction = 0
+        try:
+            memory_compaction.compact_memories(self)
+        except Exception as e:
+            print(f"⚠️ [Memory] 自動壓縮失敗: {e}")
+
+    def flush(self, timeout: float = None) -> bool:
+        """ 等待背景佇列寫完 """
+        return self.writer.flush(timeout)
+
+    def _vector_search(self, query_vec: list, n_results: int, where: dict = None) -> list:
+        """ 回傳 [(doc_id, metadata), ...] (依距離排序) """
+        with self._lock:
+            count = self.collection.count()
+            if count == 0: return []
+            results = self.collection.query(
+                query_embeddings=[query_vec],
+                n_results=min(n_results, count),
+                where=where,
+                include=["metadatas"]
+            )
+        if not results['ids'] or not results['ids'][0]: return []
+        return list(zip(results['ids'][0], results['metadatas'][0]))
+
+    def search_memories(self, query: str, k: int = 2, site: str = None, mode: str = "hybrid") -> list:
+        """
+        [New] 檢索記憶，回傳 [(doc_id, metadata), ...]
+        site: 只看「同網域 + 通用 (site="")」的記憶；舊資料沒有 site 欄位，數量不足時再不過濾補齊。
+        mode: "vector" 純向量 | "hybrid" 向量 + BM25 以 RRF 融合
+        """
+        n_candidates = max(k * 4, 10)
+        where = {"site": {"$in": [site, ""]}} if site else None
+        query_vec = self._get_embedding(query)
+
+        vector_hits = self._vector_search(query_vec, n_candidates, where)
+        if site and len(vector_hits) < k:
+            seen = {doc_id for doc_id, _ in vector_hits}
+            vector_hits += [hit for hit in self._vector_search(query_vec, n_candidates) if hit[0] not in seen]
+        if mode == "vector":
+            return vector_hits[:k]
+
+        index = self._ensure_keyword_index()
+        site_filter = (lambda meta: meta.get("site", "") in (site, "")) if site else None
+        with self._lock:
+            keyword_hits = index.search(query, top_n=n_candidates, filter_fn=site_filter)
+            keyword_meta = {doc_id: index.metadatas[doc_id] for doc_id, _ in keyword_hits}
+
+        metadata_by_id = dict(keyword_meta)
+        metadata_by_id.update(vector_hits)
+        fused = reciprocal_rank_fusion([[doc_id for doc_id, _ in vector_hits], [doc_id for doc_id, _ in keyword_hits]])
+        return [(doc_id, metadata_by_id[doc_id]) for doc_id, _ in fused[:k]]
+
+    def retrieve_relevant_memory(self, current_goal: str, k=2, site: str = None) -> dict:
         """
         檢索相關記憶，回傳包含 'success_path' 和 'warnings' 的字典
+        [Updated] 同網站優先 + 向量/關鍵字混合排序
         """
-        query_vec = self._get_embedding(current_goal)
-        
-        results = self.collection.query(
-            query_embeddings=[query_vec],
-            n_results=k
-        )
+        hits = self.search_memories(current_goal, k=k, site=site)
         
         # 解析結果容器
         retrieved = {
@@ -93,10 +377,7 @@ class MemoryManager:
             "warnings": []
         }
         
-        if not results['metadatas'] or not results['metadatas'][0]:
-            return retrieved
-
-        for meta in results['metadatas'][0]:
+        for _, meta in hits:
             outcome = meta.get('outcome')
             
             # 優先找一個成功案例
@@ -109,4 +390,29 @@ class MemoryManager:
                 if insight:
                     retrieved['warnings'].append(insight)
                     
-        return retrieved
\ No newline at end of file
+        return retrieved
+
+
+def get_shared_memory_manager() -> MemoryManager:
+    """
+    [New] 取得行程內共用的 MemoryManager (第一次呼叫時才初始化，之後直接回傳同一個實例)。
+    測試套件每個案例、UI 每個任務都會建立新的 AgentCore，共用後只需開啟一次 Chroma。
+    初始化失敗後 MEMORY_INIT_RETRY_INTERVAL 秒內直接拋出同一個錯誤 (避免每個案例重複等待逾時)，
+    之後再呼叫會重新嘗試 (服務可能只是還沒啟動)。
+    """
+    global _SHARED_MANAGER, _SHARED_INIT_ERROR
+    if _SHARED_MANAGER is not None:
+        return _SHARED_MANAGER
+    with _SHARED_LOCK:
+        if _SHARED_MANAGER is None:
+            if _SHARED_INIT_ERROR is not None:
+                error, failed_at = _SHARED_INIT_ERROR
+                if time.monotonic() - failed_at < MEMORY_INIT_RETRY_INTERVAL:
+                    raise error
+            try:
+                _SHARED_MANAGER = MemoryManager()
+                _SHARED_INIT_ERROR = None
+            except Exception as e:
+                _SHARED_INIT_ERROR = (e, time.monotonic())
+                raise
+    return _SHARED_MANAGER
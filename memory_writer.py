@@ -0,0 +1,150 @@
+# memory_writer.py
+# [New] Write-Behind 記憶寫入佇列
+# 職責：把「反思 LLM 呼叫 + Embedding + Chroma upsert」移出 Agent 主執行緒，
+#       由背景 Worker 批次寫入，失敗自動重試，程式結束前保證 flush。
+
+import atexit
+import queue
+import threading
+import time
+from config import MEMORY_WRITE_BATCH_SIZE, MEMORY_WRITE_MAX_RETRIES, MEMORY_FLUSH_TIMEOUT
+
+# 所有仍在運作的佇列 (供 flush_all / 程式結束時統一 flush)
+_ACTIVE_QUEUES = set()
+_ACTIVE_LOCK = threading.Lock()
+
+
+class MemoryWriteQueue:
+    """
+    job 格式: {"user_goal", "trajectory", "outcome", "insight", "doc_id", "insight_fn"}
+    insight_fn: 可選的 callable，在背景執行緒中才呼叫 (例如失敗反思)，結果寫入 insight。
+    寫入端 (sink) 需提供 add_memories(jobs) 一次寫入多筆；
+    若另有 on_batch_written(count)，每批寫入成功後會呼叫 (例如觸發記憶壓縮)。
+    """
+    def __init__(self, sink, batch_size: int = MEMORY_WRITE_BATCH_SIZE, max_retries: int = MEMORY_WRITE_MAX_RETRIES,
+                 retry_backoff: float = 1.0):
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self.stats = {"submitted": 0, "written": 0, "failed": 0, "batches": 0, "retries": 0}
+
+    def submit(self, job: dict):
+        """ 放入佇列後立即返回 """
+        if self._closed:
+            raise RuntimeError("MemoryWriteQueue is closed")
+        with self._cond:
+            self._pending += 1
+            self.stats["submitted"] += 1
+        self._ensure_worker()
+        self._queue.put(job)
+
+    def _ensure_worker(self):
+        # 第一次有寫入時才啟動執行緒 (只做檢索的實例不會多開執行緒)
+        with self._cond:
+            if self._thread is not None: return
+            self._thread = threading.Thread(target=self._run, name="MemoryWriter", daemon=True)
+            self._thread.start()
+        with _ACTIVE_LOCK:
+            _ACTIVE_QUEUES.add(self)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None: return # close() 的結束訊號
+            batch = [job]
+            # 把佇列中已累積的工作一起帶走 (一次 embed + 一次 upsert)
+            while len(batch) < self.batch_size:
+                try:
+                    nxt = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None) # 處理完這批再結束
+                    break
+                batch.append(nxt)
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: list):
+        hook = None
+        for job in batch:
+            insight_fn = job.pop("insight_fn", None)
+            if insight_fn:
+                try:
+                    job["insight"] = insight_fn() or ""
+                except Exception as e:
+                    print(f"⚠️ [MemoryWriter] 反思產生失敗，改存空白 Insight: {e}")
+                    job["insight"] = ""
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.sink.add_memories(batch)
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+                hook = getattr(self.sink, "on_batch_written", None)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    self.stats["failed"] += len(batch)
+                    print(f"❌ [MemoryWriter] 寫入失敗 ({len(batch)} 筆，已放棄): {e}")
+                    break
+                self.stats["retries"] += 1
+                delay = self.retry_backoff * (2 ** attempt)
+                print(f"⚠️ [MemoryWriter] 寫入失敗，{delay:.1f}s 後重試 ({attempt + 1}/{self.max_retries}): {e}")
+                time.sleep(delay)
+
+        if hook:
+            try:
+                hook(len(batch))
+            except Exception as e:
+                print(f"⚠️ [MemoryWriter] 寫入後回呼失敗: {e}")
+
+        with self._cond:
+            self._pending -= len(batch)
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = MEMORY_FLUSH_TIMEOUT) -> bool:
+        """ 等待所有已送出的工作寫完；逾時回傳 False """
+        end_time = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while self._pending > 0:
+                remaining = None if end_time is None else end_time - time.time()
+                if remaining is not None and remaining <= 0:
+                    print(f"⚠️ [MemoryWriter] Flush 逾時，仍有 {self._pending} 筆未寫入")
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = MEMORY_FLUSH_TIMEOUT) -> bool:
+        """ flush 後停止背景執行緒 (可重複呼叫) """
+        if self._closed: return True
+        flushed = self.flush(timeout)
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+        with _ACTIVE_LOCK:
+            _ACTIVE_QUEUES.discard(self)
+        return flushed
+
+
+def flush_all(timeout: float = MEMORY_FLUSH_TIMEOUT) -> bool:
+    """ 等待所有佇列寫完 (測試結束、UI 關閉時呼叫) """
+    with _ACTIVE_LOCK:
+        queues = list(_ACTIVE_QUEUES)
+    if queues:
+        print(f"💾 [MemoryWriter] 等待 {sum(q._pending for q in queues)} 筆記憶寫入...")
+    return all([q.flush(timeout) for q in queues])
+
+
+@atexit.register
+def _close_all_on_exit():
+    with _ACTIVE_LOCK:
+        queues = list(_ACTIVE_QUEUES)
+    for q in queues:
+        q.close()
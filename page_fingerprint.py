@@ -0,0 +1,144 @@
+# page_fingerprint.py
+# [New] 統一的頁面狀態指紋 (Page State Fingerprint)
+# 職責：一次 JS 呼叫取得「結構 / 文字 / 捲動」三個維度的指紋 (可選加上視覺指紋)，
+#       並以明確的「過期層級」讓元素快取、迴圈偵測、動作驗證共用同一套判斷。
+
+import io
+import time
+import hashlib
+from profiler import profiled
+
+# 比對結果 (由重到輕)，各快取依此決定是否失效：
+#   navigated         : 網址不同 -> 所有快取失效 (元素、元素地圖、頁面文字)
+#   structure_changed : DOM 骨架變了 (新節點、Dialog 開啟、aria-expanded...) -> 元素快取失效
+#   content_changed   : 只有文字變了 (AJAX 結果、計數器) -> 元素快取、頁面文字失效
+#   scrolled          : 只有捲動位置變了 -> 視窗元素、頁面文字失效；整頁元素地圖仍有效
+#   visual_changed    : DOM 完全相同但畫面不同 (Canvas / 影片 / 圖片載入) -> 元素快取失效
+#   identical         : 全部相同 -> 所有快取皆可沿用
+NAVIGATED = "navigated"
+STRUCTURE_CHANGED = "structure_changed"
+CONTENT_CHANGED = "content_changed"
+SCROLLED = "scrolled"
+VISUAL_CHANGED = "visual_changed"
+IDENTICAL = "identical"
+
+VISUAL_HASH_SIZE = (32, 18) # 視覺指紋的縮圖尺寸 (16:9)
+
+# 在瀏覽器內直接算雜湊 (FNV-1a 32-bit)，只回傳幾個短字串，不必把整頁文字傳回 Python。
+# 結構指紋：走訪 body 下所有元素 (含 Dialog、折疊選單、視窗外內容)，
+#           只取 tag / id / role 與會改變互動狀態的屬性，刻意忽略 class 以免動畫造成雜訊。
+# 文字指紋：整頁 innerText (去除空白) + 輸入框的值 / 勾選狀態。
+_FINGERPRINT_JS = """
+const STATE_ATTRS = ['aria-expanded', 'aria-selected', 'aria-checked', 'aria-hidden',
+                     'aria-pressed', 'data-state', 'open', 'hidden', 'disabled'];
+function fnv(str, h) {
+    for (let i = 0; i < str.length; i++) {
+        h ^= str.charCodeAt(i);
+        h = Math.imul(h, 16777619);
+    }
+    return h >>> 0;
+}
+const body = document.body;
+let structure = 2166136261, text = 2166136261, count = 0;
+if (body) {
+    const all = body.getElementsByTagName('*');
+    count = all.length;
+    for (let i = 0; i < all.length; i++) {
+        const el = all[i];
+        let token = el.tagName;
+        if (el.id) token += '#' + el.id;
+        const role = el.getAttribute('role');
+        if (role) token += '@' + role;
+        for (const name of STATE_ATTRS) {
+            const value = el.getAttribute(name);
+            if (value !== null) token += '|' + name + '=' + value;
+        }
+        structure = fnv(token + ';', structure);
+        if (el.tagName === 'INPUT' || el.tagName === 'TEXTAREA' || el.tagName === 'SELECT') {
+            text = fnv((el.value || '') + (el.checked ? '1' : '0') + ';', text);
+        }
+    }
+    text = fnv((body.innerText || '').replace(/\\s+/g, ''), text);
+}
+const doc = document.documentElement;
+return {
+    url: location.href,
+    structure: structure.toString(16) + ':' + count,
+    text: text.toString(16),
+    scroll_x: Math.round(window.scrollX),
+    scroll_y: Math.round(window.scrollY),
+    doc_height: Math.max(doc.scrollHeight, body ? body.scrollHeight : 0)
+};
+"""
+
+
+class PageFingerprint:
+    """
+    單一時間點的頁面狀態。
+    - content_key: 與捲動無關 (網址 + 結構 + 文字)，用於「頁面內容有沒有變」
+    - key        : 再加上捲動位置，用於「目前視窗看到的東西有沒有變」
+    """
+    def __init__(self, url="", structure="", text="", scroll_x=0, scroll_y=0, doc_height=0, visual=None):
+        self.url = url
+        self.structure = structure
+        self.text = text
+        self.scroll_x = scroll_x
+        self.scroll_y = scroll_y
+        self.doc_height = doc_height
+        self.visual = visual
+        self.captured_at = time.time()
+
+    @property
+    def content_key(self) -> str:
+        return f"{self.url}|{self.structure}|{self.text}"
+
+    @property
+    def key(self) -> str:
+        return f"{self.content_key}|{self.scroll_x},{self.scroll_y}"
+
+    def attach_visual(self, png_bytes: bytes):
+        """ 補上視覺指紋 (截圖通常在指紋之後才拍，因此分開計算) """
+        self.visual = compute_visual_hash(png_bytes)
+        return self
+
+    def compare(self, other, use_visual: bool = False) -> str:
+        """
+        回傳相對於 other (較舊的指紋) 的變化層級。
+        use_visual=False 時忽略視覺指紋：迴圈偵測不應被影片 / 輪播圖騙過。
+        """
+        if other is None or self.url != other.url: return NAVIGATED
+        if self.structure != other.structure: return STRUCTURE_CHANGED
+        if self.text != other.text: return CONTENT_CHANGED
+        if (self.scroll_x, self.scroll_y) != (other.scroll_x, other.scroll_y): return SCROLLED
+        if use_visual and self.visual and other.visual and self.visual != other.visual:
+            return VISUAL_CHANGED
+        return IDENTICAL
+
+    def __repr__(self):
+        return f"PageFingerprint({self.key[-40:]})"
+
+
+@profiled("fingerprint")
+def capture_fingerprint(driver, png_bytes: bytes = None) -> PageFingerprint | None:
+    """ 取得目前頁面的指紋；瀏覽器切換中等短暫錯誤時回傳 None (視為「未知」) """
+    try:
+        data = driver.execute_script(_FINGERPRINT_JS)
+    except Exception:
+        return None
+    if not data: return None
+    fingerprint = PageFingerprint(**data)
+    if png_bytes: fingerprint.attach_visual(png_bytes)
+    return fingerprint
+
+
+def compute_visual_hash(png_bytes: bytes) -> str | None:
+    """ 縮成 32x18 灰階並量化成 16 階後取雜湊：能抓到版面 / 大區塊變化，忽略壓縮雜訊 """
+    try:
+        from PIL import Image
+        image = Image.open(io.BytesIO(png_bytes))
+        image.draft("L", VISUAL_HASH_SIZE) # JPEG 可直接以低解析度解碼
+        small = image.convert("L").resize(VISUAL_HASH_SIZE, Image.BILINEAR)
+        quantized = bytes(p >> 4 for p in small.tobytes())
+        return hashlib.md5(quantized).hexdigest()
+    except Exception:
+        return None
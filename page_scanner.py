@@ -0,0 +1,169 @@
+# page_scanner.py
+# [New] Full-Page 感知：整頁截圖 -> 切塊 -> 平行 OmniParser -> 文件座標元素地圖
+# 職責：讓 Agent 對長頁面只「看」一次，之後以元素為目標直接捲動，而不是每次 400px 盲捲
+
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from element_map import ElementMap
+from profiler import profiled
+import api_clients
+import utils
+import browser_controller
+from config import FULL_PAGE_MAX_HEIGHT, FULL_PAGE_TILE_OVERLAP, FULL_PAGE_PARSE_WORKERS
+
+# 元素地圖的 ID 從 1000 起跳，避免與視窗內 SoM 標籤 (1, 2, 3...) 混淆
+PAGE_MAP_ID_OFFSET = 1000
+# [Fix] 提示詞中的視窗外元素以 "P1012" 表示：與 SoM 編號分屬不同的 ID 空間，大腦回傳時依前綴分流
+OFFSCREEN_ID_PREFIX = "P"
+
+
+def split_into_tiles(image_height: int, tile_height: int, overlap: int) -> list:
+    """
+    將整頁高度切成多個分塊，回傳 [(top, bottom, own_top, own_bottom), ...]
+    own_top/own_bottom: 此分塊「負責」的區段 (重疊區各分一半)，用來去除接縫處的重複元素。
+    """
+    if image_height <= tile_height:
+        return [(0, image_height, 0, image_height)]
+
+    step = max(1, tile_height - overlap)
+    tiles = []
+    top = 0
+    while True:
+        bottom = min(top + tile_height, image_height)
+        tiles.append([top, bottom])
+        if bottom >= image_height: break
+        top += step
+
+    bands = []
+    for i, (top, bottom) in enumerate(tiles):
+        own_top = 0 if i == 0 else (top + tiles[i - 1][1]) // 2
+        own_bottom = image_height if i == len(tiles) - 1 else (tiles[i + 1][0] + bottom) // 2
+        bands.append((top, bottom, own_top, own_bottom))
+    return bands
+
+
+def _parse_tile(tile_image: Image.Image):
+    buffered = io.BytesIO()
+    tile_image.save(buffered, format="PNG")
+    omni_result = api_clients.call_eyes_omni_parser(buffered.getvalue())
+    if not omni_result: return []
+    return utils.convert_omni_data_to_elements(omni_result, tile_image.size)
+
+
+@profiled("full_page_scan")
+def scan_full_page(driver) -> dict | None:
+    """
+    建立整頁元素地圖。座標一律為「文件座標 (CSS px)」，與捲動位置無關。
+    回傳: {"url", "doc_height", "css_width", "elements": [...], "build_time"} 或 None
+    """
+    start = time.time()
+    png_bytes, info = browser_controller.capture_full_page_png(driver, max_height=FULL_PAGE_MAX_HEIGHT)
+    if not png_bytes: return None
+
+    image = Image.open(io.BytesIO(png_bytes))
+    image.load()
+    px_per_css = image.width / max(1, info["css_width"])
+
+    tile_height = max(1, int(info["viewport_h"] * px_per_css)) # 每塊約等於一個視窗
+    overlap = int(tile_height * FULL_PAGE_TILE_OVERLAP)
+    bands = split_into_tiles(image.height, tile_height, overlap)
+    print(f"🗺️ [PageMap] 整頁 {image.width}x{image.height}px，切成 {len(bands)} 塊平行解析...")
+
+    tiles = [image.crop((0, top, image.width, bottom)) for top, bottom, _, _ in bands]
+    with ThreadPoolExecutor(max_workers=FULL_PAGE_PARSE_WORKERS) as pool:
+        tile_results = list(pool.map(_parse_tile, tiles))
+
+    elements = []
+    for (top, bottom, own_top, own_bottom), tile_elements in zip(bands, tile_results):
+        for el in tile_elements:
+            center_y = top + el['y'] + el['h'] / 2
+            if not (own_top <= center_y < own_bottom): continue # 接縫處只保留一份
+            elements.append({
+                "x": el['x'] / px_per_css,
+                "y": (top + el['y']) / px_per_css,
+                "w": el['w'] / px_per_css,
+                "h": el['h'] / px_per_css,
+                "tag": el['tag'],
+                "text": el['text']
+            })
+
+    # 依閱讀順序 (上到下、左到右) 編號
+    elements.sort(key=lambda e: (round(e['y']), e['x']))
+    for i, el in enumerate(elements):
+        el['id'] = PAGE_MAP_ID_OFFSET + i + 1
+
+    page_map = {
+        "url": driver.current_url,
+        "doc_height": info["css_height"],
+        "css_width": info["css_width"],
+        "truncated": info["truncated"],
+        "elements": elements,
+        "element_map": ElementMap(elements), # 座標陣列 + ID 索引 (視窗裁切 / 查找用)
+        "build_time": round(time.time() - start, 2)
+    }
+    print(f"🗺️ [PageMap] 完成，共 {len(elements)} 個元素 ({page_map['build_time']}s)")
+    return page_map
+
+
+def is_page_map_valid(page_map: dict, url: str, doc_height: float, tolerance: float = 50) -> bool:
+    """ 同一網址且文件高度沒有明顯改變 (無新內容載入) 才沿用 """
+    if not page_map: return False
+    if page_map["url"] != url: return False
+    # 截圖有高度上限時，只要實際高度仍超過上限即可視為同一頁
+    if page_map["truncated"]: return doc_height >= page_map["doc_height"]
+    return abs(page_map["doc_height"] - doc_height) <= tolerance
+
+
+def viewport_elements(page_map: dict, scroll_y: float, viewport_w: float, viewport_h: float, scale_x: float, scale_y: float) -> list:
+    """
+    從元素地圖裁出目前視窗內的元素，轉成截圖像素座標 (與 OmniParser 單張輸出格式相同)。
+    ID 重新編為 1..n (SoM 標籤)，並以 page_id 保留地圖中的 ID。
+    [Updated] 視窗判斷與座標換算以陣列一次完成
+    """
+    emap = page_map["element_map"]
+    center_y = emap.centers()[:, 1]
+    inside = np.flatnonzero((center_y >= scroll_y) & (center_y < scroll_y + viewport_h) & (emap.boxes[:, 0] < viewport_w))
+    boxes = (emap.boxes[inside] - [0, scroll_y, 0, 0]) * [scale_x, scale_y, scale_x, scale_y]
+    result = []
+    for i, (x, y, w, h) in zip(inside.tolist(), boxes.astype(np.int64).tolist()):
+        el = emap[i]
+        result.append({
+            "id": len(result) + 1, "page_id": el['id'],
+            "x": x, "y": y, "w": w, "h": h,
+            "tag": el['tag'], "text": el['text']
+        })
+    return result
+
+
+def offscreen_elements(page_map: dict, scroll_y: float, viewport_h: float, limit: int = 40) -> list:
+    """ 視窗外的元素 (依距離目前視窗由近到遠)，提供給大腦做 scroll_to 的目標 """
+    emap = page_map["element_map"]
+    center_y = emap.centers()[:, 1]
+    # 視窗上方為 scroll_y - center_y，下方為 center_y - 視窗底；視窗內兩者皆 <= 0
+    distance = np.maximum(scroll_y - center_y, center_y - scroll_y - viewport_h)
+    outside = np.flatnonzero((center_y < scroll_y) | (center_y >= scroll_y + viewport_h))
+    order = outside[np.argsort(distance[outside], kind="stable")][:limit]
+    return [emap[i] for i in order.tolist()]
+
+
+def format_offscreen_id(element_id) -> str:
+    return f"{OFFSCREEN_ID_PREFIX}{element_id}"
+
+
+def parse_offscreen_id(raw_id) -> int | None:
+    """ "P1012" -> 1012；不是視窗外元素的 ID (整數 / 其他字串) 時回傳 None """
+    if not isinstance(raw_id, str): return None
+    raw_id = raw_id.strip()
+    if raw_id[:1].upper() != OFFSCREEN_ID_PREFIX: return None
+    try:
+        return int(raw_id[1:])
+    except ValueError:
+        return None
+
+
+def find_page_element(page_map: dict, element_id) -> dict | None:
+    if not page_map: return None
+    return page_map["element_map"].get(element_id)
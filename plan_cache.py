@@ -0,0 +1,190 @@
+# plan_cache.py
+# [New] Planner 計畫快取
+# 職責：樣板化的目標 (例如 "Find a recipe for X with ...") 不必每次都呼叫推理模型。
+#       以「目標向量相似度 + 同網站」比對，命中後把不同的實體 (X -> Y) 代換進舊計畫。
+
+import atexit
+import json
+import os
+import threading
+import time
+import numpy as np
+import utils
+from config import (PLAN_CACHE_PATH, PLAN_CACHE_SIMILARITY, PLAN_CACHE_LEXICAL_SIMILARITY,
+                    PLAN_CACHE_MAX_ENTRIES, PLAN_CACHE_TTL_DAYS)
+
+
+def _default_embed(text: str) -> list | None:
+    """ 沿用記憶模組的 Embedding (含本地快取)；記憶模組不可用時回傳 None，改用字面相似度 """
+    try:
+        from memory_manager import get_shared_memory_manager
+        return get_shared_memory_manager()._get_embedding(text)
+    except Exception:
+        return None
+
+
+class PlanCache:
+    """
+    entry: {"goal", "site", "plan", "latency", "created_at", "last_used", "hits"}
+    latency: 當初生成計畫花的秒數，命中時累加到 stats["saved_seconds"]。
+    向量不寫入檔案：載入時以 embed_fn 重新取得 (Embedding 快取命中，幾乎沒有成本)，也避免換模型後比對錯亂。
+    淘汰策略：超過 TTL 的計畫失效；超過容量時淘汰最久未使用 (LRU) 的項目。
+    [Fix] 命中只更新記憶體中的 last_used / hits (標記 dirty)，由 flush() 在程式結束時寫檔；store / invalidate 才立即寫入。
+    """
+    def __init__(self, path: str = PLAN_CACHE_PATH, similarity: float = PLAN_CACHE_SIMILARITY,
+                 max_entries: int = PLAN_CACHE_MAX_ENTRIES, ttl_days: float = PLAN_CACHE_TTL_DAYS, embed_fn=_default_embed):
+        self.path = path
+        self.similarity = similarity
+        self.max_entries = max_entries
+        self.ttl = ttl_days * 86400
+        self.embed_fn = embed_fn
+        self._lock = threading.Lock()
+        self._vectors = {} # goal -> 正規化後的向量 (np.ndarray) 或 None
+        self._dirty = False # 命中後尚未寫檔的 last_used / hits
+        self.entries = []
+        self.stats = {"lookups": 0, "exact_hits": 0, "similar_hits": 0, "misses": 0, "declined": 0, "stores": 0,
+                      "evictions": 0, "saved_seconds": 0.0}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except Exception as e:
+            print(f"⚠️ [PlanCache] 讀取 {self.path} 失敗，從空白開始: {e}")
+            self.entries = []
+
+    def _save(self):
+        self._dirty = False
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _vector(self, goal: str):
+        """ 不需持鎖：同一個 goal 被兩個執行緒同時計算時，只是多算一次 """
+        if goal not in self._vectors:
+            vec = self.embed_fn(goal) if self.embed_fn else None
+            if vec is not None:
+                vec = np.asarray(vec, dtype=np.float32)
+                vec /= max(float(np.linalg.norm(vec)), 1e-12)
+            self._vectors[goal] = vec
+        return self._vectors[goal]
+
+    def _evict(self):
+        now = time.time()
+        alive = [e for e in self.entries if now - e["created_at"] <= self.ttl]
+        expired = len(self.entries) - len(alive)
+        overflow = max(0, len(alive) - self.max_entries)
+        if overflow:
+            alive.sort(key=lambda e: e["last_used"], reverse=True)
+            alive = alive[:self.max_entries]
+        self.stats["evictions"] += expired + overflow
+        self.entries = alive
+
+    def lookup(self, goal: str, site: str = "") -> str | None:
+        """ 回傳可直接使用的計畫 (已做實體代換)；沒有足夠相似的項目時回傳 None """
+        # 候選項目在鎖內取快照；Embedding 可能是網路呼叫，在鎖外計算，平行 Worker 不互相等待
+        with self._lock:
+            self.stats["lookups"] += 1
+            now = time.time()
+            candidates = [e for e in self.entries if e["site"] == site and now - e["created_at"] <= self.ttl]
+
+        best, best_score, threshold = None, 0.0, self.similarity
+        for entry in candidates:
+            if entry["goal"] == goal:
+                best, best_score = entry, 1.0
+                break
+        if best is None and candidates:
+            query_vec = self._vector(goal)
+            if query_vec is not None:
+                vectors = [(e, self._vector(e["goal"])) for e in candidates]
+                vectors = [(e, v) for e, v in vectors if v is not None]
+                if vectors:
+                    scores = np.stack([v for _, v in vectors]) @ query_vec
+                    idx = int(np.argmax(scores))
+                    best, best_score = vectors[idx][0], float(scores[idx])
+            else:
+                threshold = PLAN_CACHE_LEXICAL_SIMILARITY # 沒有向量時退回字面相似度 (分數尺度不同)
+                for entry in candidates:
+                    score = utils.goal_similarity(entry["goal"], goal)
+                    if score > best_score:
+                        best, best_score = entry, score
+
+        # [Fix] 只有差異全是可替換的實體、且每個舊實體都真的出現在計畫裡時才採用
+        # (多了 / 少了字，或舊計畫沒提到該實體，代換後的計畫仍是舊目標的計畫)
+        replacements = None
+        if best is not None and best_score >= threshold:
+            replacements = utils.goal_slot_diff(best["goal"], goal)
+            if replacements is None or not utils.goal_slots_covered([best["plan"]], replacements):
+                print(f"📋 [PlanCache] 相似計畫無法安全代換，重新規劃: {best['goal']}")
+                with self._lock:
+                    self.stats["declined"] += 1
+                best = None
+
+        with self._lock:
+            # 計算期間可能被 invalidate / 淘汰
+            if best is None or best_score < threshold or not any(e is best for e in self.entries):
+                self.stats["misses"] += 1
+                return None
+            best["last_used"] = time.time()
+            best["hits"] += 1
+            self.stats["exact_hits" if best["goal"] == goal else "similar_hits"] += 1
+            self.stats["saved_seconds"] += best.get("latency", 0.0)
+            self._dirty = True
+        plan = utils.substitute_goal_slots(best["plan"], best["goal"], goal, replacements=replacements)
+        print(f"📋 [PlanCache] 命中快取計畫 (相似度 {best_score:.2f}): {best['goal']}")
+        return plan
+
+    def store(self, goal: str, site: str, plan: str, latency: float = 0.0):
+        if not plan: return
+        with self._lock:
+            now = time.time()
+            self.entries = [e for e in self.entries if not (e["goal"] == goal and e["site"] == site)]
+            self.entries.append({"goal": goal, "site": site, "plan": plan, "latency": round(latency, 2), "created_at": now, "last_used": now, "hits": 0})
+            self._evict()
+            self._save()
+            self.stats["stores"] += 1
+
+    def invalidate(self, goal: str, site: str = ""):
+        """ 計畫被證實走不通 (需要 Re-plan) 時移除，下次重新生成 """
+        with self._lock:
+            before = len(self.entries)
+            self.entries = [e for e in self.entries if not (e["goal"] == goal and e["site"] == site)]
+            if len(self.entries) != before:
+                self._save()
+
+    def flush(self):
+        """ 把命中後更新的 last_used / hits 寫回檔案 (程式結束時自動呼叫) """
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def summary(self) -> dict:
+        """ 命中率等指標 (測試報告用) """
+        hits = self.stats["exact_hits"] + self.stats["similar_hits"]
+        return dict(self.stats, entries=len(self.entries),
+                    hit_rate=round(hits / self.stats["lookups"], 3) if self.stats["lookups"] else 0.0)
+
+
+_SHARED_CACHE = None
+_SHARED_LOCK = threading.Lock()
+
+
+def get_shared_plan_cache() -> PlanCache:
+    global _SHARED_CACHE
+    with _SHARED_LOCK:
+        if _SHARED_CACHE is None:
+            _SHARED_CACHE = PlanCache()
+            atexit.register(_SHARED_CACHE.flush)
+    return _SHARED_CACHE
+
+
+def configure_shared_plan_cache(path: str) -> PlanCache:
+    """ [New] 指定共用 PlanCache 的檔案 (test_suite 每個分片一份)；須在第一次 get_shared_plan_cache() 之前呼叫 """
+    global _SHARED_CACHE
+    with _SHARED_LOCK:
+        _SHARED_CACHE = PlanCache(path=path)
+        atexit.register(_SHARED_CACHE.flush)
+    return _SHARED_CACHE
@@ -1,18 +1,34 @@
 # planner_client.py
 import requests
 import json
+import time
+from config import PLAN_CACHE_ENABLED
+from profiler import profiled
 
 # 設定你的 Server IP 和 Port
 # 請確保這裡與你的 Docker 容器設定一致
 PLANNER_API_URL = "http://yourserverip:port/v1/chat/completions"
 MODEL_NAME = "deepseek-reasoner" 
 
-def generate_plan(user_goal: str) -> str:
+def _plan_cache():
+    """ [New] 計畫快取 (PLAN_CACHE_ENABLED=False 時回傳 None) """
+    if not PLAN_CACHE_ENABLED: return None
+    import plan_cache
+    return plan_cache.get_shared_plan_cache()
+
+def generate_plan(user_goal: str, site: str = "") -> str:
     """
     [Initial Planner]
     任務啟動時呼叫，生成初始的高層次執行計畫。
     已加入「批量查詢」優化策略。
+    [Updated] 先查計畫快取 (同網站 + 相似目標)，命中就不呼叫推理模型。
     """
+    cache = _plan_cache()
+    if cache:
+        cached_plan = cache.lookup(user_goal, site)
+        if cached_plan:
+            return cached_plan
+
     print(f"🧠 [Planner] 正在呼叫 DeepSeek-R1 生成初始計畫... (Goal: {user_goal})")
     
     system_prompt = """
@@ -45,11 +61,14 @@ def generate_plan(user_goal: str) -> str:
     }
 
     try:
+        start_time = time.time()
         response = requests.post(PLANNER_API_URL, json=payload, timeout=60)
         if response.status_code == 200:
             result = response.json()
             plan_content = result['choices'][0]['message']['content']
             print("📋 [Planner] 初始計畫生成完畢！")
+            if cache:
+                cache.store(user_goal, site, plan_content, latency=time.time() - start_time)
             return plan_content
         else:
             print(f"❌ [Planner Error] API 回傳錯誤: {response.status_code} - {response.text}")
@@ -58,6 +77,13 @@ def generate_plan(user_goal: str) -> str:
         print(f"❌ [Planner Error] 連線失敗: {e}")
         return None
 
+def forget_plan(user_goal: str, site: str = ""):
+    """ [New] 計畫走不通 (觸發 Re-plan) 時，從快取移除這個目標的計畫 """
+    cache = _plan_cache()
+    if cache:
+        cache.invalidate(user_goal, site)
+
+@profiled("replan")
 def replan_task(user_goal: str, old_plan: str, current_status: str) -> str:
     """
     [Recovery Planner]
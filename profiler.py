@@ -0,0 +1,76 @@
+# profiler.py
+# [New] 每一步的延遲剖析 (巢狀 Span)
+# 職責：量出一步 20~60 秒花在哪裡 (頁面穩定等待、截圖、頁面文字、OmniParser、DOM 對齊、A11y、SoM、TARS、大腦、動作、動作後等待)。
+#   - begin_step() / end_step() 界定一步，中間的 span() / @profiled 形成一棵時間樹
+#   - 只記錄呼叫 begin_step() 的執行緒 (Agent 主迴圈 / 平行 Worker)；背景執行緒的 Span 直接略過，
+#     它們的時間會反映在主迴圈等待結果的 Span 上
+#   - 結果格式: [{"name": "analyze", "ms": 812.3, "children": [...]}, ...]，由 TestLogger 寫入 step["timings"]
+# 分析: python analyze_logs.py (各階段 p50 / p95 / max，依網站與動作類型分組)
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from config import PROFILER_ENABLED
+
+_local = threading.local()
+
+
+def begin_step():
+    """ 開始記錄新的一步 (捨棄上一步未取走的結果)；PROFILER_ENABLED 關閉時不記錄 """
+    if not PROFILER_ENABLED:
+        _local.roots = _local.stack = None
+        return
+    _local.roots = []
+    _local.stack = []
+    _local.started = time.perf_counter()
+
+
+def end_step() -> dict | None:
+    """ 結束這一步並取回 {"total_ms", "spans"}；這個執行緒沒有在記錄 (或剖析已關閉) 時回傳 None """
+    roots = getattr(_local, "roots", None)
+    if roots is None: return None
+    total_ms = (time.perf_counter() - _local.started) * 1000
+    _local.roots = _local.stack = None
+    return {"total_ms": round(total_ms, 1), "spans": roots}
+
+
+@contextmanager
+def span(name: str):
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        yield
+        return
+    node = {"name": name, "ms": 0.0, "children": []}
+    (stack[-1]["children"] if stack else _local.roots).append(node)
+    stack.append(node)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        node["ms"] = round((time.perf_counter() - start) * 1000, 1)
+        if not node["children"]: del node["children"]
+        stack.pop()
+
+
+def profiled(name: str = None):
+    """ 裝飾器版的 span()，name 預設為函式名稱 """
+    def decorator(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def flatten_spans(spans: list, prefix: str = "") -> dict:
+    """ 巢狀 Span -> {"analyze/omniparser": ms, ...}；同一路徑出現多次 (例如重試) 時加總 """
+    flat = {}
+    for node in spans or []:
+        path = f"{prefix}/{node['name']}" if prefix else node['name']
+        flat[path] = flat.get(path, 0.0) + node['ms']
+        for child_path, ms in flatten_spans(node.get('children'), path).items():
+            flat[child_path] = flat.get(child_path, 0.0) + ms
+    return flat
@@ -0,0 +1,231 @@
+# skill_cache.py
+# [New] Skill (巨集) 快取：記錄成功任務的動作序列，相似目標直接重播
+# 職責：錄製 (定位資訊 + 前後頁面狀態) -> 驗證成功後存檔 -> 新任務比對 -> 逐步重播並驗證，
+#       一旦偏離就交還給完整的感知 / 大腦流程。
+
+import json
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+import utils
+from config import SKILL_STORE_PATH, SKILL_MATCH_THRESHOLD, SKILL_MAX_PER_SITE
+
+# 可重播的動作 (extract_content / finish 需要理解頁面內容，一律交給大腦)
+REPLAYABLE_ACTIONS = {"click", "type", "goto_url", "scroll", "scroll_to", "go_back"}
+
+
+def _url_path(url: str) -> str:
+    try:
+        parsed = urlparse(url or "")
+        return f"{parsed.hostname or ''}{parsed.path.rstrip('/')}"
+    except Exception:
+        return ""
+
+
+def _step_texts(step: dict) -> list:
+    """ 重播時會做實體替換的欄位 (輸入值 / 網址與定位文字) """
+    return [step.get("value"), (step.get("locator") or {}).get("text")]
+
+
+def skill_matches_goal(skill: dict, goal: str) -> bool:
+    """ [New] 新目標與 Skill 的差異只有實體替換，且每個舊實體都出現在錄製的步驟裡 """
+    replacements = utils.goal_slot_diff(skill["goal"], goal)
+    if replacements is None: return False
+    return utils.goal_slots_covered([t for step in skill["steps"] for t in _step_texts(step)], replacements)
+
+
+def make_step(action: str, value=None, locator: dict = None, pre_fp=None, post_fp=None, doc_y=None) -> dict:
+    """
+    建立一個錄製步驟。
+    pre_fp / post_fp: page_fingerprint.PageFingerprint；只存網址路徑與「變化層級」，
+    重播時用來便宜地驗證「在對的頁面」以及「動作有產生跟當初一樣的效果」。
+    """
+    return {
+        "action": action,
+        "value": value,
+        "locator": locator,
+        "doc_y": doc_y,
+        "pre_path": _url_path(pre_fp.url) if pre_fp else "",
+        "post_change": post_fp.compare(pre_fp) if (pre_fp and post_fp) else None
+    }
+
+
+class SkillStore:
+    """
+    以 JSON 檔保存的 Skill 清單 (依網域分組)。
+    skill: {"id", "site", "goal", "start_path", "steps", "created_at", "uses", "successes"}
+    """
+    def __init__(self, path: str = SKILL_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.skills = []
+        self.stats = {"matches": 0, "saved": 0, "declined": 0}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.skills = json.load(f)
+        except Exception as e:
+            print(f"⚠️ [Skill] 讀取 {self.path} 失敗，從空白開始: {e}")
+            self.skills = []
+
+    def _save(self):
+        # 先寫暫存檔再取代，避免中途中斷留下壞掉的 JSON
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.skills, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def save_skill(self, goal: str, site: str, start_url: str, steps: list):
+        """ 只在任務「驗證成功」後呼叫；同網站同目標的舊 Skill 會被取代 """
+        steps = [s for s in steps if s["action"] in REPLAYABLE_ACTIONS]
+        if not steps: return
+        with self._lock:
+            self.skills = [s for s in self.skills if not (s["site"] == site and s["goal"] == goal)]
+            self.skills.append({
+                "id": str(uuid.uuid4()), "site": site, "goal": goal,
+                "start_path": _url_path(start_url), "steps": steps,
+                "created_at": time.time(), "uses": 0, "successes": 0
+            })
+            # 每個網站只保留最近 / 最常成功的 SKILL_MAX_PER_SITE 個
+            same_site = sorted((s for s in self.skills if s["site"] == site),
+                               key=lambda s: (s["successes"], s["created_at"]), reverse=True)
+            drop = {s["id"] for s in same_site[SKILL_MAX_PER_SITE:]}
+            self.skills = [s for s in self.skills if s["id"] not in drop]
+            self._save()
+            self.stats["saved"] += 1
+        print(f"🧩 [Skill] 已儲存 {len(steps)} 步的 Skill: {goal}")
+
+    def find_skill(self, goal: str, site: str, start_url: str = None, threshold: float = SKILL_MATCH_THRESHOLD) -> dict | None:
+        """
+        同網站 (+ 同起始頁) 中目標最相似且超過門檻的 Skill。
+        [Fix] 目標有新增 / 刪除的字 (例如多了 "Pro"、"without cheese")，或舊目標的實體沒有出現在
+              錄製的輸入值 / 定位文字中 (無法替換) 時不採用，交給大腦重新做。
+        """
+        start_path = _url_path(start_url) if start_url else None
+        with self._lock:
+            candidates = []
+            for skill in self.skills:
+                if skill["site"] != site: continue
+                if start_path and skill["start_path"] and skill["start_path"] != start_path: continue
+                score = utils.goal_similarity(skill["goal"], goal)
+                if score >= threshold:
+                    candidates.append((score, skill))
+            best, best_score = None, 0.0
+            for score, skill in sorted(candidates, key=lambda pair: pair[0], reverse=True):
+                if skill_matches_goal(skill, goal):
+                    best, best_score = skill, score
+                    break
+                self.stats["declined"] += 1
+                print(f"🧩 [Skill] 目標差異無法以實體替換，不採用: {skill['goal']}")
+            if best:
+                best["uses"] += 1
+                self.stats["matches"] += 1
+        if best:
+            print(f"🧩 [Skill] 命中 Skill (相似度 {best_score:.2f}): {best['goal']}")
+        return best
+
+    def record_outcome(self, skill_id: str, success: bool):
+        with self._lock:
+            for skill in self.skills:
+                if skill["id"] == skill_id and success:
+                    skill["successes"] += 1
+            self._save()
+
+
+class SkillReplay:
+    """
+    一次重播的狀態。next_step() 依序給出步驟 (已做實體替換)，
+    verify_previous() 檢查上一步的效果；任何一步不符合就 abort，之後回到一般流程。
+    """
+    def __init__(self, skill: dict, goal: str):
+        self.skill = skill
+        self.goal = goal
+        self.cursor = 0
+        self.aborted = False
+        self.pending_pre_fp = None # 上一個重播步驟執行前的頁面指紋
+
+    @property
+    def finished(self) -> bool:
+        return self.aborted or self.cursor >= len(self.skill["steps"])
+
+    def abort(self, reason: str):
+        if not self.aborted:
+            print(f"🧩 [Skill] 重播中止於第 {self.cursor} 步 ({reason})，交還給大腦。")
+        self.aborted = True
+
+    def verify_previous(self, current_fp) -> bool:
+        """ 上一步原本會改變頁面 (navigated / structure_changed...)，現在卻完全沒變 -> 偏離 """
+        if self.cursor == 0 or self.pending_pre_fp is None or current_fp is None: return True
+        expected = self.skill["steps"][self.cursor - 1].get("post_change")
+        actual = current_fp.compare(self.pending_pre_fp)
+        if expected and expected != "identical" and actual == "identical":
+            self.abort(f"預期 {expected}，實際頁面未變")
+            return False
+        return True
+
+    def next_step(self, current_fp) -> dict | None:
+        if self.finished: return None
+        step = self.skill["steps"][self.cursor]
+        if step.get("pre_path") and current_fp and _url_path(current_fp.url) != step["pre_path"]:
+            self.abort(f"頁面不符 ({_url_path(current_fp.url)} != {step['pre_path']})")
+            return None
+        self.cursor += 1
+        self.pending_pre_fp = current_fp
+        step = dict(step)
+        if isinstance(step.get("value"), str):
+            step["value"] = utils.substitute_goal_slots(step["value"], self.skill["goal"], self.goal)
+        if step.get("locator") and step["locator"].get("text"):
+            step["locator"] = dict(step["locator"], text=utils.substitute_goal_slots(step["locator"]["text"], self.skill["goal"], self.goal))
+        return step
+
+
+# [New] 行程內共用 (平行 Worker 寫同一個檔案時以 _lock 序列化)
+_SHARED_STORE = None
+_SHARED_LOCK = threading.Lock()
+
+
+def get_shared_skill_store() -> SkillStore:
+    global _SHARED_STORE
+    with _SHARED_LOCK:
+        if _SHARED_STORE is None:
+            _SHARED_STORE = SkillStore()
+    return _SHARED_STORE
+
+
+def configure_shared_skill_store(path: str) -> SkillStore:
+    """ [New] 指定共用 SkillStore 的檔案 (test_suite 每個分片一份)；須在第一次 get_shared_skill_store() 之前呼叫 """
+    global _SHARED_STORE
+    with _SHARED_LOCK:
+        _SHARED_STORE = SkillStore(path)
+    return _SHARED_STORE
+
+
+def self_check():
+    """ 實體替換與 Skill 比對的回歸案例 (python skill_cache.py) """
+    lasagna = "Find a vegetarian lasagna recipe with at least 4.5 stars"
+    skill = {"goal": "Search for iPhone 15", "steps": [{"action": "type", "value": "iPhone 15", "locator": None}]}
+    checks = [
+        ("新增字 (Pro) 不採用", not skill_matches_goal(skill, "Search for iPhone 15 Pro")),
+        ("替換實體可採用", skill_matches_goal(skill, "Search for iPhone 14")),
+        ("新增條件 (without cheese) 不是替換", utils.goal_slot_diff(lasagna, lasagna + " without cheese") is None),
+        ("舊實體不在步驟中不採用", not skill_matches_goal(
+            {"goal": "Search for iPhone 15", "steps": [{"action": "click", "value": "", "locator": {"text": "Search"}}]},
+            "Search for iPhone 14")),
+        ("只換完整單字 ($40 不變)", utils.substitute_goal_slots(
+            "Set max price $40 and 4 guests", "Book a room for 4 guests", "Book a room for 2 guests") == "Set max price $40 and 2 guests"),
+        ("互換實體不是替換", utils.goal_slot_diff("Find flights from NYC to LA", "Find flights from LA to NYC") is None),
+        ("長片段優先", utils.substitute_goal_slots("lasagna 4.5 stars", lasagna, lasagna.replace("lasagna", "pizza").replace("4.5", "4")) == "pizza 4 stars"),
+        ("網址中的空白", utils.substitute_goal_slots("/s?k=new+york", "Hotels in new york", "Hotels in los angeles") == "/s?k=los+angeles"),
+    ]
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+    return all(ok for _, ok in checks)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if self_check() else 1)
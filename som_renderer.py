@@ -0,0 +1,165 @@
+# som_renderer.py
+# [New] SoM (Set-of-Marks) 標註圖渲染器
+# 職責：取代每一步都重新解碼 PNG、重新載入字型、逐一畫框再存成無損 PNG 的 utils.draw_som_on_image。
+#   - 字型與 ID 標籤圖 (label atlas) 只產生一次，之後直接貼上
+#   - 所有框與標籤畫在同一張透明 Overlay，最後一次合成
+#   - 可縮小尺寸並輸出 JPEG / WebP (大幅減少上傳大小與 Token)
+#   - 截圖與元素地圖都沒變時直接回傳上次的結果
+# 用法: python som_renderer.py  (與 utils.draw_som_on_image 比較速度與輸出大小)
+
+import base64
+import functools
+import hashlib
+import io
+import time
+from PIL import Image, ImageDraw, ImageFont
+from element_map import ElementMap
+from config import SOM_IMAGE_FORMAT, SOM_IMAGE_QUALITY, SOM_MAX_WIDTH, SOM_FONT_SIZE
+
+# 依序嘗試 (Windows / macOS / Linux)；都沒有時使用 Pillow 內建字型
+_FONT_CANDIDATES = ["arial.ttf", "Arial.ttf", "DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+                    "/System/Library/Fonts/Supplemental/Arial.ttf"]
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+@functools.lru_cache(maxsize=4)
+def load_font(size: int = SOM_FONT_SIZE):
+    for candidate in _FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size) # Pillow >= 10.1
+    except TypeError:
+        return ImageFont.load_default()
+
+
+class SoMRenderer:
+    """
+    render(screenshot_bytes, elements, image=None) -> (base64 字串, MIME 類型, 原始截圖尺寸)
+    image: 呼叫端已解碼的 PIL Image (可省去再解碼一次 PNG)
+    呼叫大腦時請傳入回傳的 MIME 類型 (繪圖失敗時回傳原始 PNG，與 self.mime_type 不同)。
+    """
+    def __init__(self, image_format: str = SOM_IMAGE_FORMAT, quality: int = SOM_IMAGE_QUALITY,
+                 max_width: int = SOM_MAX_WIDTH, font_size: int = SOM_FONT_SIZE):
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.max_width = max_width
+        self.font = load_font(font_size)
+        self._labels = {} # ID 字串 -> 預先畫好的標籤 (RGBA)
+        self._last_key = None
+        self._last_result = None
+        self.stats = {"renders": 0, "skipped": 0}
+
+    @property
+    def mime_type(self) -> str:
+        return _MIME_TYPES.get(self.image_format, "image/png")
+
+    def _label(self, el_id: str) -> Image.Image:
+        label = self._labels.get(el_id)
+        if label is None:
+            left, top, right, bottom = self.font.getbbox(el_id)
+            text_w, text_h = right - left, bottom - top
+            label = Image.new("RGBA", (text_w + 8, text_h + 4), (255, 255, 0, 255))
+            draw = ImageDraw.Draw(label)
+            draw.rectangle([0, 0, label.width - 1, label.height - 1], outline="red")
+            draw.text((4 - left, -top), el_id, fill="black", font=self.font)
+            self._labels[el_id] = label
+        return label
+
+    @staticmethod
+    def _frame_key(screenshot_bytes: bytes, emap: ElementMap) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(screenshot_bytes)
+        digest.update(emap.boxes.tobytes())
+        digest.update("\0".join(str(el['id']) for el in emap).encode("utf-8"))
+        return digest.digest()
+
+    def render(self, screenshot_bytes: bytes, elements, image: Image.Image = None):
+        emap = ElementMap.wrap(elements)
+        key = self._frame_key(screenshot_bytes, emap)
+        if key == self._last_key:
+            self.stats["skipped"] += 1
+            return self._last_result
+        try:
+            base = (image if image is not None else Image.open(io.BytesIO(screenshot_bytes))).convert("RGB")
+            width, height = base.size
+
+            # 先縮圖再畫：框線與標籤維持固定粗細 / 字級，縮小後仍清楚
+            scale = 1.0
+            if self.max_width and width > self.max_width:
+                scale = self.max_width / width
+                base = base.resize((self.max_width, max(1, round(height * scale))), Image.BILINEAR)
+
+            overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
+            draw = ImageDraw.Draw(overlay)
+            visible = emap.in_bounds_mask(width, height)
+            corners = (emap.corners()[visible] * scale).astype(int).tolist()
+            ids = [str(el['id']) for el, keep in zip(emap, visible.tolist()) if keep]
+            for el_id, (x, y, x2, y2) in zip(ids, corners):
+                draw.rectangle([x, y, x2, y2], outline="red", width=2)
+            for el_id, (x, y, _, _) in zip(ids, corners): # 標籤最後貼，避免被其他框線蓋住
+                label = self._label(el_id)
+                label_y = y - label.height if y - label.height >= 0 else y # 太上面就貼在框內
+                overlay.paste(label, (x, label_y), label)
+            base.paste(overlay, (0, 0), overlay)
+
+            buffered = io.BytesIO()
+            if self.image_format == "PNG":
+                base.save(buffered, format="PNG")
+            elif self.image_format == "WEBP":
+                base.save(buffered, format="WEBP", quality=self.quality, method=2) # method 2: 速度 / 大小的平衡點
+            else:
+                base.save(buffered, format=self.image_format, quality=self.quality)
+            result = (base64.b64encode(buffered.getvalue()).decode("utf-8"), self.mime_type, (width, height))
+        except Exception as e:
+            print(f"❌ [SoM] 繪圖失敗: {e}")
+            # 失敗時回傳原始截圖 (PNG，不快取)
+            return base64.b64encode(screenshot_bytes).decode("utf-8"), "image/png", (0, 0)
+
+        self.stats["renders"] += 1
+        self._last_key, self._last_result = key, result
+        return result
+
+
+def benchmark(rounds: int = 20, count: int = 60):
+    """ 與 utils.draw_som_on_image 比較：首次渲染、相同畫面重繪 (快取命中)、輸出大小 """
+    import random
+    import utils
+    rng = random.Random(0)
+    frame = Image.new("RGB", (1920, 1080), "white")
+    draw = ImageDraw.Draw(frame)
+    for _ in range(200): # 模擬網頁：色塊 + 文字
+        x, y = rng.randrange(1800), rng.randrange(1000)
+        draw.rectangle([x, y, x + rng.randrange(20, 300), y + rng.randrange(10, 80)],
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+        draw.text((x + 5, y + 5), "Lorem ipsum dolor", fill="black")
+    buffered = io.BytesIO()
+    frame.save(buffered, format="PNG")
+    png = buffered.getvalue()
+    elements = [{"id": i + 1, "x": rng.randrange(1800), "y": rng.randrange(1000), "w": rng.randrange(20, 200),
+                 "h": rng.randrange(15, 60), "tag": "vision_el", "text": ""} for i in range(count)]
+
+    def timed(fn):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            out = fn()
+        return (time.perf_counter() - start) / rounds * 1000, len(out[0]) * 3 // 4
+
+    print(f"{'Renderer':<28} | {'ms/frame':>9} | {'KB':>7}")
+    print("-" * 52)
+    t, size = timed(lambda: utils.draw_som_on_image(png, elements))
+    print(f"{'utils.draw_som_on_image':<28} | {t:>9.1f} | {size / 1024:>7.0f}")
+    for fmt in ("PNG", "JPEG", "WEBP"):
+        renderer = SoMRenderer(image_format=fmt)
+        # 每輪換一個元素地圖 (強迫重畫)，測實際渲染成本
+        t, size = timed(lambda: renderer.render(png, elements[:count - rng.randrange(1, 5)]))
+        print(f"{f'SoMRenderer {fmt}':<28} | {t:>9.1f} | {size / 1024:>7.0f}")
+    renderer.render(png, elements)
+    t, _ = timed(lambda: renderer.render(png, elements))
+    print(f"{'SoMRenderer (unchanged)':<28} | {t:>9.2f} |")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -4,11 +4,17 @@ import json
 import time
 from datetime import datetime
 
+# Session 彙總報告檔名 (analyze_logs 會略過這個檔案)
+SESSION_REPORT_NAME = "session_report.json"
+
 class TestLogger:
-    def __init__(self, log_dir="test_logs"):
+    def __init__(self, log_dir="test_logs", session_dir=None):
         # 建立以時間命名的資料夾，例如 test_logs/2023-10-27_10-30-00
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self.session_dir = os.path.join(log_dir, timestamp)
+        # [New] 平行模式下，各 Worker 傳入同一個 session_dir，Log 會寫進同一個資料夾
+        if session_dir is None:
+            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            session_dir = os.path.join(log_dir, timestamp)
+        self.session_dir = session_dir
         os.makedirs(self.session_dir, exist_ok=True)
         
         self.current_log = {}
@@ -41,6 +47,18 @@ class TestLogger:
         self.current_log["steps"].append(entry)
         # 即時寫入，避免程式崩潰導致 Log 遺失
         self._save_to_disk()
+        return entry
+
+    def attach_timings(self, entry, timings, **extra):
+        """ [New] 步驟結束 (動作執行完) 後補上 profiler 的延遲樹與實際執行的動作 """
+        entry["timings"] = timings
+        entry.update(extra)
+        self._save_to_disk()
+
+    def annotate_case(self, key, value):
+        """ [New] 在案例層級附加額外資訊 (例如網路統計) """
+        self.current_log[key] = value
+        self._save_to_disk()
 
     def end_case(self, status, error_msg=""):
         """ 結束測試並標記狀態 """
@@ -50,6 +68,21 @@ class TestLogger:
         self.current_log["error_msg"] = error_msg
         self._save_to_disk()
 
+    def save_session_report(self, results, meta=None):
+        """ [New] 寫出整個 Session 的彙總報告 (合併所有 Worker 的結果) """
+        report = {
+            "created_at": time.time(),
+            "meta": meta or {},
+            "results": results
+        }
+        report_path = os.path.join(self.session_dir, SESSION_REPORT_NAME)
+        try:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"❌ Session 報告寫入失敗: {e}")
+        return report_path
+
     def _save_to_disk(self):
         try:
             with open(self.log_filepath, 'w', encoding='utf-8') as f:
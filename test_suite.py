@@ -1,21 +1,35 @@
 # test_suite.py
-# [Updated] V4 - Singleton Driver (Fastest Mode for Windows)
+# [Updated] V6 - Singleton Driver (Fastest Mode for Windows) + Parallel Worker Pool
+#           + 篩選 / 分片 (跨行程、跨機器) / 逐題 Checkpoint / 續跑 / 合併報告
 
 import time
 import sys
 import json
 import os
+import glob
+import zlib
+import fnmatch
+import queue
+import shutil
+import argparse
+import threading
 from collections import defaultdict
-from browser_controller import initialize_agent
+from browser_controller import initialize_agent, sync_request_blocking, get_network_stats
 from agent_core import AgentCore
 from test_logger import TestLogger
+from config import CHROME_PROFILE_NAME, PLAN_CACHE_ENABLED, SKILL_STORE_PATH, PLAN_CACHE_PATH
+from network_blocker import BYTES_ESTIMATE_METHOD
+import memory_writer
+import plan_cache
+import skill_cache
 
 
 
 logger = TestLogger()
+DEFAULT_DATASET = "test_dataset_50.json" # 預設讀取抽樣後的檔案
+
 # 1. 讀取測試集 (保持不變)
-def load_test_cases():
-    dataset_path = "test_dataset_50.json" # 確保這裡讀取的是抽樣後的檔案
+def load_test_cases(dataset_path=DEFAULT_DATASET):
     try:
         with open(dataset_path, "r", encoding="utf-8") as f:
             data = json.load(f)
@@ -34,36 +48,129 @@ def load_test_cases():
         print(f"❌ 找不到 {dataset_path}，請先執行 sample_dataset.py！")
         return []
 
-TEST_CASES = load_test_cases()
+def filter_test_cases(cases, sites=None, ids=None, limit=None):
+    """
+    [New] 依網站 (web_name，不分大小寫) 與案例 ID (支援 * ? 萬用字元，例如 "Amazon--1*") 篩選
+    """
+    if sites:
+        wanted = {s.lower() for s in sites}
+        cases = [c for c in cases if c['web_name'].lower() in wanted]
+    if ids:
+        cases = [c for c in cases if any(fnmatch.fnmatchcase(c['id'], pattern) for pattern in ids)]
+    return cases[:limit] if limit else cases
+
+def shard_test_cases(cases, shard_index, num_shards):
+    """
+    [New] 依案例 ID 的 crc32 分片：與執行順序、篩選條件無關，不同機器對同一份測試集會切出相同的分片
+    """
+    if num_shards <= 1: return cases
+    return [c for c in cases if zlib.crc32(c['id'].encode("utf-8")) % num_shards == shard_index]
+
+# [New] 逐題 Checkpoint (JSONL)：每完成一題就附加一行並 fsync，當機 / Ctrl-C 也不會遺失已完成的結果
+class CaseCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # 上次中斷時最後一行可能沒寫完，先補換行，避免與下一筆黏在一起
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n": f.write(b"\n")
+
+    def load(self):
+        return load_checkpoint_results([self.path])
+
+    def append(self, result):
+        line = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+def load_checkpoint_results(paths):
+    """ 讀取一或多個 Checkpoint (分片輸出)，同一個 ID 以最後一筆為準；寫到一半的最後一行直接忽略 """
+    merged = {}
+    for path in paths:
+        if not os.path.exists(path): continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                merged[result['id']] = result
+    return list(merged.values())
+
+def default_checkpoint_path(dataset_path, shard_index, num_shards):
+    name = os.path.splitext(os.path.basename(dataset_path))[0]
+    return os.path.join("test_logs", "checkpoints", f"{name}.shard{shard_index}of{num_shards}.jsonl")
 
 # 2. [Modified] 執行單一測試 (接收外部傳入的 driver)
-def run_single_test(test_case, driver):
+def shard_profile_name(shard_index=0, num_shards=1, worker_id=None):
+    """
+    [Fix] Chrome Profile 名稱納入分片編號：同一台機器上的多個分片行程不會搶同一個 user-data-dir。
+    未分片時沿用原本的名稱 (既有的登入狀態 / Cookie 不受影響)。
+    """
+    name = CHROME_PROFILE_NAME
+    if num_shards > 1: name += f"_s{shard_index}"
+    if worker_id is not None: name += f"_w{worker_id}" if num_shards > 1 else f"_worker{worker_id}"
+    return name
+
+def shard_local_path(path, shard_index, num_shards):
+    """ ./skill_store.json -> ./skill_store.shard0of4.json；檔案不存在時先複製共用檔當作起點 """
+    root, ext = os.path.splitext(path)
+    local_path = f"{root}.shard{shard_index}of{num_shards}{ext}"
+    if not os.path.exists(local_path) and os.path.exists(path):
+        shutil.copyfile(path, local_path)
+    return local_path
+
+def use_shard_local_stores(shard_index, num_shards):
+    """
+    [Fix] skill_store.json / plan_cache.json 是整檔覆寫，多個分片行程共寫時後寫的會蓋掉先寫的。
+    分片執行時每個分片改用自己的檔案 (從共用檔複製)，跑完後新學到的 Skill / 計畫留在分片檔中。
+    """
+    if num_shards <= 1: return
+    skill_path = shard_local_path(SKILL_STORE_PATH, shard_index, num_shards)
+    skill_cache.configure_shared_skill_store(skill_path)
+    print(f"🧩 [Shard] Skill 庫: {skill_path}")
+    if PLAN_CACHE_ENABLED:
+        cache_path = shard_local_path(PLAN_CACHE_PATH, shard_index, num_shards)
+        plan_cache.configure_shared_plan_cache(cache_path)
+        print(f"🧩 [Shard] 計畫快取: {cache_path}")
+
+def run_single_test(test_case, driver, case_logger=None):
     """
     現在 driver 是從外部傳進來的，這個函式只負責跑邏輯，不負責開關瀏覽器。
+    case_logger: 平行模式下每個 Worker 自帶 TestLogger；未提供時使用全域 logger。
     """
+    case_logger = case_logger or logger
     print(f"\n🚀 Starting Test: {test_case['id']} ({test_case['web_name']})")
     print(f"🎯 Goal: {test_case['goal']}")
-    logger.start_case(test_case)
+    case_logger.start_case(test_case)
     # [Cleanup] 每次新任務開始前，建議清除 Cookie，避免上一題的登入狀態影響這一題
     try:
         driver.delete_all_cookies()
         # driver.execute_script("window.localStorage.clear();") # 視情況選用
     except: pass
+    get_network_stats(driver, reset=True) # 清掉上一題殘留的封鎖統計
 
-    # 強制導航至起始 URL
+    # 初始化 Agent (Agent 是任務級別的，每次都要新的)
+    # [Updated] 先啟動任務：RAG 檢索與 Planner 在背景執行，與下面的導航同時進行
     start_url = test_case.get("url")
+    agent = AgentCore(driver, logger=case_logger)
+    agent.start_new_task(test_case['goal'], start_url=start_url)
+
+    # 強制導航至起始 URL (頁面穩定由 analyze_next_step 的 wait_for_page_stability 處理，不再固定 sleep)
     if start_url:
         print(f"🔗 Navigating to start URL: {start_url}")
         try:
+            sync_request_blocking(driver, start_url)
             driver.get(start_url)
-            time.sleep(3)
         except Exception as e:
             print(f"❌ Failed to navigate: {e}")
             return False # 導航失敗直接下一題，但不關瀏覽器
-
-    # 初始化 Agent (Agent 是任務級別的，每次都要新的)
-    agent = AgentCore(driver, logger=logger)
-    agent.start_new_task(test_case['goal'])
     
     success = False
     fail_reason = "" # 用來記錄失敗原因
@@ -91,12 +198,20 @@ def run_single_test(test_case, driver):
             print(f"❌ Error during step execution: {e}")
             break
     
+    agent.flush_step_profile() # 最後一步 (finish / 例外) 的延遲剖析
     if not success:
         if not fail_reason: fail_reason = "Steps limit reached"
         print(f"❌ Failed: {fail_reason}")
         
     status = "PASS" if success else "FAIL"
-    logger.end_case(status, error_msg=fail_reason)
+    network_stats = get_network_stats(driver)
+    if network_stats:
+        print(f"🛡️ [Network] 本題封鎖 {network_stats['blocked_requests']} 個請求 "
+              f"(估計省下約 {network_stats['blocked_bytes_estimate'] / 1024:.0f} KB，依資源類型典型大小推算、非實測；"
+              f"實際載入 {network_stats['loaded_bytes'] / 1024:.0f} KB)")
+        case_logger.annotate_case("network", network_stats)
+    case_logger.annotate_case("replan", agent.replan_stats)
+    case_logger.end_case(status, error_msg=fail_reason)
     # 簡易驗證
     current_url = driver.current_url
     expected_keyword = test_case.get('expected_url_keyword')
@@ -139,60 +254,217 @@ def analyze_results(results):
         print(f"{domain:<25} | {stats['total']:<8} | {stats['pass']:<8} | {rate:.1f}%")
     print("="*60)
 
-# 4. [Modified] 主程式：只啟動一次瀏覽器
+def shutdown_driver(driver):
+    """ 關閉瀏覽器 (含 Windows 強制清理) """
+    try:
+        driver.quit()
+        # Windows 強制清理 (保險起見)
+        if sys.platform == "win32":
+            try:
+                if hasattr(driver, 'service') and driver.service.process:
+                    os.system(f"taskkill /F /PID {driver.service.process.pid} /T >nul 2>&1")
+            except: pass
+    except Exception as e:
+        print(f"⚠️ 關閉時發生錯誤: {e}")
+
+# 4. [New] 平行模式：N 個獨立瀏覽器 + 共用工作佇列
+def _parallel_worker(worker_id, case_queue, results, results_lock, session_dir, stop_event, launch_mode=None, checkpoint=None,
+                     shard_index=0, num_shards=1):
+    """
+    每個 Worker 擁有自己的 Chrome (獨立 user-data-dir)、自己的 TestLogger，
+    從共用佇列取案例，直到佇列清空或收到停止訊號。
+    """
+    profile_name = shard_profile_name(shard_index, num_shards, worker_id)
+    # 每題都會自行導航到起始網址，啟動時不需要先開 Google
+    driver = initialize_agent(profile_name=profile_name, launch_mode=launch_mode, startup_url=None)
+    if not driver:
+        # 啟動失敗不影響其他 Worker，剩下的案例會由其他 Worker 消化
+        print(f"❌ [Worker {worker_id}] 瀏覽器啟動失敗，Worker 退出。")
+        return
+
+    worker_logger = TestLogger(session_dir=session_dir)
+    try:
+        while not stop_event.is_set():
+            try:
+                case = case_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                is_pass = run_single_test(case, driver, case_logger=worker_logger)
+            except Exception as e:
+                print(f"❌ [Worker {worker_id}] {case['id']} 發生未預期錯誤: {e}")
+                is_pass = False
+
+            result = {
+                "id": case['id'],
+                "web_name": case['web_name'],
+                "status": "PASS" if is_pass else "FAIL",
+                "worker": worker_id
+            }
+            with results_lock:
+                results.append(result)
+            if checkpoint: checkpoint.append(result)
+            time.sleep(2)
+    finally:
+        print(f"🔻 [Worker {worker_id}] 任務結束，關閉瀏覽器...")
+        shutdown_driver(driver)
+
+def run_parallel(target_cases, num_workers, launch_mode=None, checkpoint=None, shard_index=0, num_shards=1):
+    """ 啟動 num_workers 個瀏覽器平行執行，回傳合併後的 results """
+    case_queue = queue.Queue()
+    for case in target_cases:
+        case_queue.put(case)
+
+    results = []
+    results_lock = threading.Lock()
+    stop_event = threading.Event()
+    num_workers = max(1, min(num_workers, len(target_cases)))
+
+    workers = []
+    for worker_id in range(num_workers):
+        t = threading.Thread(
+            target=_parallel_worker,
+            args=(worker_id, case_queue, results, results_lock, logger.session_dir, stop_event, launch_mode, checkpoint,
+                  shard_index, num_shards),
+            name=f"TestWorker-{worker_id}"
+        )
+        t.start()
+        workers.append(t)
+
+    try:
+        # 用 timeout join，讓主執行緒仍可接收 Ctrl-C
+        while any(t.is_alive() for t in workers):
+            for t in workers:
+                t.join(timeout=0.5)
+    except KeyboardInterrupt:
+        print("\n⛔ 測試被用戶手動中斷！等待各 Worker 完成當前案例...")
+        stop_event.set()
+        for t in workers:
+            t.join()
+
+    if not case_queue.empty():
+        print(f"⚠️ 尚有 {case_queue.qsize()} 個案例未執行 (Worker 全數退出或被中斷)。")
+    return results
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Agent Benchmark Runner")
+    parser.add_argument("--workers", type=int, default=1, help="平行瀏覽器數量 (1 = Singleton Driver Mode)")
+    parser.add_argument("--dataset", type=str, default=DEFAULT_DATASET, help="測試集 JSON 路徑")
+    parser.add_argument("--server", action="store_true", help="使用 new-headless 伺服器模式啟動瀏覽器")
+    # [New] 篩選 / 分片 / 續跑 / 合併
+    parser.add_argument("--sites", type=str, default="", help="只跑這些 web_name (逗號分隔)")
+    parser.add_argument("--ids", type=str, default="", help="只跑這些案例 ID (逗號分隔，支援 * ? 萬用字元)")
+    parser.add_argument("--limit", type=int, default=None, help="篩選後最多跑幾題")
+    parser.add_argument("--num-shards", type=int, default=1,
+                        help="總分片數 (跨行程 / 跨機器)；每個分片使用自己的 Chrome Profile 與 Skill / 計畫快取檔")
+    parser.add_argument("--shard-index", type=int, default=0, help="本行程負責的分片 (0 ~ num-shards-1)")
+    parser.add_argument("--checkpoint", type=str, default=None, help="逐題結果 JSONL 路徑 (預設依測試集與分片命名)")
+    parser.add_argument("--resume", action="store_true", help="略過 Checkpoint 中已完成的案例")
+    parser.add_argument("--merge", nargs="+", default=None, metavar="CHECKPOINT",
+                        help="不執行測試，只合併多個分片的 Checkpoint (支援萬用字元) 並輸出報告")
+    return parser.parse_args()
+
+def merge_checkpoints(patterns):
+    """ [New] 合併各分片的 Checkpoint，輸出與一般執行相同的報告 """
+    paths = sorted({path for pattern in patterns for path in (glob.glob(pattern) or [pattern])})
+    results = load_checkpoint_results(paths)
+    print(f"🧩 合併 {len(paths)} 個 Checkpoint，共 {len(results)} 題")
+    logger.save_session_report(results, meta={"merged_from": paths})
+    analyze_results(results)
+
+# 5. [Modified] 主程式：Singleton 模式只啟動一次瀏覽器；平行模式啟動 N 個
 if __name__ == "__main__":
-    print("🧪 [Automated Test Suite] Starting (Singleton Driver Mode)...")
-    
+    args = parse_arguments()
+    if args.merge:
+        merge_checkpoints(args.merge)
+        sys.exit(0)
+
+    if not (0 <= args.shard_index < max(1, args.num_shards)):
+        print(f"❌ --shard-index 必須介於 0 ~ {args.num_shards - 1}")
+        sys.exit(1)
+
+    TEST_CASES = load_test_cases(args.dataset)
     if not TEST_CASES:
         print("❌ No test cases found. Exiting.")
         sys.exit(1)
 
-    # 在最外層初始化瀏覽器
-    main_driver = initialize_agent()
-    
-    if not main_driver:
-        print("❌ Fatal: Could not start browser.")
-        sys.exit(1)
+    target_cases = filter_test_cases(TEST_CASES,
+                                     sites=[s.strip() for s in args.sites.split(",") if s.strip()],
+                                     ids=[i.strip() for i in args.ids.split(",") if i.strip()],
+                                     limit=args.limit)
+    target_cases = shard_test_cases(target_cases, args.shard_index, args.num_shards)
 
-    results = []
-    
-    try:
-        # 你可以調整這裡，例如只跑前 5 個測試
-        # target_cases = TEST_CASES[:5] 
-        target_cases = TEST_CASES
+    checkpoint = CaseCheckpoint(args.checkpoint or default_checkpoint_path(args.dataset, args.shard_index, args.num_shards))
+    previous_results = []
+    if args.resume:
+        target_ids = {c['id'] for c in target_cases}
+        previous_results = [r for r in checkpoint.load() if r['id'] in target_ids]
+        done_ids = {r['id'] for r in previous_results}
+        target_cases = [c for c in target_cases if c['id'] not in done_ids]
+        print(f"⏩ 續跑：Checkpoint 中已完成 {len(done_ids)} 題，略過。")
+    print(f"📋 預計執行 {len(target_cases)} 個測試案例 (分片 {args.shard_index + 1}/{args.num_shards}，Checkpoint: {checkpoint.path})...")
+
+    launch_mode = "server" if args.server else None
+    use_shard_local_stores(args.shard_index, args.num_shards)
 
-        print(f"📋 預計執行 {len(target_cases)} 個測試案例...")
+    if args.workers > 1:
+        print(f"🧪 [Automated Test Suite] Starting (Parallel Mode, {args.workers} workers)...")
+        results = run_parallel(target_cases, args.workers, launch_mode=launch_mode, checkpoint=checkpoint,
+                               shard_index=args.shard_index, num_shards=args.num_shards)
+    else:
+        print("🧪 [Automated Test Suite] Starting (Singleton Driver Mode)...")
+
+        # 在最外層初始化瀏覽器
+        main_driver = initialize_agent(profile_name=shard_profile_name(args.shard_index, args.num_shards),
+                                       launch_mode=launch_mode, startup_url=None)
         
-        for case in target_cases:
-            # [Core Change] 把 main_driver 傳進去，而不是在裡面 init
-            is_pass = run_single_test(case, main_driver)
-            status = "PASS" if is_pass else "FAIL"
-            
-            results.append({
-                "id": case['id'],
-                "web_name": case['web_name'],
-                "status": status
-            })
-            
-            # 測試間短暫休息，讓網頁有時間喘息或 GC
-            time.sleep(2) 
+        if not main_driver:
+            print("❌ Fatal: Could not start browser.")
+            sys.exit(1)
 
-    except KeyboardInterrupt:
-        print("\n⛔ 測試被用戶手動中斷！")
-    
-    finally:
-        # [Final Cleanup] 所有測試跑完後，才關閉瀏覽器
-        print("🔻 [System] 所有測試結束，正在關閉瀏覽器...")
+        results = []
+        
         try:
-            main_driver.quit()
-            # Windows 強制清理 (保險起見)
-            if sys.platform == "win32":
-                try:
-                    if hasattr(main_driver, 'service') and main_driver.service.process:
-                        os.system(f"taskkill /F /PID {main_driver.service.process.pid} /T >nul 2>&1")
-                except: pass
-        except Exception as e:
-            print(f"⚠️ 關閉時發生錯誤: {e}")
+            for case in target_cases:
+                # [Core Change] 把 main_driver 傳進去，而不是在裡面 init
+                is_pass = run_single_test(case, main_driver)
+                status = "PASS" if is_pass else "FAIL"
+                
+                result = {
+                    "id": case['id'],
+                    "web_name": case['web_name'],
+                    "status": status
+                }
+                results.append(result)
+                checkpoint.append(result)
+                
+                # 測試間短暫休息，讓網頁有時間喘息或 GC
+                time.sleep(2) 
+
+        except KeyboardInterrupt:
+            print("\n⛔ 測試被用戶手動中斷！")
+        
+        finally:
+            # [Final Cleanup] 所有測試跑完後，才關閉瀏覽器
+            print("🔻 [System] 所有測試結束，正在關閉瀏覽器...")
+            shutdown_driver(main_driver)
+
+    # 等待背景記憶寫入完成 (成功經驗 / 失敗反思)
+    memory_writer.flush_all()
+
+    # 計畫快取命中率 (樣板化目標越多，省下的 Planner 呼叫越多)
+    results = previous_results + results # 續跑時合併先前已完成的案例
+    meta = {"dataset": args.dataset, "workers": args.workers, "shard": f"{args.shard_index}/{args.num_shards}",
+            "checkpoint": checkpoint.path,
+            # case log 的 network.blocked_bytes_estimate 是估算值 (被封鎖的請求沒有下載，無法量測)
+            "network_blocked_bytes": BYTES_ESTIMATE_METHOD}
+    if PLAN_CACHE_ENABLED:
+        meta["plan_cache"] = plan_cache.get_shared_plan_cache().summary()
+        print(f"📋 [PlanCache] {meta['plan_cache']}")
+
+    # 合併報告 (平行模式下各 Worker 的 case log 已寫入同一個 session 資料夾)
+    logger.save_session_report(results, meta=meta)
 
     # 執行最後分析
     analyze_results(results)
\ No newline at end of file
@@ -6,7 +6,12 @@ import json
 from PIL import Image, ImageDraw, ImageFont
 import io
 import re
+import difflib
 import base64
+import numpy as np
+from urllib.parse import urlparse
+from element_map import ElementMap
+from config import DEBUG_OMNI_PARSER
 
 def draw_som_on_image(screenshot_bytes, elements_data):
     """
@@ -27,15 +32,15 @@ def draw_som_on_image(screenshot_bytes, elements_data):
             font = ImageFont.load_default()
 
         # 2. 繪製標籤
-        for el in elements_data:
-            el_id = str(el['id'])
-            x, y, w, h = el['x'], el['y'], el['w'], el['h']
-            
-            # 確保不畫出界
-            if x < 0 or y < 0 or x > width or y > height: continue
+        # [Updated] 座標一次取成陣列，畫面外的元素以遮罩過濾 (不再逐一判斷)
+        emap = ElementMap.wrap(elements_data)
+        visible = np.flatnonzero(emap.in_bounds_mask(width, height))
+        corners = emap.corners()[visible].astype(int).tolist()
+        for i, (x, y, x2, y2) in zip(visible.tolist(), corners):
+            el_id = str(emap[i]['id'])
 
             # 畫紅框
-            draw.rectangle([x, y, x + w, y + h], outline="red", width=2)
+            draw.rectangle([x, y, x2, y2], outline="red", width=2)
             
             # 畫標籤背景 (黃底)
             text_bbox = draw.textbbox((0, 0), el_id, font=font)
@@ -93,6 +98,70 @@ def sanitize_history(history: list) -> list:
         
     return sanitized
 
+def extract_site(url: str) -> str:
+    """ 取出網域 (去掉 www.)，例如 https://www.amazon.com/s?k=x -> amazon.com """
+    try:
+        host = urlparse(url or "").hostname or ""
+    except Exception:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+def goal_similarity(goal_a: str, goal_b: str) -> float:
+    """ 以單字序列比對兩個目標的相似度 (0~1)，不分大小寫 """
+    return difflib.SequenceMatcher(None, goal_a.lower().split(), goal_b.lower().split()).ratio()
+
+def goal_slot_diff(old_goal: str, new_goal: str) -> list | None:
+    """
+    [New] 新舊目標的實體差異 [(舊片段, 新片段), ...] (例如 lasagna -> pizza, 4.5 -> 4)。
+    有新增或刪除的字 (例如 "iPhone 15" -> "iPhone 15 Pro"、多了 "without cheese") 時回傳 None：
+    這類差異無法以替換表達，沿用舊的計畫 / 動作會做錯事。
+    """
+    old_words, new_words = old_goal.split(), new_goal.split()
+    matcher = difflib.SequenceMatcher(None, [w.lower() for w in old_words], [w.lower() for w in new_words])
+    replacements = []
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal": continue
+        if op != "replace": return None
+        old_span = " ".join(old_words[i1:i2]).strip(".,?!\"'")
+        new_span = " ".join(new_words[j1:j2]).strip(".,?!\"'")
+        if not old_span or not new_span: return None
+        if old_span.lower() != new_span.lower():
+            replacements.append((old_span, new_span))
+    return replacements
+
+def _span_variants(span: str) -> list:
+    """ 片段本身 + 網址中的空白寫法 """
+    return list(dict.fromkeys([span, span.replace(" ", "+"), span.replace(" ", "%20")]))
+
+def _span_pattern(span: str) -> str:
+    # 前後不能緊接英數字：把 "4" 換成 "2" 時不會動到 "$40"
+    return r"(?<!\w)" + re.escape(span) + r"(?!\w)"
+
+def goal_slots_covered(texts: list, replacements: list) -> bool:
+    """ [New] 每個舊片段都至少出現在其中一段文字裡 (整個單字比對)；否則替換後仍會殘留舊目標的實體 """
+    joined = "\n".join(t for t in texts if isinstance(t, str))
+    return all(any(re.search(_span_pattern(v), joined, flags=re.IGNORECASE) for v in _span_variants(old))
+               for old, _ in replacements)
+
+def substitute_goal_slots(text: str, old_goal: str, new_goal: str, replacements: list = None) -> str:
+    """
+    [Updated] 樣板化目標的實體替換：把 text 中出現的舊片段換成新片段。text 可以是計畫、輸入值或網址。
+    [Fix] 只換完整單字，且所有片段一次替換 (NYC <-> LA 互換時不會互相覆蓋)。
+    replacements: 預先算好的 goal_slot_diff 結果；有新增 / 刪除 (None) 時原文不動，由呼叫端決定是否採用。
+    """
+    if not text or old_goal == new_goal: return text
+    if replacements is None:
+        replacements = goal_slot_diff(old_goal, new_goal)
+    if not replacements: return text
+    mapping = {}
+    for old_span, new_span in replacements:
+        for old_v, new_v in zip(_span_variants(old_span), _span_variants(new_span)):
+            mapping.setdefault(old_v.lower(), new_v)
+    # 長的片段優先 (避免 "4" 先吃掉 "4.5")
+    alternatives = sorted(mapping, key=len, reverse=True)
+    pattern = re.compile("|".join(_span_pattern(old) for old in alternatives), flags=re.IGNORECASE)
+    return pattern.sub(lambda m: mapping[m.group(0).lower()], text)
+
 def get_image_dimensions(image_bytes: bytes) -> tuple:
     try:
         image = Image.open(io.BytesIO(image_bytes))
@@ -194,17 +263,17 @@ def parse_json_from_string(text: str) -> dict | list | None:
 def _parse_legacy_label_coordinates(omni_data: dict, image_size: tuple) -> list:
     """
     [Debug] 增強版解析器，強制印出原始資料以供除錯。
+    [Updated] 原始資料只在 DEBUG_OMNI_PARSER 開啟時印出
     """
     if not omni_data:
         return []
 
-    # [Debug] 強制印出 OmniParser 回傳的 Keys 和部分內容，找出為什麼是空的
-    # 請在執行時觀察這行 Log！
-    print(f"🔍 [OmniParser Raw Debug] Keys: {omni_data.keys()}")
-    if 'label_coordinates' in omni_data:
-        print(f"🔍 [OmniParser Raw Debug] label_coordinates count: {len(omni_data['label_coordinates'])}")
-    else:
-        print(f"🔍 [OmniParser Raw Debug] Content: {str(omni_data)[:200]}")
+    if DEBUG_OMNI_PARSER:
+        print(f"🔍 [OmniParser Raw Debug] Keys: {omni_data.keys()}")
+        if 'label_coordinates' in omni_data:
+            print(f"🔍 [OmniParser Raw Debug] label_coordinates count: {len(omni_data['label_coordinates'])}")
+        else:
+            print(f"🔍 [OmniParser Raw Debug] Content: {str(omni_data)[:200]}")
 
     raw_items = omni_data.get('label_coordinates', [])
     if not raw_items and 'data' in omni_data:
@@ -238,16 +307,55 @@ def _parse_legacy_label_coordinates(omni_data: dict, image_size: tuple) -> list:
 
     return parsed_elements
 
+# [New] parsed_content 單行格式: "icon 3: {'type': 'text', 'bbox': [0.03, 0.03, 0.07, 0.08], 'interactivity': True, 'content': 'Back'}"
+# 只取需要的 bbox / content 兩個欄位，不對整個 dict 做 ast.literal_eval
+_OMNI_BBOX_RE = re.compile(r"'bbox':\s*\[([^\]]*)\]")
+_OMNI_CONTENT_RE = re.compile(r"""'content':\s*('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|None)""")
+
+def _parse_omni_line(line: str):
+    """ 回傳 (bbox, content)；格式不符時回傳 None """
+    bbox_match = _OMNI_BBOX_RE.search(line)
+    if not bbox_match: return None
+    bbox = bbox_match.group(1).split(',')
+    if len(bbox) != 4: return None
+    content_match = _OMNI_CONTENT_RE.search(line)
+    # 與舊版 literal_eval 解析一致：沒有 content 欄位 -> "UI Element"；content 為 None -> "None"
+    raw = content_match.group(1) if content_match else "'UI Element'"
+    if raw == "None":
+        content = None
+    elif '\\' in raw:
+        content = ast.literal_eval(raw) # 含跳脫字元時才交給 ast 還原
+    else:
+        content = raw[1:-1]
+    return [float(v) for v in bbox], content
+
+def _normalized_boxes_to_elements(bboxes: list, contents: list, image_size: tuple) -> list:
+    """ [New] Normalized BBox (0-1, [xmin, ymin, xmax, ymax]) 一次換算為截圖像素，並過濾太小的元素 """
+    if not bboxes: return []
+    img_w, img_h = image_size
+    # 這裡算出的是截圖上的物理像素 (Retina下是高解析度的)
+    pixels = (np.asarray(bboxes, dtype=np.float64) * [img_w, img_h, img_w, img_h]).astype(np.int64)
+    sizes = pixels[:, 2:] - pixels[:, :2]
+    keep = np.flatnonzero((sizes[:, 0] >= 5) & (sizes[:, 1] >= 5))
+    return [{
+        "id": n + 1,
+        "x": x, "y": y, "w": w, "h": h,
+        "tag": "vision_el",
+        "text": str(contents[i])
+    } for n, (i, (x, y), (w, h)) in enumerate(zip(keep.tolist(), pixels[keep, :2].tolist(), sizes[keep].tolist()))]
+
 def convert_omni_data_to_elements(omni_data: dict, image_size: tuple) -> list:
     """
     [Fixed] 依照 omni_test.py 的邏輯重寫。
     解析 'parsed_content' 字串欄位，並將 Normalized BBox (0-1) 轉為 Absolute Pixels。
+    [Updated] 以預先編譯的 Regex 取出 bbox / content，座標換算改為陣列運算；
+              若伺服器直接回傳 dict 清單 (parsed_content_list) 則不需解析字串。
     """
     if not omni_data:
         return []
 
     # 1. 優先讀取 parsed_content (這是 omni_test.py 成功的關鍵)
-    content_str = omni_data.get('parsed_content', [])
+    content_str = omni_data.get('parsed_content_list') or omni_data.get('parsed_content', [])
     
     # 如果 parsed_content 是空的，才去檢查 label_coordinates (相容性)
     if not content_str:
@@ -256,60 +364,32 @@ def convert_omni_data_to_elements(omni_data: dict, image_size: tuple) -> list:
 
     # 2. 開始解析 parsed_content
     # 格式範例: "icon {'bbox': [0.03, 0.03, 0.07, 0.08], 'interactivity': True, 'content': 'Back'}"
-    parsed_elements = []
-    img_w, img_h = image_size
-    
-    # 將內容按行分割
+    bboxes, contents = [], []
     if isinstance(content_str, list): # 有些版本直接回傳 list string
         lines = content_str
     else:
         lines = str(content_str).strip().split('\n')
 
-    index = 1
     for line in lines:
+        if isinstance(line, dict): # 結構化格式
+            bbox = line.get('bbox') or []
+            if len(bbox) == 4:
+                bboxes.append(bbox)
+                contents.append(line.get('content', 'UI Element'))
+            continue
         line = line.strip()
         # 只處理 icon 開頭的行
-        if line.startswith('icon '):
-            try:
-                # 提取花括号中的内容
-                dict_str = line[line.index('{'):line.rindex('}') + 1]
-                # 使用 ast 解析字符串為字典
-                icon_data = ast.literal_eval(dict_str)
-                
-                # 提取資料
-                bbox = icon_data.get('bbox', []) # [ymin, xmin, ymax, xmax] 或 [xmin, ymin, xmax, ymax]
-                content = icon_data.get('content', 'UI Element')
-                
-                # 根據 omni_test.py，bbox 是 [xmin, ymin, xmax, ymax] 且是 0-1 的比例
-                if len(bbox) == 4:
-                    xmin, ymin, xmax, ymax = bbox
-                    
-                    # [關鍵轉換] Normalized -> Absolute Pixels
-                    # 這裡算出的是截圖上的物理像素 (Retina下是高解析度的)
-                    abs_x1 = int(xmin * img_w)
-                    abs_y1 = int(ymin * img_h)
-                    abs_x2 = int(xmax * img_w)
-                    abs_y2 = int(ymax * img_h)
-                    
-                    w = abs_x2 - abs_x1
-                    h = abs_y2 - abs_y1
-                    
-                    # 過濾太小的元素
-                    if w < 5 or h < 5: continue
-
-                    parsed_elements.append({
-                        "id": index,
-                        "x": abs_x1,
-                        "y": abs_y1,
-                        "w": w,
-                        "h": h,
-                        "tag": "vision_el",
-                        "text": str(content)
-                    })
-                    index += 1
-            except Exception as e:
-                print(f"⚠️ 解析 Omni 行失敗: {line} | Error: {e}")
-                continue
+        if not line.startswith('icon '): continue
+        try:
+            parsed = _parse_omni_line(line)
+        except (ValueError, SyntaxError) as e:
+            parsed = None
+            if DEBUG_OMNI_PARSER: print(f"⚠️ 解析 Omni 行失敗: {line} | Error: {e}")
+        if parsed:
+            bboxes.append(parsed[0])
+            contents.append(parsed[1])
 
-    print(f"🔍 [Utils] 成功從 parsed_content 解析出 {len(parsed_elements)} 個元素")
-    return parsed_elements
\ No newline at end of file
+    parsed_elements = _normalized_boxes_to_elements(bboxes, contents, image_size)
+    if DEBUG_OMNI_PARSER:
+        print(f"🔍 [Utils] 成功從 parsed_content 解析出 {len(parsed_elements)} 個元素")
+    return parsed_elements
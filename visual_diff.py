@@ -0,0 +1,160 @@
+# visual_diff.py
+# [New] 降採樣灰階視覺比對引擎
+# 職責：判斷兩張截圖的差異比例，並回傳「哪裡變了」(變動區塊的 Bounding Box)
+
+import io
+import time
+import numpy as np
+from PIL import Image
+
+DIFF_DOWNSAMPLE = 4      # 每邊縮小倍率 (2x 螢幕 3840x2160 -> 960x540)
+PIXEL_THRESHOLD = 15     # 灰階差異 <= 15 視為壓縮雜訊
+BLOCK_SIZE = 8           # 變動區塊的格子大小 (以降採樣後的像素計)
+BLOCK_MIN_RATIO = 0.1    # 格子內超過 10% 像素變動才算「變動格」
+
+
+class VisualFrame:
+    """
+    已解碼、降採樣後的灰階畫面。
+    建立一次後可重複比對 (例如點擊前、點擊後、重試後)，不必每次重新解碼 PNG。
+    """
+    def __init__(self, png_bytes: bytes, factor: int = DIFF_DOWNSAMPLE):
+        image = Image.open(io.BytesIO(png_bytes))
+        self.size = image.size # 原始像素尺寸 (用於換算 Bounding Box)
+        self.factor = factor
+        # [Fix] reduce() 不支援調色盤 (P) 等模式：先直接轉灰階 (每像素 1 byte，仍比 RGB 省)
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("L")
+        # 先在原色彩空間做 box 縮小，再轉灰階：大圖只存在於解碼當下
+        small = image.reduce(factor) if factor > 1 else image
+        self.pixels = np.asarray(small.convert("L"), dtype=np.uint8)
+
+
+def _connected_regions(block_mask: np.ndarray) -> list:
+    """ 對變動格做 4-連通分群，回傳每群的 (row0, col0, row1, col1) (含頭不含尾) """
+    rows, cols = block_mask.shape
+    visited = np.zeros_like(block_mask, dtype=bool)
+    regions = []
+    for r, c in zip(*np.nonzero(block_mask)):
+        if visited[r, c]: continue
+        stack = [(r, c)]
+        visited[r, c] = True
+        r0, c0, r1, c1 = r, c, r, c
+        while stack:
+            y, x = stack.pop()
+            r0, c0, r1, c1 = min(r0, y), min(c0, x), max(r1, y), max(c1, x)
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < rows and 0 <= nx < cols and block_mask[ny, nx] and not visited[ny, nx]:
+                    visited[ny, nx] = True
+                    stack.append((ny, nx))
+        regions.append((r0, c0, r1 + 1, c1 + 1))
+    return regions
+
+
+def diff_frames(prev: VisualFrame, curr: VisualFrame, pixel_threshold: int = PIXEL_THRESHOLD,
+                block_size: int = BLOCK_SIZE, block_min_ratio: float = BLOCK_MIN_RATIO, with_regions: bool = True) -> dict:
+    """
+    回傳: {"change_ratio": 0.0~100.0, "regions": [{"x","y","w","h"}, ...]}
+    regions 為原始截圖的像素座標，依面積由大到小排序。
+    with_regions=False 時只算變動比例 (點擊驗證只看比例，略過分群的成本)，regions 為空清單。
+    """
+    a, b = prev.pixels, curr.pixels
+    if a.shape != b.shape:
+        # Retina 螢幕有時候會有微小誤差，取共同區域比較
+        h, w = min(a.shape[0], b.shape[0]), min(a.shape[1], b.shape[1])
+        a, b = a[:h, :w], b[:h, :w]
+
+    changed = np.abs(a.astype(np.int16) - b.astype(np.int16)) > pixel_threshold
+    change_ratio = float(changed.mean() * 100) if changed.size else 0.0
+    if change_ratio == 0.0 or not with_regions:
+        return {"change_ratio": change_ratio, "regions": []}
+
+    # 補齊成 block_size 的倍數後，計算每格的變動比例
+    h, w = changed.shape
+    pad_h, pad_w = (-h) % block_size, (-w) % block_size
+    padded = np.pad(changed, ((0, pad_h), (0, pad_w)))
+    grid = padded.reshape(padded.shape[0] // block_size, block_size, padded.shape[1] // block_size, block_size)
+    block_mask = grid.mean(axis=(1, 3)) > block_min_ratio
+
+    scale = block_size * prev.factor
+    full_w, full_h = prev.size
+    regions = []
+    for r0, c0, r1, c1 in _connected_regions(block_mask):
+        x, y = c0 * scale, r0 * scale
+        regions.append({
+            "x": int(x), "y": int(y),
+            "w": int(min(c1 * scale, full_w) - x),
+            "h": int(min(r1 * scale, full_h) - y)
+        })
+    regions.sort(key=lambda reg: reg["w"] * reg["h"], reverse=True)
+    return {"change_ratio": change_ratio, "regions": regions}
+
+
+def diff_png(png_bytes_1: bytes, png_bytes_2: bytes) -> dict:
+    return diff_frames(VisualFrame(png_bytes_1), VisualFrame(png_bytes_2))
+
+
+def legacy_diff_ratio(img_bytes_1: bytes, img_bytes_2: bytes) -> float:
+    """ 舊版實作 (全解析度 RGB int16)，僅保留給 benchmark 對照 """
+    img1 = Image.open(io.BytesIO(img_bytes_1)).convert("RGB")
+    img2 = Image.open(io.BytesIO(img_bytes_2)).convert("RGB")
+    if img1.size != img2.size:
+        img2 = img2.resize(img1.size)
+    arr1 = np.array(img1, dtype=np.int16)
+    arr2 = np.array(img2, dtype=np.int16)
+    diff = np.abs(arr1 - arr2)
+    mask = np.any(diff > 15, axis=-1)
+    return np.sum(mask) / mask.size * 100
+
+
+def _synthetic_frames(width=3840, height=2160):
+    """ 產生兩張 2x 螢幕大小的測試截圖 (第二張多了一個下拉選單) """
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, size=(height // 40, width // 40, 3), dtype=np.uint8)
+    before = Image.fromarray(base).resize((width, height), Image.NEAREST)
+    after = before.copy()
+    after.paste((255, 255, 255), (600, 300, 1400, 1100))
+    frames = []
+    for img in (before, after):
+        buffered = io.BytesIO()
+        img.save(buffered, format="PNG")
+        frames.append(buffered.getvalue())
+    return frames
+
+
+def benchmark(png_1: bytes = None, png_2: bytes = None, rounds: int = 5):
+    import tracemalloc
+    if png_1 is None or png_2 is None:
+        png_1, png_2 = _synthetic_frames()
+
+    def measure(fn):
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = fn()
+        elapsed = (time.perf_counter() - start) / rounds
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, elapsed, peak
+
+    legacy, t_legacy, m_legacy = measure(lambda: legacy_diff_ratio(png_1, png_2))
+    new, t_new, m_new = measure(lambda: diff_png(png_1, png_2))
+    prev_frame = VisualFrame(png_1)
+    reused, t_reuse, m_reuse = measure(lambda: diff_frames(prev_frame, VisualFrame(png_2)))
+
+    print(f"{'Engine':<28} | {'Ratio %':>8} | {'Time (ms)':>10} | {'Peak numpy MB':>13}")
+    print("-" * 70)
+    print(f"{'legacy (RGB int16)':<28} | {legacy:>8.2f} | {t_legacy * 1000:>10.1f} | {m_legacy / 1e6:>13.1f}")
+    print(f"{'downsampled gray':<28} | {new['change_ratio']:>8.2f} | {t_new * 1000:>10.1f} | {m_new / 1e6:>13.1f}")
+    print(f"{'downsampled + reused prev':<28} | {reused['change_ratio']:>8.2f} | {t_reuse * 1000:>10.1f} | {m_reuse / 1e6:>13.1f}")
+    print(f"Regions: {new['regions'][:3]}")
+
+
+if __name__ == "__main__":
+    import sys
+    # 用法: python visual_diff.py [before.png after.png]
+    if len(sys.argv) == 3:
+        with open(sys.argv[1], "rb") as f1, open(sys.argv[2], "rb") as f2:
+            benchmark(f1.read(), f2.read())
+    else:
+        benchmark()